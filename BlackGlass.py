@@ -5,22 +5,52 @@ import asyncio
 if sys.platform == 'win32':
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+import os
 import time
+import atexit
+import bisect
+import csv
+import dataclasses
+import gzip
+import queue
+import sqlite3
+import tempfile
 import threading
+import traceback
+import types
 import json
-import base64
+import hashlib
+import heapq
+import itertools
 import math
 import random
 import re
 import uuid as _uuid
-import urllib.request
 import urllib.parse
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import aiohttp
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Hippolyzer Core Imports
 from hippolyzer.lib.base.message.message import Message, Block
+from hippolyzer.lib.base.message.message_handler import MessageHandler
+from hippolyzer.lib.base.message.circuit import ReliableResendInfo
+from hippolyzer.lib.base.objects import Object
 from hippolyzer.lib.base.datatypes import Vector3, Quaternion, UUID
-from hippolyzer.lib.base.templates import ChatType, ChatSourceType, IMDialogType
+from hippolyzer.lib.base.templates import ChatType, ChatSourceType, IMDialogType, PCode
+from hippolyzer.lib.client.object_manager import ObjectUpdateType, ObjectEvent
 from hippolyzer.lib.client.hippo_client import HippoClient, StartLocation
 
 # ==========================================
@@ -57,117 +87,2046 @@ class SmartParser:
 # SECTION 2: SHARED STATE & Q-LEARNING
 # ==========================================
 
-class LimitedList:
-    """Thread-safe wrapped list (Prevents NoneType C-struct inheritance crashes)."""
-    def __init__(self, limit=200):
-        self.limit = limit
-        self.data = []
+@dataclasses.dataclass(slots=True)
+class Vec3:
+    """A position; published instances are never mutated."""
+    x: float
+    y: float
+    z: float
+
+@dataclasses.dataclass(slots=True)
+class SimView:
+    """The agent's "stats" section: sim rate, time dilation and our position."""
+    fps: float
+    dilation: float
+    pos: Vec3
+
+@dataclasses.dataclass(slots=True)
+class LogRecord:
+    """One line of the message log (or a bulk-login progress event)."""
+    seq: int
+    time: str
+    text: str
+    type: str
+    meta: dict = None
+
+@dataclasses.dataclass(slots=True)
+class AvatarSample:
+    """A nearby avatar as published; `seen` is when it last moved or was renamed."""
+    id: str
+    name: str
+    x: float
+    y: float
+    z: float
+    seen: float
+
+def _json_default(obj):
+    if dataclasses.is_dataclass(obj): return {f: getattr(obj, f) for f in obj.__slots__}
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+def dumps(obj):
+    """API payload as JSON bytes. orjson (when installed) encodes the slots records directly;
+    the stdlib fallback expands each one as it is written."""
+    if orjson is not None: return orjson.dumps(obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_json_default).encode("utf-8")
+
+class RingBuffer:
+    """Fixed-capacity ring of seq-ordered records: O(1) append, O(log n) seek by seq."""
+    __slots__ = ("capacity", "slots", "start", "size")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.start = 0
+        self.size = 0
+
+    def __len__(self): return self.size
+
+    def __getitem__(self, i):
+        return self.slots[(self.start + i) % self.capacity]
+
     def append(self, item):
-        self.data.append(item)
-        if len(self.data) > self.limit:
-            self.data.pop(0)
+        if self.size < self.capacity:
+            self.slots[(self.start + self.size) % self.capacity] = item
+            self.size += 1
+        else:
+            self.slots[self.start] = item
+            self.start = (self.start + 1) % self.capacity
+
+    def oldest_seq(self):
+        return self[0].seq if self.size else None
+
+    def since(self, seq):
+        """Records with seq > `seq`, oldest first; only the matching tail is copied."""
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid].seq <= seq: lo = mid + 1
+            else: hi = mid
+        return [self[i] for i in range(lo, self.size)]
+
+    def last(self, k, pred=None):
+        """Newest-last list of up to k records matching pred, scanning back from the head."""
+        out = []
+        i = self.size - 1
+        while i >= 0 and len(out) < k:
+            item = self[i]
+            if pred is None or pred(item): out.append(item)
+            i -= 1
+        out.reverse()
+        return out
+
+class MessageLog:
+    """Per-channel rings so chatty local chat can't evict IMs or system lines."""
+    CHANNELS = {"chat": ("chat", "chat_own"), "im": ("im",), "system": ("system", "error", "success", "info")}
+    DEFAULT_CAPACITY = {"chat": 200, "im": 200, "system": 100}
+    MAX_PEERS = 1024
+    PEER_DEPTH = 50
+
+    def __init__(self, capacities=None):
+        caps = dict(self.DEFAULT_CAPACITY, **(capacities or {}))
+        self.rings = {name: RingBuffer(caps[name]) for name in self.CHANNELS}
+        self.type_channel = {t: name for name, types in self.CHANNELS.items() for t in types}
+        self.peers = OrderedDict()    # IM partner id -> deque of that conversation's records
+
+    def channel_of(self, msg_type):
+        return self.type_channel.get(msg_type, "system")
+
+    def append(self, msg):
+        channel = self.channel_of(msg.type)
+        self.rings[channel].append(msg)
+        if channel == "im":
+            meta = msg.meta or {}
+            peer = meta.get("id") or meta.get("to")
+            if peer:
+                convo = self.peers.pop(peer, None) or deque(maxlen=self.PEER_DEPTH)
+                convo.append(msg)
+                self.peers[peer] = convo
+                if len(self.peers) > self.MAX_PEERS: self.peers.popitem(last=False)
+
+    def since(self, seq, channels=None):
+        """Everything after `seq` across the selected channels, merged in seq order."""
+        parts = [self.rings[c].since(seq) for c in (channels or self.rings)]
+        parts = [p for p in parts if p]
+        if len(parts) == 1: return parts[0]
+        return sorted((m for p in parts for m in p), key=lambda m: m.seq)
+
+    def last(self, k, channel="im", peer=None):
+        """Newest k records of a channel, or of one IM conversation when `peer` is given."""
+        if peer is None: return self.rings[channel].last(k)
+        convo = self.peers.get(peer)
+        if not convo: return []
+        # Conversation entries older than the IM ring's tail have been evicted
+        oldest = self.rings["im"].oldest_seq() or 0
+        return [m for m in list(convo)[-k:] if m.seq >= oldest]
+
     def as_list(self):
-        return list(self.data)
+        return self.since(0)
+
+def merge_avatar_deltas(deltas):
+    """Folds a run of {add, move, remove} avatar deltas into one equivalent delta."""
+    state = {}
+    for d in deltas:
+        for rec in d["add"]:
+            prev = state.get(rec.id)
+            state[rec.id] = ("move" if prev and prev[0] == "remove" else "add", rec)
+        for rec in d["move"]:
+            prev = state.get(rec.id)
+            state[rec.id] = ("add" if prev and prev[0] == "add" else "move", rec)
+        for av_id in d["remove"]:
+            prev = state.get(av_id)
+            if prev and prev[0] == "add": del state[av_id]
+            else: state[av_id] = ("remove", None)
+    out = {"add": [], "move": [], "remove": []}
+    for av_id, (kind, rec) in state.items():
+        out[kind].append(av_id if kind == "remove" else rec)
+    return out
+
+class SpatialGrid:
+    """Uniform bucket grid over a region for radius and k-nearest queries on avatar positions."""
+    def __init__(self, cell_size=16.0, region_size=256.0):
+        self.cell_size = cell_size
+        self.max_cell = int(region_size // cell_size) - 1
+        self.lock = threading.Lock()
+        self.cells = {}      # (cx, cy) -> set of ids
+        self.points = {}     # id -> (x, y, z, cell)
+
+    def _cell(self, x, y):
+        # Avatars just over a region edge are folded into the border cells
+        cx = min(max(int(x // self.cell_size), 0), self.max_cell)
+        cy = min(max(int(y // self.cell_size), 0), self.max_cell)
+        return cx, cy
+
+    def update(self, key, x, y, z):
+        cell = self._cell(x, y)
+        with self.lock:
+            old = self.points.get(key)
+            if old is not None and old[3] != cell:
+                bucket = self.cells[old[3]]
+                bucket.discard(key)
+                if not bucket: del self.cells[old[3]]
+            if old is None or old[3] != cell:
+                self.cells.setdefault(cell, set()).add(key)
+            self.points[key] = (x, y, z, cell)
+
+    def remove(self, key):
+        with self.lock:
+            old = self.points.pop(key, None)
+            if old is None: return
+            bucket = self.cells[old[3]]
+            bucket.discard(key)
+            if not bucket: del self.cells[old[3]]
+
+    def clear(self):
+        with self.lock:
+            self.cells.clear(); self.points.clear()
+
+    def _ring(self, cx, cy, ring):
+        """Cells at Chebyshev distance `ring` from (cx, cy)."""
+        if ring == 0:
+            yield cx, cy; return
+        for dx in range(-ring, ring + 1):
+            yield cx + dx, cy - ring
+            yield cx + dx, cy + ring
+        for dy in range(-ring + 1, ring):
+            yield cx - ring, cy + dy
+            yield cx + ring, cy + dy
+
+    def _scan(self, x, y, z, cells):
+        out = []
+        for cell in cells:
+            for key in self.cells.get(cell, ()):
+                px, py, pz, _ = self.points[key]
+                out.append((((px - x) ** 2 + (py - y) ** 2 + (pz - z) ** 2) ** 0.5, key))
+        return out
+
+    def within(self, x, y, z, radius):
+        """[(distance, id), ...] inside `radius` metres (3D), nearest first."""
+        lo, hi = self._cell(x - radius, y - radius), self._cell(x + radius, y + radius)
+        cells = [(cx, cy) for cx in range(lo[0], hi[0] + 1) for cy in range(lo[1], hi[1] + 1)]
+        with self.lock: hits = self._scan(x, y, z, cells)
+        return sorted(h for h in hits if h[0] <= radius)
+
+    def nearest(self, x, y, z, k, radius=None):
+        """The k closest [(distance, id), ...], optionally capped at `radius`, nearest first."""
+        cx, cy = self._cell(x, y)
+        best = []            # max-heap of the k closest so far, as (-distance, id)
+        with self.lock:
+            if not self.points or k <= 0: return []
+            # Unscanned avatars are at least this far off vertically, however close in the plane
+            zs = [p[2] for p in self.points.values()]
+            dz = max(min(zs) - z, z - max(zs), 0.0)
+            left = len(self.points)
+            for ring in range(self.max_cell + 1):
+                cells = [c for c in self._ring(cx, cy, ring)
+                         if 0 <= c[0] <= self.max_cell and 0 <= c[1] <= self.max_cell]
+                for dist, key in self._scan(x, y, z, cells):
+                    left -= 1
+                    if len(best) < k: heapq.heappush(best, (-dist, key))
+                    elif dist < -best[0][0]: heapq.heapreplace(best, (-dist, key))
+                if not left: break
+                # Anything in the next ring is at least `ring * cell_size` away in the plane
+                bound = math.hypot(ring * self.cell_size, dz)
+                if len(best) >= k and -best[0][0] <= bound: break
+                if radius is not None and bound > radius: break
+        found = sorted((-d, key) for d, key in best)
+        if radius is not None: found = [f for f in found if f[0] <= radius]
+        return found
+
+class AvatarTracker:
+    """Incremental nearby-avatar table fed by object/kill/coarse events; emits add/move/remove deltas."""
+    MOVE_THRESHOLD = 0.5    # metres of drift before a move is reported
 
-class SharedState:
     def __init__(self):
+        self.index = SpatialGrid()
+        self.table = {}      # id -> AvatarSample; replaced (never mutated) on change, so it can be published as-is
+        self.coarse = set()  # ids whose position so far comes only from CoarseLocationUpdate
+        self.pending = {}    # id -> "add" | "move" | "remove" since the last drain
+
+    def _mark(self, av_id, kind):
+        prev = self.pending.get(av_id)
+        if kind == "move" and prev == "add": return
+        if kind == "remove" and prev == "add":
+            del self.pending[av_id]; return
+        if kind == "add" and prev == "remove": kind = "move"
+        self.pending[av_id] = kind
+
+    def upsert(self, av_id, x, y, z, name=None, exact=True, now=None):
+        rec = self.table.get(av_id)
+        if rec is None:
+            self.table[av_id] = AvatarSample(av_id, name or "", x, y, z, time.time() if now is None else now)
+            if not exact: self.coarse.add(av_id)
+            self.index.update(av_id, x, y, z)
+            self._mark(av_id, "add")
+            return
+        if exact: self.coarse.discard(av_id)
+        elif av_id not in self.coarse: return    # coarse fixes never override an exact object position
+        renamed = name and name != rec.name
+        t = self.MOVE_THRESHOLD
+        moved = (x - rec.x) ** 2 + (y - rec.y) ** 2 + (z - rec.z) ** 2 >= t * t
+        if not (moved or renamed): return
+        if moved: self.index.update(av_id, x, y, z)
+        else: x, y, z = rec.x, rec.y, rec.z
+        # Reuse the stored id string: every event formats a fresh one
+        self.table[av_id] = AvatarSample(rec.id, name if renamed else rec.name, x, y, z, time.time() if now is None else now)
+        self._mark(av_id, "move")
+
+    def remove(self, av_id):
+        if self.table.pop(av_id, None) is not None:
+            self.coarse.discard(av_id)
+            self.index.remove(av_id)
+            self._mark(av_id, "remove")
+
+    def sync_coarse(self, positions, now=None):
+        """Applies a CoarseLocationUpdate: {id: (x, y, z)} for every agent the sim reports."""
+        for av_id, (x, y, z) in positions.items():
+            self.upsert(av_id, x, y, z, exact=False, now=now)
+        for av_id in [a for a in self.coarse if a not in positions]:
+            self.remove(av_id)
+
+    def drain(self):
+        """Pending changes as {add, move, remove}, or None when nothing moved."""
+        if not self.pending: return None
+        out = {"add": [], "move": [], "remove": []}
+        for av_id, kind in self.pending.items():
+            out[kind].append(av_id if kind == "remove" else self.table[av_id])
+        self.pending.clear()
+        return out
+
+    def rows(self):
+        return tuple(self.table.values())
+
+    def query(self, x, y, z, radius=None, k=None):
+        """Avatars near a point via the spatial index, nearest first, each with its distance."""
+        if k: hits = self.index.nearest(x, y, z, k, radius)
+        else: hits = self.index.within(x, y, z, radius if radius is not None else 512.0)
+        out = []
+        for dist, av_id in hits:
+            rec = self.table.get(av_id)
+            if rec: out.append(dict(_json_default(rec), dist=round(dist, 2)))
+        return out
+
+    def clear(self):
+        for av_id in list(self.table): self.remove(av_id)
+
+class EventSubscription:
+    """One push-channel consumer: bounded message queue plus latest-wins state slots."""
+    def __init__(self, kinds=None, max_messages=256):
+        self.kinds = set(kinds) if kinds else None
+        self.max_messages = max_messages
+        self.cond = threading.Condition()
+        self.messages = deque()
+        self.latest = OrderedDict()
+        self.lagged = False
+        self.closed = False
+
+    def wants(self, kind, msg_type=None):
+        return self.kinds is None or kind in self.kinds or (msg_type is not None and msg_type in self.kinds)
+
+    def offer(self, kind, data):
+        with self.cond:
+            if kind == "message":
+                # Backpressure: a slow consumer loses the oldest lines and is told to resync
+                if len(self.messages) >= self.max_messages:
+                    self.messages.popleft()
+                    self.lagged = True
+                self.messages.append(data)
+            elif kind == "avatars" and kind in self.latest:
+                # Avatar deltas are cumulative, so fold them rather than replace
+                self.latest[kind] = merge_avatar_deltas([self.latest.pop(kind), data])
+            else:
+                # State sections coalesce: only the newest value matters
+                self.latest.pop(kind, None)
+                self.latest[kind] = data
+            self.cond.notify()
+
+    def prime(self, backlog, sections):
+        """Seeds a fresh subscription with history that predates its first live event."""
+        with self.cond:
+            first = self.messages[0].seq if self.messages else None
+            older = [m for m in backlog if (first is None or m.seq < first) and self.wants("message", m.type)]
+            self.messages.extendleft(reversed(older))
+            for kind, data in sections.items():
+                wanted = self.wants(kind) or (kind == "nearby" and self.wants("avatars"))
+                if wanted and kind not in self.latest: self.latest[kind] = data
+            self.cond.notify()
+
+    def drain(self, timeout=None):
+        """Blocks until events are pending (or timeout); returns [(kind, data), ...]."""
+        with self.cond:
+            if not (self.messages or self.latest or self.lagged or self.closed):
+                self.cond.wait(timeout)
+            out = []
+            if self.lagged:
+                out.append(("resync", {"reason": "lagged"}))
+                self.lagged = False
+            out.extend(("message", m) for m in self.messages)
+            out.extend(self.latest.items())
+            self.messages.clear(); self.latest.clear()
+            return out
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+class ResponseCache:
+    """Small LRU of encoded response bodies keyed by state version: N pollers of unchanged state
+    share one encode, and concurrent misses on a key wait for the first builder instead of repeating it."""
+    def __init__(self, capacity=32):
+        self.capacity = capacity
         self.lock = threading.Lock()
-        self.messages = LimitedList(200)
-        self.map_data = None
-        self.current_region = "Unknown"
-        self.nearby_avatars = []
-        self.pos = {"x": 128.0, "y": 128.0, "z": 0.0}
-        self.sim_fps = 45.0
-        self.time_dilation = 1.0
+        self.entries = OrderedDict()    # key -> Future of the built value
+        self.hits = self.misses = 0
+
+    def get(self, key, build):
+        with self.lock:
+            fut = self.entries.get(key)
+            owner = fut is None
+            if owner:
+                fut = self.entries[key] = Future()
+                self.misses += 1
+                while len(self.entries) > self.capacity: self.entries.popitem(last=False)
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        if not owner: return fut.result()
+        try:
+            fut.set_result(build())
+        except BaseException as e:
+            with self.lock:
+                if self.entries.get(key) is fut: del self.entries[key]
+            fut.set_exception(e)
+        return fut.result()
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+class EventBus:
+    """Fans state changes out to push subscribers; free when nobody is listening."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = ()
+
+    def subscribe(self, kinds=None, max_messages=256):
+        sub = EventSubscription(kinds, max_messages)
+        with self.lock: self.subscribers = self.subscribers + (sub,)
+        return sub
+
+    def unsubscribe(self, sub):
+        sub.close()
+        with self.lock: self.subscribers = tuple(s for s in self.subscribers if s is not sub)
+
+    def publish(self, kind, data, msg_type=None):
+        for sub in self.subscribers:
+            if sub.wants(kind, msg_type): sub.offer(kind, data)
+
+class TimedLock:
+    """threading.Lock that also counts acquisitions, contention, wait time and hold time."""
+    __slots__ = ("_lock", "_acquired_at", "acquisitions", "contended", "wait", "hold", "max_hold")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+        self.acquisitions = self.contended = 0
+        self.wait = self.hold = self.max_hold = 0.0
+
+    def __enter__(self):
+        t = time.perf_counter()
+        if not self._lock.acquire(False):
+            self._lock.acquire()
+            # Counters are only touched while the lock is held
+            self.contended += 1
+            now = time.perf_counter()
+            self.wait += now - t
+            t = now
+        self._acquired_at = t
+        self.acquisitions += 1
+        return self
+
+    def __exit__(self, *exc):
+        held = time.perf_counter() - self._acquired_at
+        self.hold += held
+        if held > self.max_hold: self.max_hold = held
+        self._lock.release()
+
+    def stats(self):
+        return {"acquisitions": self.acquisitions, "contended": self.contended,
+                "wait_ms": round(self.wait * 1000, 3), "hold_ms": round(self.hold * 1000, 3),
+                "max_hold_ms": round(self.max_hold * 1000, 3)}
+
+class SharedState:
+    """Per-agent view state. Sections are immutable (version, value) snapshots swapped in whole,
+    so readers never lock; writers serialise on `lock` only to order versions and log appends."""
+    SECTIONS = ("map", "region", "nearby", "stats")
+    AVATAR_DELTA_WINDOW = 64
+    READ_RETRIES = 4
+
+    def __init__(self, agent=None):
+        self.lock = TimedLock()
+        self.agent = agent
+        self.sink = log_sink
+        self.messages = MessageLog()
+        self.seq = 0
+        self.events = EventBus()
+        self.responses = ResponseCache()
+        self._sections = {"map": (0, None), "region": (0, "Unknown"), "nearby": (0, ()),
+                          "stats": (0, SimView(45.0, 1.0, Vec3(128.0, 128.0, 0.0)))}
+        self._grid = (0, 0)
+        self._avatar_deltas = ()    # ((nearby version, delta), ...) for cursor polls
+        self._log_gen = 0           # odd while a log append is in progress
+        self.read_retries = 0
         self.connected = False
-        self.grid_x = 0
-        self.grid_y = 0
         self.full_name = "User"
 
+    # Read-only views; every published value is a fresh object that is never mutated afterwards
+    @property
+    def versions(self): return {name: self._sections[name][0] for name in self.SECTIONS}
+    @property
+    def map_tile(self): return self._sections["map"][1]
+    @property
+    def current_region(self): return self._sections["region"][1]
+    @property
+    def nearby_avatars(self): return self._sections["nearby"][1]
+    @property
+    def pos(self): return self._sections["stats"][1].pos
+    @property
+    def time_dilation(self): return self._sections["stats"][1].dilation
+    @property
+    def sim_fps(self): return self._sections["stats"][1].fps
+    @property
+    def grid(self): return self._grid
+    @property
+    def grid_x(self): return self._grid[0]
+    @property
+    def grid_y(self): return self._grid[1]
+
     def log(self, text, msg_type="info", meta=None):
-        print(f"[{msg_type.upper()}] {text}")
-        msg_obj = {"time": time.strftime("%H:%M:%S"), "text": text, "type": msg_type}
-        if meta: msg_obj["meta"] = meta
-        with self.lock: self.messages.append(msg_obj)
+        stamp = time.strftime("%H:%M:%S")
+        with self.lock:
+            self._log_gen += 1
+            self.seq += 1
+            rec = LogRecord(self.seq, stamp, text, msg_type, meta or None)
+            self.messages.append(rec)
+            self._log_gen += 1
+        if self.sink: self.sink.emit(msg_type, text, agent=self.agent, seq=rec.seq, meta=meta)
+        self.events.publish("message", rec, msg_type)
+
+    def _read_log(self, read):
+        """Runs `read` against the message log without locking, retrying if an append raced it."""
+        for _ in range(self.READ_RETRIES):
+            gen = self._log_gen
+            if not gen & 1:
+                try:
+                    out = read()
+                    if gen == self._log_gen: return out
+                except (IndexError, KeyError, TypeError, RuntimeError):
+                    pass    # torn read of a ring slot or deque mid-append
+            self.read_retries += 1
+        with self.lock: return read()
+
+    def _publish(self, name, value):
+        """Swaps in a new snapshot of a section; caller must hold the lock."""
+        self._sections[name] = (self._sections[name][0] + 1, value)
 
     def update_pos(self, x, y, z):
-        with self.lock: self.pos = {"x": float(x), "y": float(y), "z": float(z)}
+        x, y, z = float(x), float(y), float(z)
+        with self.lock:
+            stats = self._sections["stats"][1]
+            p = stats.pos
+            if x == p.x and y == p.y and z == p.z: return
+            pos = Vec3(x, y, z)
+            self._publish("stats", SimView(stats.fps, stats.dilation, pos))
+        self.events.publish("pos", pos)
+
+    def update_avatars(self, delta, avatars):
+        """Applies one tracker delta; `avatars` is the full table after it."""
+        avatars = tuple(avatars)
+        with self.lock:
+            version = self._sections["nearby"][0] + 1
+            # Deltas first, so a reader that sees the new section also finds its delta
+            self._avatar_deltas = (self._avatar_deltas + ((version, delta),))[-self.AVATAR_DELTA_WINDOW:]
+            self._publish("nearby", avatars)
+        self.events.publish("avatars", delta)
+
+    def _avatar_delta_since(self, version, upto):
+        """Merged delta from `version` to `upto`, or None if the window no longer reaches back."""
+        deltas = self._avatar_deltas
+        if not deltas or deltas[0][0] > version + 1: return None
+        return merge_avatar_deltas([d for v, d in deltas if version < v <= upto])
+
+    def update_stats(self, time_dilation, sim_fps):
+        with self.lock:
+            stats = self._sections["stats"][1]
+            if time_dilation == stats.dilation and sim_fps == stats.fps: return
+            stats = SimView(sim_fps, time_dilation, stats.pos)
+            self._publish("stats", stats)
+        self.events.publish("stats", stats)
 
-    def update_nearby(self, avatars):
-        with self.lock: self.nearby_avatars = list(avatars)
+    def update_map(self, map_tile):
+        with self.lock:
+            if map_tile == self._sections["map"][1]: return
+            self._publish("map", map_tile)
+        self.events.publish("map", map_tile)
 
     def update_region(self, name, grid_x=None, grid_y=None):
         with self.lock:
-            if name and name != "Unknown":
-                self.current_region = name
-            if grid_x and grid_x > 0: self.grid_x = grid_x
-            if grid_y and grid_y > 0: self.grid_y = grid_y
+            region = self._sections["region"][1]
+            gx, gy = self._grid
+            if name and name != "Unknown": region = name
+            if grid_x and grid_x > 0: gx = grid_x
+            if grid_y and grid_y > 0: gy = grid_y
+            if (region, gx, gy) == (self._sections["region"][1], *self._grid): return
+            self._grid = (gx, gy)
+            self._publish("region", region)
+        self.events.publish("region", region)
+
+    def _section(self, name):
+        return self._sections[name][1]
+
+    def cursor(self):
+        """Opaque poll cursor: message seq followed by every section version."""
+        return ".".join(str(v) for v in (self.seq, *(self._sections[k][0] for k in self.SECTIONS)))
+
+    @staticmethod
+    def parse_cursor(cursor):
+        try:
+            parts = [int(p) for p in cursor.split(".")]
+            # A bare message seq (e.g. an SSE event id) asks for every section in full
+            if len(parts) == 1: return parts + [-1] * len(SharedState.SECTIONS)
+            if len(parts) == len(SharedState.SECTIONS) + 1: return parts
+        except (AttributeError, ValueError):
+            pass
+        return None
+
+    def delta(self, cursor=None):
+        """Messages newer than the cursor plus only the sections whose version moved."""
+        known = self.parse_cursor(cursor)
+        # Unknown or future cursors (e.g. after a restart) resync from scratch
+        if known is None or known[0] > self.seq: known = [0] + [-1] * len(self.SECTIONS)
+        seq, messages = self._read_log(lambda: (self.seq, self.messages.since(known[0])))
+        out = {"messages": messages}
+        versions = [seq]
+        for name, seen in zip(self.SECTIONS, known[1:]):
+            version, value = self._sections[name]
+            versions.append(version)
+            if version == seen: continue
+            if name == "nearby" and seen >= 0:
+                delta = self._avatar_delta_since(seen, version)
+                if delta is not None:
+                    out["avatars"] = delta; continue
+            out[name] = value
+        out["cursor"] = ".".join(map(str, versions))
+        return out
+
+    def subscribe(self, kinds=None, since=0):
+        """Opens a push subscription primed with current sections and messages after `since`."""
+        sub = self.events.subscribe(kinds)
+        backlog = self._read_log(lambda: self.messages.since(since))
+        sections = {name: self._section(name) for name in self.SECTIONS}
+        sections["pos"] = sections["stats"].pos
+        sub.prime(backlog, sections)
+        return sub
+
+    def recent(self, k=50, channel="im", peer=None):
+        return self._read_log(lambda: self.messages.last(k, channel, peer))
 
     def snapshot(self):
-        with self.lock:
-            return {
-                "messages": self.messages.as_list(),
-                "map": self.map_data,
-                "region": self.current_region,
-                "nearby": list(self.nearby_avatars),
-                "stats": {"fps": self.sim_fps, "dilation": self.time_dilation, "pos": dict(self.pos)}
-            }
+        return {
+            "messages": self._read_log(self.messages.as_list),
+            "map": self.map_tile,
+            "region": self.current_region,
+            "nearby": self.nearby_avatars,
+            "stats": self._section("stats"),
+        }
+
+    def contention(self):
+        return dict(self.lock.stats(), read_retries=self.read_retries)
+
+# AgentUpdate ControlFlags used by the autopilot
+AGENT_CONTROL_AT_POS = 0x1
+AGENT_CONTROL_AT_NEG = 0x2
+
+class QTable:
+    """Tabular Q-values in a memory-mapped .npy, so agents (and processes) can share one policy."""
+    def __init__(self, n_states, n_actions, path=None):
+        self.path = path
+        shape = (n_states, n_actions)
+        self.q = None
+        if path:
+            try:
+                if os.path.exists(path):
+                    q = np.lib.format.open_memmap(path, mode="r+")
+                    if q.shape == shape and q.dtype == np.float32: self.q = q
+                    else: log_sink.emit("qtable", f"{path} has shape {q.shape}, expected {shape}; starting fresh", "warning")
+                if self.q is None:
+                    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                    self.q = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+            except (OSError, ValueError) as e:
+                log_sink.emit("qtable", f"cannot map {path}: {e}; using an in-memory table", "warning")
+                self.path = None
+        if self.q is None: self.q = np.zeros(shape, dtype=np.float32)
+
+    def best(self, s):
+        return int(np.argmax(self.q[s]))
+
+    def update_batch(self, s, a, r, s2, done, alpha, gamma):
+        """One vectorised Q-learning step over a batch of transitions."""
+        target = r + gamma * self.q[s2].max(axis=1) * (1.0 - done)
+        # np.add.at so duplicate (s, a) pairs in a batch all contribute
+        np.add.at(self.q, (s, a), alpha * (target - self.q[s, a]))
+
+    def flush(self):
+        if isinstance(self.q, np.memmap): self.q.flush()
+
+class ReplayBuffer:
+    """Fixed-size ring of (s, a, r, s2, done) transitions in NumPy arrays, allocated on first use
+    with the narrowest dtypes that hold them (10 bytes a transition for the autopilot's table)."""
+    def __init__(self, capacity=20000, n_states=1 << 31, n_actions=256):
+        self.capacity = capacity
+        self.state_dtype = np.min_scalar_type(n_states - 1)
+        self.action_dtype = np.min_scalar_type(n_actions - 1)
+        self.s = self.a = self.r = self.s2 = self.done = None
+        self.size = 0
+        self.head = 0
+
+    def __len__(self): return self.size
+
+    def _allocate(self):
+        n = self.capacity
+        self.s, self.s2 = np.zeros(n, dtype=self.state_dtype), np.zeros(n, dtype=self.state_dtype)
+        self.a = np.zeros(n, dtype=self.action_dtype)
+        self.r = np.zeros(n, dtype=np.float32)
+        self.done = np.zeros(n, dtype=np.uint8)
+
+    def add(self, s, a, r, s2, done):
+        if self.s is None: self._allocate()
+        i = self.head
+        self.s[i], self.a[i], self.r[i], self.s2[i], self.done[i] = s, a, r, s2, done
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, n, rng):
+        idx = rng.integers(0, self.size, size=min(n, self.size))
+        return self.s[idx], self.a[idx], self.r[idx], self.s2[idx], self.done[idx]
 
 class QLearningDrive:
-    """Manual AgentDrive Neural Net (Continuous ControlFlag Movement)."""
-    def __init__(self, state):
+    """Tabular Q-learning autopilot: discretised pose/motion state, actions mapped to ControlFlags."""
+    CELLS = 8                   # position grid per axis (32 m cells)
+    BEARINGS = 8                # target bearing relative to our heading
+    SPEEDS = 3                  # stalled / slow / moving
+    N_STATES = CELLS * CELLS * BEARINGS * SPEEDS * 2
+    # (control flags, heading change in radians)
+    ACTIONS = ((AGENT_CONTROL_AT_POS, 0.0), (AGENT_CONTROL_AT_POS, math.pi / 6), (AGENT_CONTROL_AT_POS, -math.pi / 6),
+               (0, math.pi / 2), (0, -math.pi / 2), (AGENT_CONTROL_AT_NEG, 0.0))
+    ARRIVAL_RADIUS = 2.0
+    STALL_DISTANCE = 0.2
+
+    def __init__(self, state, table=None, record_path=None, seed=None):
         self.state = state
         self.active = False
+        self.mode = "learn"     # learn | exploit | steer (legacy direct steering)
         self.target_pos = None
+        self.table = table if table is not None else QTable(self.N_STATES, len(self.ACTIONS))
+        self.replay = ReplayBuffer(n_states=self.N_STATES, n_actions=len(self.ACTIONS))
+        self.rng = np.random.default_rng(seed)
+        self.alpha, self.gamma = 0.2, 0.95
+        self.epsilon, self.epsilon_min, self.epsilon_decay = 1.0, 0.05, 0.999
+        self.batch_size, self.train_every = 64, 4
+        self.heading = 0.0
+        self.steps = 0
+        self.episodes = 0
+        self._prev = None       # (obs, state index, action) awaiting its outcome
+        self.record_path = record_path
+        self._record = None     # opened on the first recorded step, closed with the session
 
     def toggle(self):
         self.active = not self.active
         self.target_pos = None
+        self._prev = None
+        if not self.active:
+            self.table.flush()
+            if self._record: self._record.flush()
         return self.active
 
+    def close(self):
+        """Flushes the table and closes the trajectory file; call from the loop that runs decide()."""
+        self.table.flush()
+        if self._record:
+            self._record.close()
+            self._record = None
+
     @property
     def pos(self):
-        p = self.state.pos
-        return type('V', (), {'x': p['x'], 'y': p['y'], 'z': p['z']})()
+        return self.state.pos
 
     def dist_xy(self, x1, y1, x2, y2): 
         return ((x1 - x2)**2 + (y1 - y2)**2)**0.5
 
+    @classmethod
+    def encode(cls, x, y, heading, target, moved, stalled):
+        """Discrete state index from an observation."""
+        cx = min(max(int(x * cls.CELLS / 256), 0), cls.CELLS - 1)
+        cy = min(max(int(y * cls.CELLS / 256), 0), cls.CELLS - 1)
+        rel = (math.atan2(target[1] - y, target[0] - x) - heading + math.pi) % (2 * math.pi)
+        bearing = int(rel * cls.BEARINGS / (2 * math.pi)) % cls.BEARINGS
+        speed = 0 if moved < cls.STALL_DISTANCE else (1 if moved < 1.0 else 2)
+        return ((((cx * cls.CELLS + cy) * cls.BEARINGS + bearing) * cls.SPEEDS + speed) * 2) + int(stalled)
+
+    @classmethod
+    def outcome(cls, prev_obs, action, obs):
+        """(state index, reward, done) for the step from prev_obs to obs under `action`."""
+        px, py, _, tx, ty = prev_obs
+        x, y, heading, _, _ = obs
+        moved = ((x - px) ** 2 + (y - py) ** 2) ** 0.5
+        stalled = cls.ACTIONS[action][0] != 0 and moved < cls.STALL_DISTANCE
+        before = ((tx - px) ** 2 + (ty - py) ** 2) ** 0.5
+        after = ((tx - x) ** 2 + (ty - y) ** 2) ** 0.5
+        done = after < cls.ARRIVAL_RADIUS
+        reward = (before - after) - 0.05 - (0.5 if stalled else 0.0) + (10.0 if done else 0.0)
+        return cls.encode(x, y, heading, (tx, ty), moved, stalled), reward, done
+
+    def learn(self, s, a, r, s2, done):
+        self.replay.add(s, a, r, s2, float(done))
+        self.steps += 1
+        if self.steps % self.train_every == 0 and len(self.replay) >= self.batch_size:
+            self.table.update_batch(*self.replay.sample(self.batch_size, self.rng), self.alpha, self.gamma)
+            self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay)
+
+    def _rotation(self):
+        return (0, 0, math.sin(self.heading / 2.0), math.cos(self.heading / 2.0))
+
+    def _steer(self, me):
+        # Legacy behaviour: face the waypoint and walk
+        self.heading = math.atan2(self.target_pos[1] - me.y, self.target_pos[0] - me.x)
+        return AGENT_CONTROL_AT_POS, self._rotation()
+
     def decide(self):
         if not self.active: return 0, (0, 0, 0, 1)
         me = self.pos
         
         # Determine Waypoint
-        if not self.target_pos or self.dist_xy(me.x, me.y, self.target_pos[0], self.target_pos[1]) < 2.0:
-            self.target_pos = (random.randint(20, 236), random.randint(20, 236))
+        if not self.target_pos or self.dist_xy(me.x, me.y, self.target_pos[0], self.target_pos[1]) < self.ARRIVAL_RADIUS:
+            self.target_pos = tuple(int(v) for v in self.rng.integers(20, 237, size=2))
+            self.episodes += 1
             self.state.log(f"AI AUTOPILOT: Routing to Sector <{self.target_pos[0]}, {self.target_pos[1]}>", "system")
-        
-        # Calculate Angular Rotation
-        dx = self.target_pos[0] - me.x
-        dy = self.target_pos[1] - me.y
-        target_angle = math.atan2(dy, dx)
-        
-        qz = math.sin(target_angle / 2.0)
-        qw = math.cos(target_angle / 2.0)
-        
-        # 1 = AT_FORWARD (Walk Control Flag)
-        return 1, (0, 0, qz, qw)
+        if self.mode == "steer": return self._steer(me)
+
+        obs = (me.x, me.y, self.heading, self.target_pos[0], self.target_pos[1])
+        if self._prev is not None:
+            prev_obs, prev_s, prev_a = self._prev
+            s, reward, done = self.outcome(prev_obs, prev_a, obs)
+            if self.mode == "learn": self.learn(prev_s, prev_a, reward, s, done)
+            # `s` was encoded against the old waypoint; a new one starts a fresh episode, as in train_offline
+            if prev_obs[3:] != obs[3:]: s = self.encode(me.x, me.y, self.heading, self.target_pos, 0.0, False)
+        else:
+            s = self.encode(me.x, me.y, self.heading, self.target_pos, 0.0, False)
+
+        if self.mode == "learn" and self.rng.random() < self.epsilon:
+            action = int(self.rng.integers(len(self.ACTIONS)))
+        else:
+            action = self.table.best(s)
+        if self.record_path:
+            if self._record is None: self._record = open(self.record_path, "a", buffering=1 << 16)
+            self._record.write(json.dumps({"t": time.time(), "obs": obs, "action": action}) + "\n")
+        self._prev = (obs, s, action)
+
+        controls, turn = self.ACTIONS[action]
+        self.heading = (self.heading + turn + math.pi) % (2 * math.pi) - math.pi
+        return controls, self._rotation()
+
+    def stats(self):
+        return {"mode": self.mode, "active": self.active, "steps": self.steps, "episodes": self.episodes,
+                "epsilon": round(self.epsilon, 4), "replay": len(self.replay), "table": self.table.path}
+
+def train_offline(paths, table, epochs=1, batch_size=256, alpha=0.1, gamma=0.95, seed=None):
+    """Fits a QTable to recorded autopilot trajectories (JSON lines from QLearningDrive) with no simulator."""
+    rng = np.random.default_rng(seed)
+    replay = ReplayBuffer(capacity=1 << 20, n_states=QLearningDrive.N_STATES, n_actions=len(QLearningDrive.ACTIONS))
+    for path in paths:
+        prev = None
+        with open(path) as f:
+            for line in f:
+                try: rec = json.loads(line)
+                except ValueError: continue
+                obs, action = tuple(rec["obs"]), rec["action"]
+                # A new waypoint (or a gap in the log) starts a new episode
+                if prev and prev[0][3:] == obs[3:] and rec["t"] - prev[3] < 5.0:
+                    p_obs, p_action, p_s, _ = prev
+                    s, reward, done = QLearningDrive.outcome(p_obs, p_action, obs)
+                    replay.add(p_s, p_action, reward, s, float(done))
+                else:
+                    s = QLearningDrive.encode(obs[0], obs[1], obs[2], obs[3:], 0.0, False)
+                prev = (obs, action, s, rec["t"])
+    if not len(replay): return 0
+    updates = max(1, epochs * len(replay) // batch_size)
+    for _ in range(updates):
+        table.update_batch(*replay.sample(batch_size, rng), alpha, gamma)
+    table.flush()
+    return len(replay)
+
+class AgentUpdateScheduler:
+    """Decides when an AgentUpdate is worth sending: on real change, otherwise a slow keepalive."""
+    ROT_EPSILON = 0.99985     # |q1.q2| below this (~2 degrees) counts as a turn
+    CAMERA_EPSILON = 0.5      # metres
+    MIN_INTERVAL = 0.2        # fastest rate for camera-only updates
+    KEEPALIVE = 2.0           # idle heartbeat at time dilation 1.0
+    CLOCK_SLACK = 0.01        # tick jitter allowance, so a due send isn't pushed to the next tick
+
+    def __init__(self):
+        self.last = None
+        self.last_time = 0.0
+        self.counters = {"sent": 0, "suppressed": 0, "keepalive": 0}
+
+    def _changed(self, controls, rot, camera):
+        """"control" for new control flags or a turn, "camera" for camera drift, else None."""
+        if self.last is None: return "control"
+        l_controls, l_rot, l_camera = self.last
+        if controls != l_controls: return "control"
+        if abs(sum(a * b for a, b in zip(rot, l_rot))) < self.ROT_EPSILON: return "control"
+        if sum((a - b) ** 2 for a, b in zip(camera, l_camera)) > self.CAMERA_EPSILON ** 2: return "camera"
+        return None
+
+    def should_send(self, controls, rot, camera, time_dilation=1.0, now=None):
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.last_time + self.CLOCK_SLACK
+        changed = self._changed(controls, rot, camera)
+        # Control changes always go out (the autopilot learns from what the sim actually got);
+        # only the idle keepalive stretches with dilation, since a dilated sim simulates slower
+        if changed == "control" or (changed and elapsed >= self.MIN_INTERVAL):
+            pass
+        elif elapsed >= self.KEEPALIVE / min(max(time_dilation, 0.1), 1.0):
+            self.counters["keepalive"] += 1
+        else:
+            self.counters["suppressed"] += 1
+            return False
+        self.last = (controls, tuple(rot), tuple(camera))
+        self.last_time = now
+        self.counters["sent"] += 1
+        return True
+
+    def reset(self):
+        """Forces the next tick to send (e.g. after a teleport or relogin)."""
+        self.last = None
+        self.last_time = 0.0
+
+class SimStatsAggregator:
+    """Sampled region statistics: per-packet work is a counter bump, aggregation happens once per bucket."""
+    BUCKET = 1.0                # seconds per time-series point
+    WINDOW = 300                # points kept (5 minutes)
+    SAMPLE_INTERVAL = 0.25      # min spacing between TimeDilation samples taken from ObjectUpdate
+    # SimStats StatIDs worth keeping (LL_SIM_STAT_*)
+    STAT_IDS = {0: "dilation", 1: "fps", 2: "physics_fps", 13: "agents", 14: "child_agents", 15: "scripts"}
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.counts = {}            # message name -> packets in the open bucket
+        self.totals = {}            # message name -> packets in closed buckets; swapped whole, read at scrape time
+        self.samples = []           # dilation samples in the open bucket
+        self.sim = {}               # latest SimStats values
+        self.sampled = 0
+        self.skipped = 0
+        self.series = ()            # closed points; tuples are swapped whole so readers need no lock
+        self._window = ()           # per-point dilation samples, parallel to series
+        self._bucket_start = None
+        self._next_sample = 0.0
+
+    def on_packet(self, msg):
+        """Wildcard message handler; runs on the client loop for every inbound packet."""
+        name = msg.name
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if name == "ObjectUpdate":
+            now = self.clock()
+            if now < self._next_sample:
+                self.skipped += 1; return
+            self._next_sample = now + self.SAMPLE_INTERVAL
+            try: self.samples.append(msg["RegionData"]["TimeDilation"] / 65535.0)
+            except (KeyError, IndexError, TypeError): return
+            self.sampled += 1
+        elif name == "SimStats":
+            for block in msg["Stat"]:
+                key = self.STAT_IDS.get(block["StatID"])
+                if key: self.sim[key] = round(float(block["StatValue"]), 3)
+
+    def roll(self, now=None):
+        """Closes the open bucket once it is due and returns its point (else None); call from the client loop."""
+        now = self.clock() if now is None else now
+        if self._bucket_start is None: self._bucket_start = now
+        elapsed = now - self._bucket_start
+        if elapsed < self.BUCKET: return None
+        counts, self.counts = self.counts, {}
+        samples, self.samples = self.samples, []
+        totals = dict(self.totals)
+        for k, v in counts.items(): totals[k] = totals.get(k, 0) + v
+        self.totals = totals
+        if not samples and "dilation" in self.sim: samples = [self.sim["dilation"]]
+        point = {"t": round(time.time(), 3), "pps": round(sum(counts.values()) / elapsed, 2),
+                 "packets": {k: round(v / elapsed, 2) for k, v in counts.items()},
+                 "dilation": self._summarise(samples), "sim": dict(self.sim)}
+        self._bucket_start = now
+        self._window = (self._window + (tuple(samples),))[-self.WINDOW:]
+        self.series = (self.series + (point,))[-self.WINDOW:]
+        return point
+
+    @staticmethod
+    def _summarise(samples):
+        if not len(samples): return None
+        a = np.asarray(samples, dtype=np.float64)
+        return {"min": round(float(a.min()), 4), "avg": round(float(a.mean()), 4),
+                "p95": round(float(np.percentile(a, 95)), 4), "n": int(a.size)}
+
+    def current(self):
+        """(time dilation, sim fps) from the newest point, or None before the first sample."""
+        if not self.series or not self.series[-1]["dilation"]: return None
+        point = self.series[-1]
+        td = point["dilation"]["avg"]
+        # Without SimStats, approximate FPS from dilation against the 45 fps target
+        return td, point["sim"].get("fps", round(td * 45.0, 2))
+
+    def summary(self):
+        series, window = self.series, self._window
+        packets = {}
+        for point in series:
+            for name, rate in point["packets"].items(): packets[name] = packets.get(name, 0.0) + rate
+        n = max(len(series), 1)
+        return {"points": len(series), "bucket_seconds": self.BUCKET,
+                "dilation": self._summarise([v for bucket in window for v in bucket]),
+                "pps": round(sum(p["pps"] for p in series) / n, 2),
+                "packets": {k: round(v / n, 2) for k, v in sorted(packets.items(), key=lambda kv: -kv[1])},
+                "sim": series[-1]["sim"] if series else {}, "sampled": self.sampled, "skipped": self.skipped}
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`."""
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = None
+
+    def wait(self, now):
+        """Seconds until a token is available (0 if one is now)."""
+        if self.stamp is not None: self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1.0
+
+class OutboundQueue:
+    """Per-agent outbound chat/IM: priority lanes paced by token buckets, with per-message delivery status."""
+    LANES = ("im", "chat")      # drained in priority order
+    # Conservative against the sim's spam throttles: per-lane (msgs/s, burst) plus a shared circuit budget
+    RATES = {"im": (1.0, 5), "chat": (1.0, 4)}
+    CIRCUIT_RATE = (1.5, 6)
+    MAX_QUEUED = 1000           # per lane
+    MAX_AGE = 120.0             # queued messages older than this fail as expired
+    HISTORY = 2048              # status records kept for the API
+
+    def __init__(self, deliver, ready, clock=time.monotonic):
+        self.deliver = deliver
+        self.ready = ready
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.lanes = {lane: deque() for lane in self.LANES}
+        self.buckets = {lane: TokenBucket(*self.RATES[lane]) for lane in self.LANES}
+        self.circuit = TokenBucket(*self.CIRCUIT_RATE)
+        self.records = OrderedDict()
+        self.counters = {"queued": 0, "sent": 0, "failed": 0}
+        self.inflight = {}          # id -> record handed to the circuit, awaiting its ack
+        self._loop = None
+        self._wake = None
+        self._task = None
+
+    def start(self, loop):
+        """(Re)starts the drain task; call on the client loop once the circuit is up."""
+        if self._task: self._task.cancel()
+        self._loop = loop
+        self._wake = asyncio.Event()
+        self._task = loop.create_task(self._drain())
+
+    def stop(self):
+        if self._task and self._loop: self._loop.call_soon_threadsafe(self._task.cancel)
+        self._task = None
+        # The circuit that owed these acks is gone
+        with self.lock:
+            for rec in self.inflight.values(): self._finish(rec, "failed", "circuit lost")
+            self.inflight.clear()
+
+    def _finish(self, rec, status, error=None):
+        # Caller holds the lock
+        rec["status"] = status
+        rec["done"] = time.time()
+        if error: rec["error"] = error
+        self.counters[status] += 1
+
+    def enqueue(self, lane, items):
+        """Queues [(text, fields), ...] on one lane with a single wake-up; returns status snapshots."""
+        out = []
+        with self.lock:
+            q = self.lanes[lane]
+            for text, fields in items:
+                rec = dict(fields, id=_uuid.uuid4().hex[:12], lane=lane, text=text, status="queued", queued=time.time())
+                self.records[rec["id"]] = rec
+                if fields.get("error"): self._finish(rec, "failed", fields["error"])
+                elif len(q) >= self.MAX_QUEUED: self._finish(rec, "failed", "queue full")
+                else:
+                    q.append(rec)
+                    self.counters["queued"] += 1
+                out.append(dict(rec))
+            while len(self.records) > self.HISTORY: self.records.popitem(last=False)
+        if self._loop and self._wake: self._loop.call_soon_threadsafe(self._wake.set)
+        return out
+
+    def status(self, ids=None, k=50):
+        with self.lock:
+            if ids: return [dict(self.records[i]) for i in ids if i in self.records]
+            return [dict(r) for r in list(self.records.values())[-k:]]
+
+    def stats(self):
+        with self.lock: return dict(self.counters, sending=len(self.inflight),
+                                    **{f"{lane}_depth": len(q) for lane, q in self.lanes.items()})
+
+    def _acked(self, rec, fut):
+        if fut.cancelled(): error = "cancelled"
+        else:
+            e = fut.exception()
+            error = e and (str(e) or type(e).__name__)
+        with self.lock:
+            if self.inflight.pop(rec["id"], None) is None: return
+            self._finish(rec, "failed" if error else "sent", error)
+
+    def _pump(self):
+        """Sends what the buckets allow; returns seconds until the next send is possible (None when idle)."""
+        if not self.ready(): return None
+        now, delay, expired = self.clock(), None, time.time() - self.MAX_AGE
+        for lane in self.LANES:
+            q, bucket = self.lanes[lane], self.buckets[lane]
+            while q:
+                with self.lock:
+                    rec = q[0]
+                    if rec["queued"] < expired:
+                        q.popleft(); self._finish(rec, "failed", "expired"); continue
+                wait = max(bucket.wait(now), self.circuit.wait(now))
+                if wait:
+                    delay = wait if delay is None else min(delay, wait); break
+                bucket.take(); self.circuit.take()
+                try:
+                    ack, error = self.deliver(rec), None
+                except Exception as e:
+                    ack, error = None, str(e) or type(e).__name__
+                with self.lock:
+                    q.popleft()
+                    if error or ack is None: self._finish(rec, "failed" if error else "sent", error)
+                    else:
+                        # Reliable send: the record settles when the sim acks (or the resends give up)
+                        rec["status"] = "sending"
+                        self.inflight[rec["id"]] = rec
+                if ack is not None and not error: ack.add_done_callback(lambda fut, rec=rec: self._acked(rec, fut))
+        return delay
+
+    async def _drain(self):
+        while True:
+            self._wake.clear()
+            delay = self._pump()
+            try: await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError: pass
 
 # ==========================================
-# SECTION 3: HIPPO CLIENT
+# SECTION 3: LOGGING & METRICS
 # ==========================================
 
-class HippoSLClient:
+class LogPipeline:
+    """Structured log sink: emit() only appends to a deque; a writer thread batches JSON lines into a
+    size-rotated file and mirrors the familiar `[TYPE] text` lines to stdout."""
+    LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+    LEVEL_NAMES = {v: k for k, v in LEVELS.items()}
+
+    def __init__(self, path=None, level="info", types=None, console=True, max_bytes=10 << 20, backups=5,
+                 flush_interval=0.2, max_pending=100000):
+        self.path = path or None
+        self.level = self.LEVELS.get(level, 20)
+        self.types = set(types) if types else None
+        self.console = console
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self._pending = deque()
+        self._file = None
+        self._size = 0
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._writer = None     # started by the first record, so importing the module spawns nothing
+
+    def open(self, path):
+        """Points the JSON-lines file at `path`; until then records only reach the console."""
+        self.path = path or None
+
+    def _start(self):
+        with self._start_lock:
+            if self._writer is not None: return
+            self._writer = threading.Thread(target=self._write_loop, name="log-writer", daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+
+    def emit(self, msg_type, text, level=None, agent=None, seq=None, meta=None):
+        """Filters and queues one record; never touches stdout or disk on the caller's thread."""
+        lvl = self.LEVELS.get(level) or (40 if msg_type == "error" else 20)
+        if lvl < self.level or (self.types is not None and msg_type not in self.types): return
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1; return
+        self._pending.append((time.time(), lvl, msg_type, agent, seq, text, meta))
+        if self._writer is None: self._start()
+
+    def _write_loop(self):
+        while True:
+            stop = self._stop.wait(self.flush_interval)
+            batch = []
+            try:
+                while True: batch.append(self._pending.popleft())
+            except IndexError:
+                pass
+            if batch: self._write(batch)
+            if stop: break
+        if self._file: self._file.close()
+
+    def _write(self, batch):
+        if self.console:
+            try:
+                sys.stdout.write("".join(f"[{r[2].upper()}] {r[5]}\n" for r in batch)); sys.stdout.flush()
+            except (OSError, ValueError):
+                pass
+        if not self.path: return
+        data = "".join(json.dumps({"ts": round(ts, 3), "level": self.LEVEL_NAMES[lvl], "type": t, "agent": agent,
+                                   "seq": seq, "text": text, "meta": meta}, default=str) + "\n"
+                       for ts, lvl, t, agent, seq, text, meta in batch).encode("utf-8")
+        try:
+            if self._file is None: self._open()
+            if self._size and self._size + len(data) > self.max_bytes: self._rotate()
+            self._file.write(data); self._file.flush()
+            self._size += len(data)
+            self.written += len(batch)
+        except OSError as e:
+            sys.stderr.write(f"[LOG] disabled, cannot write {self.path}: {e}\n")
+            self.path = None
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        """path -> path.1 -> ... -> path.<backups>; the oldest falls off."""
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"): os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups: os.replace(self.path, f"{self.path}.1")
+        else: os.remove(self.path)
+        self.rotations += 1
+        self._open()
+
+    def close(self):
+        if self._writer and self._writer.is_alive():
+            self._stop.set()
+            self._writer.join(timeout=5)
+
+    def stats(self):
+        return {"path": self.path, "level": self.LEVEL_NAMES.get(self.level), "written": self.written,
+                "pending": len(self._pending), "dropped": self.dropped, "rotations": self.rotations}
+
+# The file path is set in main (see open_data_dir); importing the module touches no disk
+log_sink = LogPipeline(
+    level=os.environ.get("BLACKGLASS_LOG_LEVEL", "info"),
+    types=[t for t in os.environ.get("BLACKGLASS_LOG_TYPES", "").split(",") if t],
+    console=os.environ.get("BLACKGLASS_LOG_CONSOLE", "1") != "0",
+    max_bytes=int(os.environ.get("BLACKGLASS_LOG_MAX_BYTES", 10 << 20)))
+
+class Metric:
+    """One metric family: label values -> a number (counter/gauge) or bucket counts (histogram)."""
+    def __init__(self, name, help_text, kind="counter", labels=(), buckets=None):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) if buckets else None
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), value=1.0):
+        with self.lock: self.series[labels] = self.series.get(labels, 0.0) + value
+
+    def set(self, value, labels=()):
+        self.series[labels] = value
+
+    def observe(self, value, labels=()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            s = self.series.get(labels)
+            if s is None: s = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1; s[1] += value; s[2] += 1
+
+    def drop(self, label, value):
+        """Forgets every series whose `label` equals `value` (e.g. a removed agent)."""
+        if label not in self.labels: return
+        idx = self.labels.index(label)
+        with self.lock:
+            for key in [k for k in self.series if k[idx] == value]: del self.series[key]
+
+    @staticmethod
+    def _fmt(names, values, extra=None):
+        pairs = [(n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for n, v in zip(names, values)]
+        if extra: pairs.append(extra)
+        return "{" + ",".join(f'{n}="{v}"' for n, v in pairs) + "}" if pairs else ""
+
+    def expose(self, out):
+        """Appends this family in Prometheus text exposition format."""
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        with self.lock: series = [(k, (list(v[0]), v[1], v[2]) if self.kind == "histogram" else v) for k, v in self.series.items()]
+        for key, value in sorted(series, key=lambda kv: kv[0]):
+            if self.kind != "histogram":
+                out.append(f"{self.name}{self._fmt(self.labels, key)} {value:g}"); continue
+            counts, total, n = value
+            running = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                running += c
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                out.append(f"{self.name}_bucket{self._fmt(self.labels, key, ('le', le))} {running}")
+            out.append(f"{self.name}_sum{self._fmt(self.labels, key)} {total:g}")
+            out.append(f"{self.name}_count{self._fmt(self.labels, key)} {n}")
+
+class MetricsRegistry:
+    """Process-wide metrics: instrumented families plus collectors sampled at scrape time."""
+    LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+    SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+    RECOVERY_BUCKETS = (1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
     def __init__(self):
-        self.state = SharedState()
-        self.neural = QLearningDrive(self.state)
+        self.families = {}
+        self.collectors = []
+
+    def _family(self, name, help_text, kind, labels, buckets=None):
+        fam = self.families.get(name)
+        if fam is None: fam = self.families[name] = Metric(name, help_text, kind, labels, buckets)
+        return fam
+
+    def counter(self, name, help_text, labels=()): return self._family(name, help_text, "counter", labels)
+    def gauge(self, name, help_text, labels=()): return self._family(name, help_text, "gauge", labels)
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._family(name, help_text, "histogram", labels, buckets)
+
+    def register_collector(self, fn):
+        """fn() yields freshly built Metric objects each scrape (for values other objects already count)."""
+        self.collectors.append(fn)
+
+    def drop(self, label, value):
+        for fam in self.families.values(): fam.drop(label, value)
+
+    def expose(self):
+        out = []
+        for fam in list(self.families.values()): fam.expose(out)
+        for fn in self.collectors:
+            try:
+                for fam in fn(): fam.expose(out)
+            except Exception as e:
+                out.append(f"# collector {getattr(fn, '__name__', fn)} failed: {e}")
+        return "\n".join(out) + "\n"
+
+metrics = MetricsRegistry()
+HANDLER_SECONDS = metrics.histogram("blackglass_handler_seconds", "Packet handler execution time (1 in HANDLER_SAMPLE calls).",
+                                    ("agent", "handler"))
+LOOP_LAG_SECONDS = metrics.histogram("blackglass_loop_lag_seconds", "Control loop wake-up delay beyond its tick.", ("agent",))
+TICK_SECONDS = metrics.histogram("blackglass_tick_seconds", "Control loop tick execution time.", ("agent",))
+HTTP_REQUESTS = metrics.counter("blackglass_http_requests_total", "HTTP requests served.", ("method", "route", "code"))
+HTTP_SECONDS = metrics.histogram("blackglass_http_request_seconds", "HTTP request handling time.", ("route",))
+HTTP_BYTES = metrics.histogram("blackglass_http_response_bytes", "HTTP response size including headers.", ("route",),
+                               buckets=MetricsRegistry.SIZE_BUCKETS)
+EVENT_LOOP_LAG = metrics.histogram("blackglass_event_loop_lag_seconds", "Profiler heartbeat delay per loop thread.", ("loop",))
+LOOP_STALLS = metrics.counter("blackglass_event_loop_stalls_total", "Times a loop thread was blocked past the threshold.", ("loop",))
+CIRCUIT_LOSSES = metrics.counter("blackglass_circuit_losses_total", "Sessions lost, by detection reason.", ("agent", "reason"))
+RECONNECT_ATTEMPTS = metrics.counter("blackglass_reconnect_attempts_total", "Re-login attempts after a lost session.", ("agent", "result"))
+RECOVERY_SECONDS = metrics.histogram("blackglass_reconnect_recovery_seconds", "Time from losing a session to being back in-world.",
+                                     ("agent",), buckets=MetricsRegistry.RECOVERY_BUCKETS)
+
+class LoopProfiler:
+    """Opt-in watchdog for asyncio loop threads: a heartbeat measures lag, a sampler thread catches stalls
+    (with the blocking stack) and folds sampled stacks into flame-graph input on demand."""
+    HEARTBEAT = 0.01            # seconds between heartbeat wake-ups on each watched loop
+    LAG_WINDOW = 1000           # recent lag samples kept per loop
+    MAX_DEPTH = 64
+
+    def __init__(self, threshold=0.1, sample_interval=0.005, max_stalls=50):
+        self.threshold = threshold
+        self.sample_interval = sample_interval
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.loops = {}             # name -> watch record
+        self.stalls = deque(maxlen=max_stalls)
+        self._capture = None        # folded stack -> samples while a flame capture runs
+        self._capture_lock = threading.Lock()
+        self._sampler = None
+        self._run = None            # token of the current start(); tasks from an older run exit
+
+    def watch(self, name, loop, thread_id):
+        w = {"name": name, "loop": loop, "thread_id": thread_id, "beat": time.perf_counter(),
+             "lag": deque(maxlen=self.LAG_WINDOW), "stall": None, "stalls": 0, "heartbeat": None}
+        with self.lock:
+            old = self.loops.get(name)
+            if old and old["heartbeat"]: old["heartbeat"].cancel()
+            self.loops[name] = w
+            if self.enabled: self._start_heartbeat(w)
+
+    def start(self, threshold=None):
+        if threshold is not None: self.threshold = threshold
+        with self.lock:
+            if self.enabled: return
+            self.enabled = True
+            run = self._run = object()
+            for w in self.loops.values(): self._start_heartbeat(w)
+            self._sampler = threading.Thread(target=self._sample_loop, args=(run,), name="loop-profiler", daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        with self.lock:
+            self.enabled = False
+            self._run = None
+            for w in self.loops.values():
+                if w["heartbeat"]: w["heartbeat"].cancel()
+                w["heartbeat"] = None
+            sampler, self._sampler = self._sampler, None
+        if sampler and sampler is not threading.current_thread(): sampler.join(timeout=1.0)
+
+    def _start_heartbeat(self, w):
+        """Caller must hold the lock."""
+        w["beat"] = time.perf_counter()
+        w["heartbeat"] = asyncio.run_coroutine_threadsafe(self._heartbeat(w, self._run), w["loop"])
+
+    async def _heartbeat(self, w, run):
+        labels = (w["name"],)
+        while self._run is run:
+            t = time.perf_counter()
+            w["beat"] = t
+            await asyncio.sleep(self.HEARTBEAT)
+            lag = max(time.perf_counter() - t - self.HEARTBEAT, 0.0)
+            w["lag"].append(lag)
+            EVENT_LOOP_LAG.observe(lag, labels)
+
+    @classmethod
+    def _fold(cls, frame):
+        """Root-first 'func (file:line);...' key for one stack, as flamegraph.pl / speedscope expect."""
+        names = []
+        while frame is not None and len(names) < cls.MAX_DEPTH:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _sample_loop(self, run):
+        while self._run is run:
+            time.sleep(self.sample_interval)
+            now = time.perf_counter()
+            capture = self._capture
+            with self.lock: watched = list(self.loops.values())
+            frames = None
+            for w in watched:
+                blocked = now - w["beat"]
+                stall = w["stall"]
+                if blocked <= self.threshold and stall is None and capture is None: continue
+                if frames is None: frames = sys._current_frames()
+                frame = frames.get(w["thread_id"])
+                if frame is None: continue
+                folded = self._fold(frame)
+                if capture is not None:
+                    key = f"{w['name']};{folded}"
+                    capture[key] = capture.get(key, 0) + 1
+                if blocked > self.threshold:
+                    if stall is None:
+                        stall = w["stall"] = {"loop": w["name"], "at": time.time(), "duration_ms": 0.0,
+                                              "stack": traceback.format_stack(frame), "samples": {}}
+                        w["stalls"] += 1
+                        self.stalls.append(stall)
+                        LOOP_STALLS.inc((w["name"],))
+                    stall["duration_ms"] = round(blocked * 1000, 1)
+                    stall["samples"][folded] = stall["samples"].get(folded, 0) + 1
+                elif stall is not None:
+                    w["stall"] = None
+                    log_sink.emit("loop_stall", f"{w['name']} blocked {stall['duration_ms']} ms in:\n{''.join(stall['stack'][-8:])}",
+                                  "warning", meta={"loop": w["name"], "duration_ms": stall["duration_ms"]})
+
+    def capture(self, seconds):
+        """Samples every watched loop thread for `seconds`; returns folded stacks (or None if one is running)."""
+        if not self._capture_lock.acquire(blocking=False): return None
+        try:
+            self._capture = {}
+            time.sleep(seconds)
+            folded, self._capture = self._capture, None
+        finally:
+            self._capture_lock.release()
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(folded.items(), key=lambda kv: -kv[1]))
+
+    def report(self):
+        loops = {}
+        with self.lock: watched = list(self.loops.values())
+        for w in watched:
+            lag = np.asarray(w["lag"], dtype=np.float64) * 1000.0
+            loops[w["name"]] = {"stalls": w["stalls"], "lag_ms": {
+                "p50": round(float(np.percentile(lag, 50)), 3), "p99": round(float(np.percentile(lag, 99)), 3),
+                "max": round(float(lag.max()), 3)} if lag.size else None}
+        stalls = [dict(s, samples=dict(sorted(s["samples"].items(), key=lambda kv: -kv[1])[:5])) for s in list(self.stalls)]
+        return {"enabled": self.enabled, "threshold_ms": round(self.threshold * 1000, 1), "loops": loops, "stalls": stalls}
+
+profiler = LoopProfiler(threshold=float(os.environ.get("BLACKGLASS_PROFILE_THRESHOLD_MS", 100)) / 1000.0)
+
+# ==========================================
+# SECTION 4: MAP TILES
+# ==========================================
+
+class TileCache:
+    """Region map tiles: in-memory LRU over a content-addressed, size-bounded disk store."""
+    LAYERS = ("objects", "base")
+    MIN_TILE_BYTES = 1000
+
+    def __init__(self, cache_dir=None, base_url="https://map.secondlife.com", disk_budget=64 << 20,
+                 memory_budget=8 << 20, ttl=24 * 3600, missing_ttl=3600, user_agent="Mozilla/5.0"):
+        self.cache_dir = cache_dir
+        self.base_url = base_url.rstrip("/")
+        self.disk_budget = disk_budget
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.user_agent = user_agent
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()     # (gx, gy, layer) -> (bytes, fetched), LRU order
+        self.memory_bytes = 0
+        self.index = OrderedDict()      # "gx-gy-layer" -> {"sha", "size", "fetched"}, LRU order
+        self.blob_refs = {}             # sha -> number of index entries pointing at it
+        self.disk_bytes = 0
+        self.layers = {}                # "gx-gy" -> layer that last served a real tile
+        self.missing = {}               # "gx-gy" -> time every layer came back empty
+        self.counters = dict.fromkeys(("memory_hits", "disk_hits", "misses", "evictions"), 0)
+        self._load_index()
+
+    # ---- keys & paths ----
+    @staticmethod
+    def url_for(gx, gy, etag):
+        return f"/api/map/{gx}/{gy}.jpg?v={etag}"
+
+    @staticmethod
+    def _ikey(gx, gy, layer=None):
+        return f"{gx}-{gy}" if layer is None else f"{gx}-{gy}-{layer}"
+
+    def _blob_path(self, sha):
+        return os.path.join(self.cache_dir, "blobs", sha[:2], sha + ".jpg")
+
+    def _tile_key(self, gx, gy, data):
+        etag = hashlib.sha1(data).hexdigest()[:16]
+        return {"gx": gx, "gy": gy, "etag": etag, "url": self.url_for(gx, gy, etag)}
+
+    def open(self, cache_dir):
+        """Moves the disk tier to `cache_dir` (None keeps tiles in memory only)."""
+        with self.lock:
+            self.cache_dir = cache_dir
+            self.index.clear(); self.blob_refs.clear()
+            self.disk_bytes = 0
+            self._load_index()
+
+    # ---- disk index ----
+    def _load_index(self):
+        if not self.cache_dir: return
+        try:
+            with open(os.path.join(self.cache_dir, "index.json")) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, entry in saved.get("tiles", []):
+            if os.path.exists(self._blob_path(entry["sha"])):
+                self._index_add(key, entry)
+        self.layers.update(saved.get("layers", {}))
+
+    def _save_index(self):
+        """Caller must hold the lock."""
+        if not self.cache_dir: return
+        path = os.path.join(self.cache_dir, "index.json")
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                json.dump({"tiles": list(self.index.items()), "layers": self.layers}, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            log_sink.emit("tile_cache", f"index write failed: {e}", "error")
+
+    def _index_add(self, key, entry):
+        self.index[key] = entry
+        refs = self.blob_refs.get(entry["sha"], 0)
+        if refs == 0: self.disk_bytes += entry["size"]
+        self.blob_refs[entry["sha"]] = refs + 1
+
+    def _index_drop(self, key):
+        entry = self.index.pop(key, None)
+        if entry is None: return
+        refs = self.blob_refs.get(entry["sha"], 1) - 1
+        if refs > 0:
+            self.blob_refs[entry["sha"]] = refs; return
+        self.blob_refs.pop(entry["sha"], None)
+        self.disk_bytes -= entry["size"]
+        try: os.remove(self._blob_path(entry["sha"]))
+        except OSError: pass
+
+    # ---- tiers ----
+    def _remember(self, mkey, data, fetched):
+        """Caller must hold the lock."""
+        if mkey in self.memory:
+            self.memory_bytes -= len(self.memory.pop(mkey)[0])
+        self.memory[mkey] = (data, fetched)
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.memory_budget and len(self.memory) > 1:
+            self.memory_bytes -= len(self.memory.popitem(last=False)[1][0])
+
+    def _read(self, gx, gy, layer, fresh_only):
+        """Cached bytes for one layer, or None. Caller must hold the lock."""
+        key = self._ikey(gx, gy, layer)
+        entry = self.index.get(key)
+        held = self.memory.get((gx, gy, layer))
+        # Memory-only tiles (no disk tier) carry their own fetch time
+        fetched = held[1] if held else entry and entry["fetched"]
+        if fresh_only and fetched is not None and time.time() - fetched > self.ttl: return None
+        if held is not None:
+            self.memory.move_to_end((gx, gy, layer))
+            if entry: self.index.move_to_end(key)
+            self.counters["memory_hits"] += 1
+            return held[0]
+        if entry is None: return None
+        try:
+            with open(self._blob_path(entry["sha"]), "rb") as f: data = f.read()
+        except OSError:
+            self._index_drop(key); return None
+        self.index.move_to_end(key)
+        self._remember((gx, gy, layer), data, entry["fetched"])
+        self.counters["disk_hits"] += 1
+        return data
+
+    def _store(self, gx, gy, layer, data):
+        """Caller must hold the lock."""
+        self._remember((gx, gy, layer), data, time.time())
+        self.layers[self._ikey(gx, gy)] = layer
+        self.missing.pop(self._ikey(gx, gy), None)
+        if not self.cache_dir: return
+        sha = hashlib.sha1(data).hexdigest()
+        path = self._blob_path(sha)
+        try:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + ".tmp", "wb") as f: f.write(data)
+                os.replace(path + ".tmp", path)
+        except OSError as e:
+            log_sink.emit("tile_cache", f"blob write failed: {e}", "error"); return
+        key = self._ikey(gx, gy, layer)
+        entry = self.index.get(key)
+        if entry and entry["sha"] == sha:
+            entry["fetched"] = time.time()
+            self.index.move_to_end(key)
+        else:
+            self._index_drop(key)
+            self._index_add(key, {"sha": sha, "size": len(data), "fetched": time.time()})
+        while self.disk_bytes > self.disk_budget and len(self.index) > 1:
+            self._index_drop(next(iter(self.index)))
+            self.counters["evictions"] += 1
+        self._save_index()
+
+    def _best_cached(self, gx, gy):
+        """Any cached layer, fresh or stale, preferred layer first. Caller must hold the lock."""
+        for layer in self._layer_order(gx, gy):
+            data = self._read(gx, gy, layer, fresh_only=False)
+            if data is not None: return data
+        return None
+
+    def _layer_order(self, gx, gy):
+        preferred = self.layers.get(self._ikey(gx, gy))
+        return ((preferred,) if preferred else ()) + tuple(l for l in self.LAYERS if l != preferred)
+
+    # ---- public API ----
+    def lookup(self, gx, gy):
+        """Best cached tile as (bytes, etag) without touching the network."""
+        with self.lock: data = self._best_cached(gx, gy)
+        return None if data is None else (data, self._tile_key(gx, gy, data)["etag"])
+
+    def probe(self, gx, gy):
+        """(tile key or None, needs download, layer order) from the cache alone."""
+        with self.lock:
+            order = self._layer_order(gx, gy)
+            for layer in order:
+                data = self._read(gx, gy, layer, fresh_only=True)
+                if data is not None: return self._tile_key(gx, gy, data), False, order
+            missed = self.missing.get(self._ikey(gx, gy))
+            if missed and time.time() - missed < self.missing_ttl: return None, False, order
+            self.counters["misses"] += 1
+            return None, True, order
+
+    def store(self, gx, gy, layer, data):
+        """Caches downloaded bytes for a layer and returns the tile key."""
+        with self.lock: self._store(gx, gy, layer, data)
+        return self._tile_key(gx, gy, data)
+
+    def mark_missing(self, gx, gy):
+        """Records that every layer came back empty; returns a stale tile key if one survives."""
+        with self.lock:
+            self.missing[self._ikey(gx, gy)] = time.time()
+            # A stale copy beats an empty map while the tile server is unreachable
+            data = self._best_cached(gx, gy)
+        return None if data is None else self._tile_key(gx, gy, data)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, memory_tiles=len(self.memory), memory_bytes=self.memory_bytes,
+                        disk_tiles=len(self.index), disk_bytes=self.disk_bytes)
+
+map_tiles = TileCache(
+    base_url=os.environ.get("BLACKGLASS_MAP_URL", "https://map.secondlife.com"))
+
+class MapFetcher:
+    """Async tile downloads on the caller's loop: keep-alive pool, bounded concurrency, in-flight dedup."""
+    def __init__(self, cache, concurrency=4, timeout=10.0, retries=2, backoff=0.5):
+        self.cache = cache
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self._inflight = {}     # (gx, gy) -> concurrent Future shared by every waiter, on any loop
+        self._pools = {}        # loop -> (ClientSession, Semaphore)
+        self._holders = {}      # loop -> sessions using its pool
+        self._tasks = {}        # loop -> its download tasks; each set is only touched on its own loop
+        self.counters = dict.fromkeys(("requests", "deduplicated", "retries", "failures"), 0)
+
+    def _pool(self):
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+            session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                            headers={"User-Agent": self.cache.user_agent})
+            pool = self._pools[loop] = (session, asyncio.Semaphore(self.concurrency))
+        return pool
+
+    def hold(self):
+        """Registers a session on the running loop; pair with release()."""
+        loop = asyncio.get_running_loop()
+        self._holders[loop] = self._holders.get(loop, 0) + 1
+
+    async def release(self):
+        """Drops a session from the running loop; the last one out closes the loop's pool."""
+        loop = asyncio.get_running_loop()
+        left = self._holders.get(loop, 1) - 1
+        if left > 0:
+            self._holders[loop] = left; return
+        self._holders.pop(loop, None)
+        # Let downloads other loops may be waiting on finish before their connections go
+        with self.lock: pending = list(self._tasks.get(loop, ()))
+        if pending: await asyncio.wait(pending, timeout=self.timeout.total)
+        if self._holders.get(loop): return
+        with self.lock:
+            if not self._tasks.get(loop): self._tasks.pop(loop, None)
+        pool = self._pools.pop(loop, None)
+        if pool: await pool[0].close()
+
+    def _spawn(self, coro):
+        loop = asyncio.get_running_loop()
+        task = loop.create_task(coro)
+        with self.lock: tasks = self._tasks.setdefault(loop, set())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return task
+
+    async def fetch(self, gx, gy):
+        """Tile key for the poll payload (cached or downloaded), or None if the region is void."""
+        loop = asyncio.get_running_loop()
+        # Cache probes may touch disk, so keep them off the loop thread
+        tile, needed, order = await loop.run_in_executor(None, self.cache.probe, gx, gy)
+        if not needed: return tile
+        with self.lock:
+            shared = self._inflight.get((gx, gy))
+            owner = shared is None
+            if owner: shared = self._inflight[(gx, gy)] = Future()
+            else: self.counters["deduplicated"] += 1
+        # Runs as its own task so a cancelled waiter never strands the others
+        if owner: self._spawn(self._resolve(gx, gy, order, shared))
+        return await asyncio.wrap_future(shared)
+
+    async def _resolve(self, gx, gy, order, shared):
+        try:
+            result = await self._download_chain(gx, gy, order)
+        except Exception as e:
+            self.counters["failures"] += 1
+            with self.lock: self._inflight.pop((gx, gy), None)
+            shared.set_exception(e)
+        else:
+            with self.lock: self._inflight.pop((gx, gy), None)
+            shared.set_result(result)
+
+    async def _download_chain(self, gx, gy, order):
+        loop = asyncio.get_running_loop()
+        for layer in order:
+            data = await self._download(f"{self.cache.base_url}/map-1-{gx}-{gy}-{layer}.jpg")
+            if data is not None:
+                return await loop.run_in_executor(None, self.cache.store, gx, gy, layer, data)
+        return await loop.run_in_executor(None, self.cache.mark_missing, gx, gy)
+
+    async def _download(self, url):
+        """Bytes for one layer; None when forbidden, absent or unrendered. Transient errors retry."""
+        session, limiter = self._pool()
+        for attempt in range(self.retries + 1):
+            try:
+                async with limiter:
+                    self.counters["requests"] += 1
+                    async with session.get(url) as resp:
+                        if 400 <= resp.status < 500: return None
+                        resp.raise_for_status()
+                        data = await resp.read()
+                return data if len(data) > self.cache.MIN_TILE_BYTES else None
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                if attempt == self.retries: raise
+                self.counters["retries"] += 1
+                await asyncio.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+
+    def prefetch_neighbors(self, gx, gy):
+        """Schedules the 8 surrounding tiles on the running loop; failures are ignored."""
+        async def _quiet(nx, ny):
+            try: await self.fetch(nx, ny)
+            except Exception: pass
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                if (dx or dy) and gx + dx > 0 and gy + dy > 0:
+                    self._spawn(_quiet(gx + dx, gy + dy))
+
+    def stats(self):
+        with self.lock: inflight = len(self._inflight)
+        return dict(self.counters, inflight=inflight)
+
+map_fetcher = MapFetcher(map_tiles)
+
+# ==========================================
+# SECTION 5: HISTORY STORE
+# ==========================================
+
+class HistoryStore:
+    """SQLite (WAL) archive of chat and IM, indexed for search, fed by a batch writer; rows past the
+    retention window are pruned as it goes."""
+    PRUNE_INTERVAL = 3600.0
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY, ts REAL NOT NULL, agent TEXT, region TEXT, type TEXT NOT NULL,
+            sender_id TEXT, sender_name TEXT, text TEXT NOT NULL)""",
+        "CREATE INDEX IF NOT EXISTS ix_messages_ts ON messages(ts)",
+        "CREATE INDEX IF NOT EXISTS ix_messages_sender ON messages(sender_id, ts)",
+        "CREATE INDEX IF NOT EXISTS ix_messages_region ON messages(region, ts)",
+        "CREATE INDEX IF NOT EXISTS ix_messages_type ON messages(type, ts)",
+    )
+    FTS_SCHEMA = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(text, content='messages', content_rowid='id')",
+        """CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text); END""",
+        """CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text); END""",
+    )
+    COLUMNS = ("id", "ts", "agent", "region", "type", "sender_id", "sender_name", "text")
+
+    def __init__(self, path, batch_size=256, flush_interval=1.0, max_pending=100000, retention_days=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention_days * 86400.0 if retention_days else None
+        self.fts = False
+        self.written = 0
+        self.dropped = 0
+        self.pruned = 0
+        self._queue = queue.Queue(max_pending)
+        self._writer = None
+        if path: self._open()
+
+    def open(self, path, retention_days=None):
+        """Starts archiving to `path`; a store built without one records nothing until then."""
+        if self._writer: return
+        self.path = path
+        self.retention = retention_days * 86400.0 if retention_days else None
+        if path: self._open()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _open(self):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = self._connect()
+            db.execute("PRAGMA journal_mode=WAL")
+            for stmt in self.SCHEMA: db.execute(stmt)
+            try:
+                for stmt in self.FTS_SCHEMA: db.execute(stmt)
+                self.fts = True
+            except sqlite3.OperationalError:
+                pass    # SQLite built without FTS5: text search falls back to LIKE
+            db.commit()
+            db.close()
+        except (OSError, sqlite3.Error) as e:
+            log_sink.emit("history", f"disabled, cannot open {self.path}: {e}", "error")
+            self.path = None
+            return
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def record(self, agent, region, msg_type, sender_id, sender_name, text):
+        """Queues one row; never blocks the packet handler."""
+        if not self.path: return
+        try: self._queue.put_nowait((time.time(), agent, region, msg_type, sender_id, sender_name, text))
+        except queue.Full: self.dropped += 1
+
+    def _write_loop(self):
+        db = self._connect()
+        # One commit (and one WAL fsync) per batch rather than per message
+        db.execute("PRAGMA synchronous=FULL")
+        next_prune = 0.0
+        while True:
+            if self.retention and time.monotonic() >= next_prune:
+                self._prune(db)
+                next_prune = time.monotonic() + self.PRUNE_INTERVAL
+            # Wake at least once per prune interval so an idle archive still ages out
+            try: row = self._queue.get(timeout=max(next_prune - time.monotonic(), 0) if self.retention else None)
+            except queue.Empty: continue
+            if row is None: break
+            batch = [row]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                try: row = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty: break
+                if row is None:
+                    stop = True; break
+                batch.append(row)
+            try:
+                db.executemany("INSERT INTO messages (ts, agent, region, type, sender_id, sender_name, text) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+                db.commit()
+                self.written += len(batch)
+            except sqlite3.Error as e:
+                log_sink.emit("history", f"batch of {len(batch)} lost: {e}", "error")
+            if stop: break
+        db.close()
+
+    def _prune(self, db):
+        try:
+            cur = db.execute("DELETE FROM messages WHERE ts < ?", (time.time() - self.retention,))
+            db.commit()
+            self.pruned += cur.rowcount
+        except sqlite3.Error as e:
+            log_sink.emit("history", f"prune failed: {e}", "error")
+
+    def close(self):
+        if self._writer and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=5)
+
+    @staticmethod
+    def _fts_query(text):
+        # Quote every term so user input can't hit FTS5 syntax errors
+        return " ".join('"' + t.replace('"', '""') + '"' for t in text.split())
+
+    def query(self, text=None, sender=None, region=None, msg_type=None, agent=None,
+              since=None, until=None, before=None, limit=50):
+        """Newest-first page of rows; pass the returned `next` back as `before` for the next page."""
+        if not self.path: return {"results": [], "next": None}
+        where, args = [], []
+        table = "messages m"
+        if text:
+            if self.fts:
+                table += " JOIN messages_fts f ON f.rowid = m.id"
+                where.append("messages_fts MATCH ?"); args.append(self._fts_query(text))
+            else:
+                where.append("m.text LIKE ?"); args.append(f"%{text}%")
+        for col, val in (("sender_id", sender), ("region", region), ("type", msg_type), ("agent", agent)):
+            if val:
+                where.append(f"m.{col} = ?"); args.append(val)
+        if since is not None: where.append("m.ts >= ?"); args.append(float(since))
+        if until is not None: where.append("m.ts < ?"); args.append(float(until))
+        if before is not None: where.append("m.id < ?"); args.append(int(before))
+        sql = f"SELECT {', '.join('m.' + c for c in self.COLUMNS)} FROM {table}"
+        if where: sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY m.id DESC LIMIT ?"
+        args.append(int(limit))
+        db = self._connect()
+        try: rows = [dict(zip(self.COLUMNS, r)) for r in db.execute(sql, args)]
+        finally: db.close()
+        return {"results": rows, "next": rows[-1]["id"] if len(rows) == limit else None}
+
+    def stats(self):
+        return {"enabled": bool(self.path), "fts": self.fts, "written": self.written, "pending": self._queue.qsize(),
+                "dropped": self.dropped, "pruned": self.pruned,
+                "retention_days": self.retention / 86400.0 if self.retention else None}
+
+history_store = HistoryStore(None)
+
+# ==========================================
+# SECTION 6: HIPPO CLIENT
+# ==========================================
+
+class HippoSLClient:
+    TICK = 0.2                  # control loop period (seconds)
+    CIRCUIT_TIMEOUT = 15.0
+    SILENCE_TIMEOUT = 30.0      # sims send SimStats every second; this much quiet means the circuit is gone
+    ACK_RESENDS = 4             # a reliable packet resent this often without an ack means the same
+    RESEND_BUDGET = ReliableResendInfo.tries_left   # hippolyzer's tries per reliable packet
+    STALE_POSITION = 20.0       # driving this long without our position changing
+    RECONNECT_BASE = 2.0        # backoff: base * 2**attempt, capped, with jitter
+    RECONNECT_MAX = 300.0
+    HANDLER_SAMPLE = 16         # time one handler call in this many
+
+    def __init__(self, loop=None, agent_key=None, fetcher=None, history=None, qtable=None, record_path=None,
+                 hippo_factory=None):
+        self.state = SharedState(agent=agent_key)
+        self.fetcher = fetcher if fetcher is not None else map_fetcher
+        self.history = history if history is not None else history_store
+        self.neural = QLearningDrive(self.state, table=qtable, record_path=record_path)
+        self.updates = AgentUpdateScheduler()
+        self.sim_stats = SimStatsAggregator(clock=lambda: self.clock())
+        self.avatars = AvatarTracker()
+        self.outbox = OutboundQueue(self._deliver, lambda: self.state.connected and bool(self._hippo and self._hippo.main_circuit))
+        self.agent_key = agent_key
+        self.agent_id = None
+        # HippoClient, or a stand-in with the same surface (see SimHippoClient)
+        self.hippo_factory = hippo_factory or HippoClient
+        self.clock = time.monotonic
         self._hippo = None
-        self._loop = None
+        self._loop = loop
+        self._generation = 0
+        self._map_task = None
+        self._lost = None           # set by KickUser/LogoutReply handlers
+        self._moving = False
+        self._last_rx = 0.0
+        self._pos_seen = (None, 0.0)
+        self.session_stats = {"state": "offline", "losses": 0, "reconnects": 0, "attempts": 0,
+                              "last_loss": None, "last_recovery": None}
 
     def log(self, text, msg_type="info", meta=None):
         self.state.log(text, msg_type, meta)
 
-    def login(self, first, last, password, start_input="last"):
+    def _ensure_loop(self):
+        # Standalone clients (no fleet) still get a private loop thread
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            def run_loop():
+                asyncio.set_event_loop(self._loop)
+                self._loop.run_forever()
+            thread = threading.Thread(target=run_loop, name=f"client-loop-{self.agent_key or id(self)}", daemon=True)
+            thread.start()
+            profiler.watch(thread.name, self._loop, thread.ident)
+        return self._loop
+
+    def begin_login(self, first, last, password, start_input="last"):
+        """Starts a login on the client loop; returns a Future resolving to success."""
         self.state.log(f"Resolving Location: {start_input}...", "system")
         start_loc = SmartParser.parse_start_location(start_input)
         self.state.log(f"Target URI: {start_loc}", "system")
@@ -178,93 +2137,289 @@ class HippoSLClient:
             r_name = urllib.parse.unquote(start_loc[4:].split('&')[0])
             self.state.update_region(r_name)
 
-        self._loop = asyncio.new_event_loop()
-        login_done = threading.Event()
-        login_result = [False]
+        # Retire any previous session loop before re-authenticating
+        self.state.connected = False
+        self._generation += 1
+        login_future = Future()
 
-        def run_loop():
-            asyncio.set_event_loop(self._loop)
-            self._loop.run_until_complete(self._async_main(first, last, password, start_loc, login_done, login_result))
-
-        threading.Thread(target=run_loop, daemon=True).start()
-        login_done.wait(timeout=45)
-        return login_result[0]
+        asyncio.run_coroutine_threadsafe(
+            self._async_main(first, last, password, start_loc, login_future, self._generation),
+            self._ensure_loop())
+        return login_future
 
-    async def _async_main(self, first, last, password, start_loc, login_done, login_result):
-        self._hippo = HippoClient()
-        try:
-            await self._hippo.login(username=f"{first} {last}", password=password, start_location=start_loc, agree_to_tos=True)
-            
-            timeout = 15
-            while not self._hippo.main_circuit and timeout > 0:
-                await asyncio.sleep(0.5); timeout -= 0.5
-            if not self._hippo.main_circuit: raise Exception("UDP Circuit Timeout")
-
-            pres_msg = Message("CompleteAgentMovement", Block("AgentData", 
-                AgentID=self._hippo.session.agent_id, SessionID=self._hippo.session.id, 
-                CircuitCode=self._hippo.session.login_data['circuit_code']))
-            self._hippo.main_circuit.send(pres_msg)
-
-            login_data = self._hippo.session.login_data
-            if "region_x" in login_data and "region_y" in login_data:
-                gx = int(login_data["region_x"]) // 256
-                gy = int(login_data["region_y"]) // 256
-                self.state.update_region(self.state.current_region, gx, gy)
-            
-            self.state.connected = True
-            login_result[0] = True
-            login_done.set()
+    def login(self, first, last, password, start_input="last"):
+        try: return self.begin_login(first, last, password, start_input).result(timeout=45)
+        except Exception: return False
+
+    def logout(self):
+        self.state.connected = False
+        self._generation += 1
+        self.session_stats["state"] = "offline"
+        self.outbox.stop()
+        if self._hippo and self._loop:
+            async def _do_logout():
+                self.neural.close()
+                try: await self._hippo.aclose()
+                except Exception as e: self.state.log(f"Logout failed: {e}", "error")
+            asyncio.run_coroutine_threadsafe(_do_logout(), self._loop)
+        else:
+            self.neural.close()
 
-            h = self._hippo.session.message_handler
-            h.subscribe("ChatFromSimulator", self._on_chat)
-            h.subscribe("ImprovedInstantMessage", self._on_im)
-            h.subscribe("RegionHandshake", self._on_region_handshake)
-            h.subscribe("TeleportFinish", self._on_teleport_finish)
-            h.subscribe("ObjectUpdate", self._on_object_update)
+    async def _async_main(self, first, last, password, start_loc, login_future, generation):
+        """Session supervisor: logs in, runs the control loop, and re-logs in whenever the session is lost."""
+        # The loop's tile pool lives as long as some supervisor on it does
+        self.fetcher.hold()
+        try: await self._supervise(first, last, password, start_loc, login_future, generation)
+        finally: await self.fetcher.release()
 
-            self._fetch_map()
+    async def _supervise(self, first, last, password, start_loc, login_future, generation):
+        try:
+            hippo = await self._connect(first, last, password, start_loc, generation)
+        except Exception as e:
+            # A failed first login is the user's to retry (bad password, region down)
+            self.state.log(f"Login Fault: {e}", "error")
+            login_future.set_result(False)
+            return
+        if hippo is None:
+            login_future.set_result(False); return
+        login_future.set_result(True)
+        self.session_stats["state"] = "online"
+
+        attempt, lost_at = 0, None
+        reason = await self._run_session(generation)
+        while reason is not None:
+            # Retired mid-reconnect: the client is the new login's to replace, not ours to drop
+            if generation != self._generation: return
+            if lost_at is None:
+                lost_at = time.monotonic()
+                self._on_session_lost(reason)
+            await self._drop_session(hippo)
+
+            # Exponential backoff with equal jitter, so a sim restart doesn't bring the fleet back in lockstep
+            delay = min(self.RECONNECT_MAX, self.RECONNECT_BASE * 2 ** attempt)
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            attempt += 1
+            self.session_stats["state"] = "reconnecting"
+            self.state.log(f"Reconnecting in {delay:.1f}s (attempt {attempt})...", "system")
+            await asyncio.sleep(delay)
+            if generation != self._generation: return
+
+            self.session_stats["attempts"] += 1
+            try:
+                fresh = await self._connect(first, last, password, self._resume_location(start_loc), generation)
+            except Exception as e:
+                # Straight back to backoff; _connect has already closed the half-built client
+                RECONNECT_ATTEMPTS.inc((self.metrics_label, "failed"))
+                self.state.log(f"Reconnect failed: {e}", "error")
+                continue
+            if fresh is None: return
+            hippo = fresh
+            recovered = time.monotonic() - lost_at
+            RECONNECT_ATTEMPTS.inc((self.metrics_label, "ok"))
+            RECOVERY_SECONDS.observe(recovered, (self.metrics_label,))
+            self.session_stats.update(state="online", reconnects=self.session_stats["reconnects"] + 1,
+                                      last_recovery=round(recovered, 2))
+            self.state.log(f"Session restored after {recovered:.1f}s", "success")
+            attempt, lost_at = 0, None
+            reason = await self._run_session(generation)
+
+    async def _run_session(self, generation):
+        """Runs the control loop until retired (returns None) or the session is lost (returns why)."""
+        labels = (self.metrics_label,)
+        while generation == self._generation:
+            t0 = time.perf_counter()
+            try:
+                await self._tick()
+            except Exception as e:
+                log_sink.emit("loop_err", f"{e}\n{traceback.format_exc()}", "error", agent=self.agent_key)
+            # Guarded separately: a failing tick must not stop us noticing the circuit died
+            try:
+                reason = self._circuit_fault()
+            except Exception as e:
+                log_sink.emit("loop_err", f"{e}\n{traceback.format_exc()}", "error", agent=self.agent_key)
+                reason = None
+            if reason: return reason
+            t1 = time.perf_counter()
+            TICK_SECONDS.observe(t1 - t0, labels)
+
+            # Poll faster (0.2s) to maintain AI walking fluidity
+            await asyncio.sleep(self.TICK)
+            # Skip once retired, so a removed agent's series stay dropped
+            if generation == self._generation:
+                LOOP_LAG_SECONDS.observe(max(time.perf_counter() - t1 - self.TICK, 0.0), labels)
+        return None
+
+    def _circuit_fault(self):
+        """Why the session looks dead, or None: kicked/logged out, circuit closed, no acks, silence, stale position."""
+        if self._lost: return self._lost
+        circuit = self._hippo.main_circuit
+        if not circuit or not getattr(circuit, "is_alive", True): return "circuit_closed"
+        unacked = getattr(circuit, "unacked_reliable", None)
+        if unacked and any(self.RESEND_BUDGET - r.tries_left >= self.ACK_RESENDS for r in list(unacked.values())):
+            return "missing_acks"
+        now = self.clock()
+        if now - self._last_rx > self.SILENCE_TIMEOUT: return "silence"
+        pos = self._own_position()
+        pos = (pos.X, pos.Y, pos.Z) if pos else None
+        if pos != self._pos_seen[0] or not self._moving:
+            self._pos_seen = (pos, now)
+        elif now - self._pos_seen[1] > self.STALE_POSITION:
+            return "stale_position"
+        return None
+
+    def _on_session_lost(self, reason):
+        CIRCUIT_LOSSES.inc((self.metrics_label, reason))
+        self.session_stats.update(losses=self.session_stats["losses"] + 1, last_loss=reason)
+        self.state.log(f"Session lost ({reason.replace('_', ' ')})", "error")
+        log_sink.emit("session", f"lost: {reason}", "warning", agent=self.agent_key)
+
+    async def _drop_session(self, hippo):
+        """Tears down a dead session's client without taking the supervisor with it."""
+        if hippo is self._hippo:
+            self.state.connected = False
+            self.outbox.stop()
+            if self._map_task: self._map_task.cancel()
+        await self._close_client(hippo)
 
-            while self.state.connected:
-                try:
-                    self._sync_state()
-                    
-                    if self.neural.active:
-                        controls, rot = self.neural.decide()
-                    else:
-                        controls, rot = 0, (0, 0, 0, 1)
+    @staticmethod
+    async def _close_client(hippo):
+        if hippo is None: return
+        try: await asyncio.wait_for(hippo.aclose(), 5.0)
+        except Exception: pass
+
+    def _resume_location(self, start_loc):
+        # Come back where we were rather than at the original start location
+        region, p = self.state.current_region, self.state.pos
+        if not region or region == "Unknown": return start_loc
+        return f"uri:{region}&{int(p.x)}&{int(p.y)}&{int(p.z)}"
+
+    async def _connect(self, first, last, password, start_loc, generation=None):
+        """Logs in, announces presence and wires the packet handlers; returns the new client, or None if
+        `generation` was retired meanwhile. The client is published after the last await, so a retired
+        supervisor never sees it."""
+        hippo = self.hippo_factory()
+        try:
+            await hippo.login(username=f"{first} {last}", password=password, start_location=start_loc, agree_to_tos=True)
+            await self._await_circuit(hippo)
+        except BaseException:
+            await self._close_client(hippo); raise
+        retired = lambda: generation is not None and generation != self._generation
+        # Replaces whatever client a retired supervisor left behind; closed first so its handlers go quiet
+        if not retired() and self._hippo is not None and self._hippo is not hippo:
+            await self._close_client(self._hippo)
+        if retired():
+            await self._close_client(hippo); return None
+        self._hippo = hippo
+        self._reset_avatars()
+        pres_msg = Message("CompleteAgentMovement", Block("AgentData", 
+            AgentID=self._hippo.session.agent_id, SessionID=self._hippo.session.id, 
+            CircuitCode=self._hippo.session.login_data['circuit_code']))
+        self._hippo.main_circuit.send(pres_msg)
+
+        login_data = self._hippo.session.login_data
+        if "region_x" in login_data and "region_y" in login_data:
+            gx = int(login_data["region_x"]) // 256
+            gy = int(login_data["region_y"]) // 256
+            self.state.update_region(self.state.current_region, gx, gy)
+        
+        self.agent_id = str(self._hippo.session.agent_id)
+        self.updates.reset()
+        self._lost = None
+        self._last_rx = self.clock()
+        self._pos_seen = (None, self._last_rx)
+        self.state.connected = True
+
+        h = self._hippo.session.message_handler
+        h.subscribe("*", self._on_packet)
+        h.subscribe("ChatFromSimulator", self._instrument("chat", self._on_chat))
+        h.subscribe("ImprovedInstantMessage", self._instrument("im", self._on_im))
+        h.subscribe("RegionHandshake", self._instrument("region_handshake", self._on_region_handshake))
+        h.subscribe("TeleportFinish", self._instrument("teleport_finish", self._on_teleport_finish))
+        h.subscribe("CoarseLocationUpdate", self._instrument("coarse_location", self._on_coarse_location))
+        h.subscribe("KickUser", self._on_kicked)
+        h.subscribe("LogoutReply", self._on_kicked)
+        objects = self._hippo.session.objects
+        objects.events.subscribe(ObjectUpdateType.UPDATE, self._instrument("object_update", self._on_object_event))
+        objects.events.subscribe(ObjectUpdateType.KILL, self._instrument("object_kill", self._on_object_kill))
+
+        self.outbox.start(asyncio.get_running_loop())
+        self._fetch_map()
+        return hippo
 
-                    await self._send_agent_update(controls, rot)
+    async def _await_circuit(self, hippo):
+        """Waits on the region's `connected` future rather than polling for main_circuit."""
+        if hippo.main_circuit: return
+        regions = getattr(hippo.session, "regions", None)
+        try:
+            if regions: await asyncio.wait_for(asyncio.shield(regions[-1].connected), self.CIRCUIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        if not hippo.main_circuit: raise Exception("UDP Circuit Timeout")
+
+    async def _tick(self):
+        """One control-loop step: sync state, run the autopilot, send an AgentUpdate if warranted."""
+        self._sync_state()
+        # Sim stats reach the shared state once per bucket, not once per packet
+        if self.sim_stats.roll(self.clock()):
+            current = self.sim_stats.current()
+            if current: self.state.update_stats(*current)
+        
+        if self.neural.active:
+            controls, rot = self.neural.decide()
+        else:
+            controls, rot = 0, (0, 0, 0, 1)
+        self._moving = bool(controls & (AGENT_CONTROL_AT_POS | AGENT_CONTROL_AT_NEG))
 
-                except Exception as e:
-                    print(f"[LOOP_ERR] {e}")
-                    import traceback; traceback.print_exc()
-                
-                # Poll faster (0.2s) to maintain AI walking fluidity
-                await asyncio.sleep(0.2)
+        p = self.state.pos
+        if self.updates.should_send(controls, rot, (p.x, p.y, p.z), self.state.time_dilation, self.clock()):
+            await self._send_agent_update(controls, rot)
 
-        except Exception as e:
-            self.state.log(f"Login Fault: {e}", "error")
-            login_result[0] = False
-            login_done.set()
+    @property
+    def metrics_label(self):
+        return self.agent_key or "default"
+
+    def _instrument(self, name, handler):
+        """Wraps a packet/event handler so one call in HANDLER_SAMPLE lands in HANDLER_SECONDS."""
+        labels = (self.metrics_label, name)
+        calls = itertools.count()
+        def _timed(msg):
+            if next(calls) % self.HANDLER_SAMPLE:
+                handler(msg); return
+            t = time.perf_counter()
+            try: handler(msg)
+            finally: HANDLER_SECONDS.observe(time.perf_counter() - t, labels)
+        return _timed
+
+    def _on_packet(self, msg):
+        # Wildcard: counting lives in the sim-stats aggregator and is exported at scrape time, lock-free here
+        self._last_rx = self.clock()
+        self.sim_stats.on_packet(msg)
+
+    def _on_kicked(self, m):
+        self._lost = "kicked" if m.name == "KickUser" else "logged_out"
+        if m.name == "KickUser":
+            try: self.state.log(f"Kicked: {m['UserInfo']['Reason']}", "error")
+            except KeyError: pass
+
+    def _own_position(self):
+        """Our avatar's region position from the session's object table; None until the sim sends it."""
+        session = self._hippo.session if self._hippo else None
+        obj = session.objects.lookup_fullid(session.agent_id) if session else None
+        if obj is None or not obj.AncestorsKnown: return None
+        return obj.RegionPosition
 
     def _sync_state(self):
-        if self._hippo.position:
-            p = self._hippo.position
-            self.state.update_pos(p.X, p.Y, p.Z)
+        p = self._own_position()
+        if p: self.state.update_pos(p.X, p.Y, p.Z)
         
-        if self._hippo.session and self._hippo.session.objects:
-            nearby = []
-            my_id = self._hippo.session.agent_id
-            for av in self._hippo.session.objects.all_avatars:
-                if av.FullID != my_id and av.RegionPosition:
-                    p = av.RegionPosition
-                    nearby.append({"x": float(p.X), "y": float(p.Y), "z": float(p.Z)})
-            self.state.update_nearby(nearby)
+        # Avatar events only queue changes; publish them once per tick
+        delta = self.avatars.drain()
+        if delta: self.state.update_avatars(delta, self.avatars.rows())
 
     async def _send_agent_update(self, control_flags=0, rot_tuple=(0,0,0,1)):
         if not self._hippo.main_circuit or not self._hippo.session: return
         qx, qy, qz, qw = rot_tuple
-        pos = self._hippo.position or Vector3(128, 128, 0)
+        pos = self._own_position() or Vector3(128, 128, 0)
         
         msg = Message("AgentUpdate", Block("AgentData",
             AgentID=self._hippo.session.agent_id, SessionID=self._hippo.session.id,
@@ -293,12 +2448,48 @@ class HippoSLClient:
 
             if dialog == 0:
                 self.state.log(f"[IM] {from_name}: {msg_text}", "im", {"id": from_id})
+                self.history.record(self.agent_key, self.state.current_region, "im", from_id, from_name, msg_text)
         except Exception as e:
             self.state.log(f"IM Parse Exception: {e}", "error")
 
+    def _reset_avatars(self):
+        # The old region's avatars won't all get KillObjects, so drop them wholesale
+        self.avatars.clear()
+        delta = self.avatars.drain()
+        if delta: self.state.update_avatars(delta, [])
+
+    def _on_object_event(self, event):
+        obj = event.object
+        if obj.PCode != PCode.AVATAR or obj.FullID == self._hippo.session.agent_id: return
+        av_id = str(obj.FullID)
+        if av_id in self.avatars.table and not event.updated & {"Position", "ParentID", "NameValue"}: return
+        try:
+            if not obj.AncestorsKnown: return
+            p = obj.RegionPosition
+            entry = self._hippo.session.objects.name_cache.lookup(obj.FullID)
+            self.avatars.upsert(av_id, float(p.X), float(p.Y), float(p.Z), str(entry) if entry else None)
+        except Exception as e:
+            log_sink.emit("avatar_err", str(e), "warning", agent=self.agent_key)
+
+    def _on_object_kill(self, event):
+        obj = event.object
+        if obj.PCode == PCode.AVATAR: self.avatars.remove(str(obj.FullID))
+
+    def _on_coarse_location(self, m):
+        my_id = self._hippo.session.agent_id
+        positions = {}
+        for agent_block, loc in zip(m["AgentData"], m["Location"]):
+            if agent_block["AgentID"] == my_id: continue
+            # Coarse Z is in 4 m steps; 255 means unknown
+            positions[str(agent_block["AgentID"])] = (float(loc["X"]), float(loc["Y"]), float(loc["Z"] * 4 if loc["Z"] != 255 else 0))
+        self.avatars.sync_coarse(positions)
+
     def _on_chat(self, m):
-        if m["ChatData"]["ChatType"] not in (ChatType.TYPING_START, ChatType.TYPING_STOP):
-            self.state.log(f"{m['ChatData']['FromName']}: {m['ChatData']['Message']}", "chat")
+        cd = m["ChatData"]
+        if cd["ChatType"] not in (ChatType.TYPING_START, ChatType.TYPING_STOP):
+            self.state.log(f"{cd['FromName']}: {cd['Message']}", "chat")
+            self.history.record(self.agent_key, self.state.current_region, "chat",
+                                str(cd["SourceID"]), str(cd["FromName"]), str(cd["Message"]))
 
     def _on_region_handshake(self, m):
         name = str(m["RegionInfo"]["SimName"])
@@ -313,90 +2504,78 @@ class HippoSLClient:
             gy = int((handle >> 32) / 256)
             self.state.update_region(self.state.current_region, gx, gy)
             self.state.log(f"Teleport Complete. Grid: <{gx}, {gy}>", "success")
+            self.updates.reset()
+            self._reset_avatars()
             self._fetch_map()
 
-    def _on_object_update(self, m):
-        try:
-            td = float(m["RegionData"]["TimeDilation"]) / 65535.0
-            with self.state.lock:
-                self.state.time_dilation = td
-                self.state.sim_fps = td * 45.0
-        except: pass
-
     def _fetch_map(self):
-        def _fetch_thread():
-            try:
-                with self.state.lock:
-                    gx, gy = self.state.grid_x, self.state.grid_y
-                
-                if gx == 0 or gy == 0: return
+        # Always invoked from the client loop (login and packet handlers)
+        if self._map_task: self._map_task.cancel()
+        self._map_task = self._loop.create_task(self._fetch_map_async())
 
-                urls = [
-                    f"https://map.secondlife.com/map-1-{gx}-{gy}-objects.jpg",
-                    f"https://map.secondlife.com/map-1-{gx}-{gy}-base.jpg"
-                ]
-                headers = {'User-Agent': 'Mozilla/5.0'}
-                
-                success = False
-                for url in urls:
-                    try:
-                        req = urllib.request.Request(url, headers=headers)
-                        with urllib.request.urlopen(req) as response:
-                            data = response.read()
-                            if len(data) > 1000:
-                                with self.state.lock:
-                                    self.state.map_data = base64.b64encode(data).decode('utf-8')
-                                self.state.log("Map Visuals Acquired.", "success")
-                                success = True
-                                break
-                    except urllib.error.HTTPError as e:
-                        if e.code == 403: continue 
-                        raise e
-                    except Exception:
-                        pass
-                
-                if not success:
-                    self.state.log("Map Uplink Failed: Sim tiles are unrendered or void.", "error")
+    async def _fetch_map_async(self):
+        try:
+            gx, gy = self.state.grid
 
-            except Exception as e:
-                self.state.log(f"Map Uplink Fatal: {e}", "error")
+            if gx == 0 or gy == 0: return
 
-        threading.Thread(target=_fetch_thread, daemon=True).start()
+            tile = await self.fetcher.fetch(gx, gy)
+            if tile:
+                self.state.update_map(tile)
+                self.state.log("Map Visuals Acquired.", "success")
+            else:
+                self.state.log("Map Uplink Failed: Sim tiles are unrendered or void.", "error")
+            self.fetcher.prefetch_neighbors(gx, gy)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.state.log(f"Map Uplink Fatal: {e}", "error")
 
     def send_chat(self, message, chat_type=1, channel=0):
-        if not self.state.connected or not self._loop: return
+        """Queues local chat (or an IM for "/im <uuid> <text>"); returns its outbox record."""
+        if not self.state.connected or not self._loop: return None
         if message.startswith("/im "):
             parts = message.split(' ', 2)
             if len(parts) >= 3:
-                self.send_im(parts[1], parts[2])
-                return
+                return self.send_im(parts[1], parts[2])
                 
-        ct = ChatType(chat_type) if isinstance(chat_type, int) else chat_type
-        
-        def _do_chat():
-            try:
-                self._hippo.send_chat(message, channel=channel, chat_type=ct)
-            except Exception as e:
-                self.state.log(f"Chat execution failed: {e}", "error")
-
-        self._loop.call_soon_threadsafe(_do_chat)
+        ct = int(ChatType(chat_type)) if isinstance(chat_type, int) else int(chat_type)
+        rec = self.outbox.enqueue("chat", [(message, {"channel": channel, "chat_type": ct})])[0]
         self.state.log(f"You: {message}", "chat_own")
+        return rec
 
     def send_im(self, to_id, message):
-        async def _send():
-            msg = Message("ImprovedInstantMessage",
-                Block("AgentData", AgentID=self._hippo.session.agent_id, SessionID=self._hippo.session.id),
-                Block("MessageBlock", FromAgentName=self.state.full_name, ToAgentID=UUID(to_id),
-                    ParentEstateID=0, RegionID=UUID(), Position=self._hippo.position or Vector3(0,0,0),
-                    Offline=0, Dialog=0, ID=UUID(str(_uuid.uuid4())), Timestamp=int(time.time()),
-                    FromAgentID=self._hippo.session.agent_id, Message=message, BinaryBucket=b""))
-            self._hippo.main_circuit.send(msg)
-        asyncio.run_coroutine_threadsafe(_send(), self._loop)
-        self.state.log(f"To {to_id}: {message}", "im")
+        return self.broadcast_im([to_id], message)[0]
+
+    def broadcast_im(self, recipients, message):
+        """Queues one IM per recipient in a single batch; bad UUIDs come back already failed."""
+        items = []
+        for to_id in recipients:
+            to_id = str(to_id).strip()
+            try: UUID(to_id); fields = {"to": to_id}
+            except ValueError: fields = {"to": to_id, "error": "invalid recipient"}
+            items.append((message, fields))
+        recs = self.outbox.enqueue("im", items)
+        for rec in recs:
+            if rec["status"] != "failed": self.state.log(f"To {rec['to']}: {message}", "im", {"to": rec["to"]})
+        return recs
+
+    def _deliver(self, rec):
+        """Outbox transport; runs on the client loop and returns the future of the sim's ack."""
+        if rec["lane"] == "chat":
+            return self._hippo.send_chat(rec["text"], channel=rec["channel"], chat_type=ChatType(rec["chat_type"]))
+        msg = Message("ImprovedInstantMessage",
+            Block("AgentData", AgentID=self._hippo.session.agent_id, SessionID=self._hippo.session.id),
+            Block("MessageBlock", FromAgentName=self.state.full_name, ToAgentID=UUID(rec["to"]),
+                ParentEstateID=0, RegionID=UUID(), Position=self._own_position() or Vector3(0,0,0),
+                Offline=0, Dialog=0, ID=UUID(str(_uuid.uuid4())), Timestamp=int(time.time()),
+                FromAgentID=self._hippo.session.agent_id, Message=rec["text"], BinaryBucket=b""))
+        return self._hippo.main_circuit.send_reliable(msg)
 
     def teleport_local(self, x, y, z):
         if not self.state.connected or not self._loop: return
-        with self.state.lock: gx, gy = self.state.grid_x, self.state.grid_y
+        gx, gy = self.state.grid
         handle = (gy * 256 << 32) | (gx * 256)
 
         def _do_teleport():
@@ -414,163 +2593,744 @@ class HippoSLClient:
         self.state.log(f"Initializing Teleport Sequence to <{x}, {y}, {z}>...", "system")
 
 # ==========================================
-# SECTION 4: WEB SERVER
+# SECTION 7: OFFLINE SIMULATOR
 # ==========================================
 
-client = HippoSLClient()
-
-HTML_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>BlackGlass OS v3.0</title>
+class SimNames(dict):
+    """Name cache: avatar id -> display name."""
+    lookup = dict.get
+
+class SimSession:
+    """The slice of a hippolyzer client session HippoSLClient relies on."""
+    def __init__(self, agent_id, login_data):
+        self.agent_id = agent_id
+        self.id = UUID.random()
+        self.login_data = login_data
+        self.regions = [types.SimpleNamespace(connected=asyncio.get_running_loop().create_future())]
+        self.message_handler = MessageHandler()
+        table = {}
+        self.objects = types.SimpleNamespace(table=table, lookup_fullid=table.get,
+                                             events=MessageHandler(take_by_default=False), name_cache=SimNames())
+
+class SimHippoClient:
+    """Headless stand-in for HippoClient: one flat region with kinematic movement, wandering avatars and chat.
+
+    In realtime mode it steps itself on the running loop; otherwise the caller drives step(), which is how
+    run_simulation() runs the client far faster than wall-clock time.
+    """
+    REGION = 256.0
+    WALK_SPEED = 3.2            # m/s, roughly the SL walk
+    BACK_SPEED = 1.6
+    AVATAR_SPEED = 1.2
+    PHRASES = ("hello", "anyone around?", "nice build", "brb", "lol", "where is the sandbox?", "hi all", "afk")
+
+    def __init__(self, avatars=12, chat_rate=0.2, churn=0.01, dt=0.1, realtime=True, seed=None,
+                 region="Simulation", grid=(0, 0), login_delay=None, circuit_delay=0.0, fail_rate=0.0):
+        self.rng = random.Random(seed)
+        self.login_delay = login_delay      # (min, max) seconds spent "at the login server"
+        self.circuit_delay = circuit_delay  # the circuit comes up this long after login returns
+        self.fail_rate = fail_rate
+        self.n_avatars, self.chat_rate, self.churn = avatars, chat_rate, churn
+        self.dt, self.realtime = dt, realtime
+        self.region, self.grid = region, grid
+        self.clock = 0.0
+        self.session = None
+        self.main_circuit = None
+        self.me = None          # our avatar, kept in the session's object table like HippoClient's
+        self.controls = 0
+        self.heading = 0.0
+        self.avatars = {}       # FullID -> [Object, heading]
+        self.counters = {"steps": 0, "agent_updates": 0, "chat_in": 0, "chat_out": 0, "im_out": 0,
+                         "teleports": 0, "object_events": 0}
+        self._replies = []
+        self._next_local_id = 1000
+        self._task = None
+
+    async def login(self, username, password, start_location=None, agree_to_tos=False):
+        self.username = username
+        if self.login_delay: await asyncio.sleep(self.rng.uniform(*self.login_delay))
+        if self.rng.random() < self.fail_rate: raise ConnectionError("simulated login failure")
+        login_data = {"circuit_code": self.rng.randrange(1 << 31)}
+        if all(self.grid): login_data.update(region_x=self.grid[0] * 256, region_y=self.grid[1] * 256)
+        self.session = SimSession(UUID.random(), login_data)
+        self.me = Object(FullID=self.session.agent_id, LocalID=1, PCode=PCode.AVATAR, ParentID=0,
+                         Position=Vector3(128.0, 128.0, 22.0))
+        self.session.objects.table[self.me.FullID] = self.me
+        if isinstance(start_location, str) and start_location.startswith("uri:"):
+            try: self.position = Vector3(*(float(v) for v in start_location.split("&")[1:4]))
+            except (TypeError, ValueError): pass
+        for _ in range(self.n_avatars): self._spawn()
+        if self.circuit_delay: asyncio.get_running_loop().call_later(self.circuit_delay, self._open_circuit)
+        else: self._open_circuit()
+
+    def _open_circuit(self):
+        self.main_circuit = self
+        if not self.session.regions[0].connected.done(): self.session.regions[0].connected.set_result(True)
+        if self.realtime: self._task = asyncio.get_running_loop().create_task(self._run())
 
-    <script type="importmap">
-      {
-        "imports": {
-          "three": "https://cdn.jsdelivr.net/npm/three@0.160.0/build/three.module.js",
-          "three/addons/": "https://cdn.jsdelivr.net/npm/three@0.160.0/examples/jsm/"
+    @property
+    def position(self):
+        return self.me.Position if self.me else None
+
+    @position.setter
+    def position(self, value):
+        self.me.Position = value
+
+    async def aclose(self):
+        if self._task: self._task.cancel()
+        self.main_circuit = None
+
+    def drop_circuit(self, kick_reason=None):
+        """Fault injection: a sim restart goes silent; a kick sends KickUser first."""
+        if kick_reason:
+            self.session.message_handler.handle(Message("KickUser",
+                Block("TargetBlock", TargetIP=0, TargetPort=0),
+                Block("UserInfo", AgentID=self.session.agent_id, SessionID=self.session.id, Reason=kick_reason)))
+        if self._task: self._task.cancel()
+
+    async def _run(self):
+        while self.main_circuit:
+            self.step()
+            await asyncio.sleep(self.dt)
+
+    def _spawn(self):
+        av_id = UUID.random()
+        self._next_local_id += 1
+        obj = Object(FullID=av_id, LocalID=self._next_local_id, PCode=PCode.AVATAR, ParentID=0,
+                     Position=Vector3(self.rng.uniform(0, self.REGION), self.rng.uniform(0, self.REGION), 22.0))
+        self.avatars[av_id] = [obj, self.rng.uniform(-math.pi, math.pi)]
+        self.session.objects.name_cache[av_id] = f"Sim Resident{self._next_local_id}"
+        self._emit(ObjectEvent(obj, {"Position", "ParentID", "NameValue"}, ObjectUpdateType.UPDATE))
+
+    def _emit(self, event):
+        self.counters["object_events"] += 1
+        self.session.objects.events.handle(event)
+
+    # Outbound traffic from HippoSLClient lands here (main_circuit is the simulator itself)
+    def send(self, msg):
+        if msg.name == "AgentUpdate":
+            ad = msg["AgentData"]
+            q = ad["BodyRotation"]
+            self.controls = int(ad["ControlFlags"])
+            self.heading = 2.0 * math.atan2(q.Z, q.W)
+            self.counters["agent_updates"] += 1
+        elif msg.name == "ImprovedInstantMessage":
+            self.counters["im_out"] += 1
+            to_id = msg["MessageBlock"]["ToAgentID"]
+            if to_id in self.avatars: self._replies.append(to_id)
+        elif msg.name == "TeleportLocationRequest":
+            p = msg["Info"]["Position"]
+            self.position = Vector3(min(max(p.X, 0.0), self.REGION - 0.01), min(max(p.Y, 0.0), self.REGION - 0.01), p.Z)
+            self.counters["teleports"] += 1
+
+    def send_reliable(self, msg):
+        # The simulated circuit never drops a packet, so every reliable send is acked at once
+        self.send(msg)
+        ack = Future(); ack.set_result(None)
+        return ack
+
+    def send_chat(self, message, channel=0, chat_type=ChatType.NORMAL):
+        self.counters["chat_out"] += 1
+        self._chat(self.session.agent_id, self.username, message, self.position, chat_type)
+        ack = Future(); ack.set_result(None)
+        return ack
+
+    def _chat(self, source_id, name, text, pos, chat_type=ChatType.NORMAL):
+        self.session.message_handler.handle(Message("ChatFromSimulator", Block("ChatData",
+            FromName=name, SourceID=source_id, OwnerID=source_id, SourceType=ChatSourceType.AGENT,
+            ChatType=chat_type, Audible=1, Position=pos, Message=text)))
+
+    def _im(self, source_id, text):
+        self.session.message_handler.handle(Message("ImprovedInstantMessage",
+            Block("AgentData", AgentID=source_id, SessionID=UUID()),
+            Block("MessageBlock", FromAgentName=self.session.objects.name_cache.lookup(source_id),
+                  FromAgentID=source_id, ToAgentID=self.session.agent_id, Dialog=IMDialogType.NOTHING_SPECIAL,
+                  Message=text)))
+
+    def step(self, dt=None):
+        """Advances the region by dt seconds of simulated time."""
+        dt = self.dt if dt is None else dt
+        rng, h = self.rng, self.session.message_handler
+        if not self.counters["steps"]:
+            h.handle(Message("RegionHandshake", Block("RegionInfo", SimName=self.region)))
+        self.counters["steps"] += 1
+        self.clock += dt
+
+        speed = self.WALK_SPEED if self.controls & AGENT_CONTROL_AT_POS else (
+            -self.BACK_SPEED if self.controls & AGENT_CONTROL_AT_NEG else 0.0)
+        if speed:
+            p, edge = self.position, self.REGION - 0.01
+            self.position = Vector3(min(max(p.X + math.cos(self.heading) * speed * dt, 0.0), edge),
+                                    min(max(p.Y + math.sin(self.heading) * speed * dt, 0.0), edge), p.Z)
+
+        for av_id, entry in list(self.avatars.items()):
+            obj, heading = entry
+            if rng.random() < self.churn * dt:
+                del self.avatars[av_id]
+                self._emit(ObjectEvent(obj, set(), ObjectUpdateType.KILL))
+                self._spawn()
+                continue
+            heading += rng.gauss(0.0, 0.5) * dt
+            x = obj.Position.X + math.cos(heading) * self.AVATAR_SPEED * dt
+            y = obj.Position.Y + math.sin(heading) * self.AVATAR_SPEED * dt
+            # Bounce off the region edge
+            if not 0.0 <= x < self.REGION or not 0.0 <= y < self.REGION:
+                heading += math.pi
+                x, y = min(max(x, 0.0), self.REGION - 0.01), min(max(y, 0.0), self.REGION - 0.01)
+            entry[1] = heading
+            obj.Position = Vector3(x, y, obj.Position.Z)
+            self._emit(ObjectEvent(obj, {"Position"}, ObjectUpdateType.UPDATE))
+
+        if self.avatars and rng.random() < self.chat_rate * dt:
+            obj = rng.choice(list(self.avatars.values()))[0]
+            self.counters["chat_in"] += 1
+            self._chat(obj.FullID, self.session.objects.name_cache.lookup(obj.FullID), rng.choice(self.PHRASES), obj.Position)
+        for av_id in self._replies: self._im(av_id, "auto-reply: away")
+        self._replies.clear()
+
+        # Region stats arrive with object updates roughly once a second
+        if int(self.clock) != int(self.clock - dt):
+            td = 1.0 - 0.1 * rng.random()
+            h.handle(Message("ObjectUpdate", Block("RegionData", RegionHandle=0, TimeDilation=int(td * 65535))))
+            h.handle(Message("SimStats", Block("Region", RegionX=self.grid[0], RegionY=self.grid[1]),
+                             Block("Stat", StatID=0, StatValue=td), Block("Stat", StatID=1, StatValue=45.0 * td),
+                             Block("Stat", StatID=13, StatValue=float(len(self.avatars) + 1))))
+
+def run_simulation(steps=10000, dt=0.2, avatars=12, chat_rate=0.2, mode="learn", windows=10, seed=None, qtable=None):
+    """Drives a HippoSLClient against SimHippoClient as fast as possible and reports latency and learning progress."""
+    def _ms(samples):
+        a = np.asarray(samples) * 1000.0
+        return {"mean": round(float(a.mean()), 4), "p50": round(float(np.percentile(a, 50)), 4),
+                "p99": round(float(np.percentile(a, 99)), 4), "max": round(float(a.max()), 4)} if len(a) else {}
+
+    async def _run():
+        sim = SimHippoClient(avatars=avatars, chat_rate=chat_rate, dt=dt, realtime=False, seed=seed)
+        table = qtable if qtable is not None else QTable(QLearningDrive.N_STATES, len(QLearningDrive.ACTIONS))
+        client = HippoSLClient(loop=asyncio.get_running_loop(), agent_key="sim.bench", history=HistoryStore(None),
+                               qtable=table, hippo_factory=lambda: sim)
+        client.clock = lambda: sim.clock
+        client.state.sink = None    # keep client log lines out of the report
+        client.neural.rng = np.random.default_rng(seed)
+        await client._connect("Sim", "Bench", "", "last")
+        client.neural.mode = mode
+        client.neural.toggle()
+
+        decide, decide_lat = client.neural.decide, []
+        def _timed_decide():
+            t = time.perf_counter(); r = decide()
+            decide_lat.append(time.perf_counter() - t)
+            return r
+        client.neural.decide = _timed_decide
+
+        step_lat, tick_lat, arrivals = [], [], []
+        per_window = max(steps // max(windows, 1), 1)
+        # The first decide() always routes a waypoint; only count arrivals after it
+        started, episodes = time.perf_counter(), client.neural.episodes + 1
+        for i in range(steps):
+            t0 = time.perf_counter()
+            sim.step()
+            t1 = time.perf_counter()
+            await client._tick()
+            t2 = time.perf_counter()
+            step_lat.append(t1 - t0); tick_lat.append(t2 - t1)
+            if (i + 1) % per_window == 0:
+                arrivals.append(client.neural.episodes - episodes)
+                episodes = client.neural.episodes
+        wall = time.perf_counter() - started
+        client.state.connected = False
+        return {
+            "steps": steps, "sim_seconds": round(sim.clock, 1), "wall_seconds": round(wall, 3),
+            "steps_per_second": round(steps / wall, 1), "speedup": round(sim.clock / wall, 1),
+            "decide_ms": _ms(decide_lat), "tick_ms": _ms(tick_lat), "sim_step_ms": _ms(step_lat),
+            "arrivals_per_window": arrivals, "autopilot": client.neural.stats(),
+            "agent_updates": dict(client.updates.counters), "sim": dict(sim.counters),
+            "messages_logged": client.state.seq, "nearby": len(client.avatars.table),
         }
-      }
-    </script>
-
-    <style>
-        :root {
-            --bg-color: #050505;
-            --win-bg: #111116;
-            --win-header: #1a1a20;
-            --accent: #00d4ff;
-            --text: #ececec;
-            --success: #00ff9d;
-            --err: #ff4757;
-            --im-color: #d000ff;
-            --taskbar-bg: #0a0a0a;
-            --border: #333;
+    return asyncio.run(_run())
+
+def _deep_size(obj, seen=None):
+    """sys.getsizeof summed over containers, dicts and slots records (each object counted once)."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen: return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict): size += sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, deque)): size += sum(_deep_size(v, seen) for v in obj)
+    elif hasattr(obj, "__slots__"): size += sum(_deep_size(getattr(obj, f, None), seen) for f in obj.__slots__)
+    return size
+
+def run_memory_benchmark(bots=20, steps=600, avatars=24, chat_rate=2.0, seed=None):
+    """Per-bot memory footprint: bots run against simulators until their message rings are full."""
+    import gc, tracemalloc
+
+    async def _run():
+        loop = asyncio.get_running_loop()
+        table = QTable(QLearningDrive.N_STATES, len(QLearningDrive.ACTIONS))
+        gc.collect()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        pairs = []
+        for i in range(bots):
+            sim = SimHippoClient(avatars=avatars, chat_rate=chat_rate, realtime=False, seed=None if seed is None else seed + i)
+            client = HippoSLClient(loop=loop, agent_key=f"mem.{i}", history=HistoryStore(None), qtable=table,
+                                   hippo_factory=lambda sim=sim: sim)
+            client.clock = lambda sim=sim: sim.clock
+            client.state.sink = None
+            client.neural.rng = np.random.default_rng(None if seed is None else seed + i)
+            await client._connect("Mem", f"Bot{i}", "", "last")
+            client.neural.toggle()
+            pairs.append((sim, client))
+        gc.collect()
+        connected = tracemalloc.get_traced_memory()[0] - base
+        t0 = time.perf_counter()
+        for _ in range(steps):
+            for sim, client in pairs:
+                sim.step()
+                await client._tick()
+        tick_us = (time.perf_counter() - t0) / (steps * bots) * 1e6
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - base
+        tracemalloc.stop()
+
+        state = pairs[0][1].state
+        messages, nearby = state.messages.as_list(), state.nearby_avatars
+        for sim, client in pairs:
+            client.state.connected = False
+            metrics.drop("agent", client.agent_key)
+        return {
+            "bots": bots, "steps": steps, "avatars_per_bot": avatars,
+            "kb_per_bot_connected": round(connected / bots / 1024, 1),
+            "kb_per_bot_running": round(retained / bots / 1024, 1),
+            "messages_per_bot": len(messages), "nearby_per_bot": len(nearby),
+            "bytes_per_message": round(sum(_deep_size(m) for m in messages) / max(len(messages), 1)),
+            "bytes_per_avatar": round(sum(_deep_size(a) for a in nearby) / max(len(nearby), 1)),
+            "bytes_stats_section": _deep_size(state._sections["stats"][1]),
+            "tick_us": round(tick_us, 1),
         }
+    return asyncio.run(_run())
 
-        * { box-sizing: border-box; user-select: none; }
+# ==========================================
+# SECTION 8: FLEET MANAGER
+# ==========================================
 
-        body {
-            margin: 0;
-            font-family: 'Consolas', 'Monaco', monospace;
-            background: var(--bg-color);
-            color: var(--text);
-            height: 100vh;
-            overflow: hidden;
-            background-image: radial-gradient(circle at center, #111 0%, #000 100%);
-        }
+def _rss_bytes():
+    """Resident set size of this process (0 when the platform can't tell us)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+    except Exception:
+        return 0
+
+def parse_roster(text):
+    """Accounts from a JSON list or CSV (header row optional): [(first, last, password, start), ...]."""
+    text = text.strip()
+    if text.startswith("["):
+        rows = json.loads(text)
+    else:
+        lines = [l for l in text.splitlines() if l.strip() and not l.lstrip().startswith("#")]
+        rows = list(csv.reader(lines))
+        header = [h.strip().lower() for h in rows[0]] if rows else []
+        if {"first", "username", "name"} & set(header): rows = [dict(zip(header, r)) for r in rows[1:]]
+        else: rows = [dict(zip(("first", "last", "password", "start"), r)) for r in rows]
+    roster = []
+    for i, row in enumerate(rows, 1):
+        if not isinstance(row, dict): raise ValueError(f"roster entry {i} is not an object")
+        row = {k.strip().lower(): str(v).strip() for k, v in row.items() if v is not None}
+        first, last = row.get("first", ""), row.get("last", "")
+        if not first and (row.get("username") or row.get("name")):
+            first, _, last = (row.get("username") or row.get("name")).partition(" ")
+        password = row.get("password", row.get("pass"))
+        if not first or password is None: raise ValueError(f"roster entry {i}: need first, last and password")
+        roster.append((first, last or "Resident", password, row.get("start") or "last"))
+    return roster
+
+class AgentFleet:
+    """Registry of HippoSLClient sessions sharing a small pool of asyncio loops."""
+    LOGIN_TIMEOUT = 45
+    JOB_HISTORY = 256
+    BULK_CONCURRENCY = 8        # simultaneous logins in a bulk job
+    BULK_STAGGER = 1.0          # mean seconds between login starts
+    BULK_JITTER = 0.5           # +/- fraction applied to the stagger
+
+    def __init__(self, loop_count=1, fetcher=None, history=None, qtable=None, trajectory_dir=None, hippo_factory=None,
+                 qtable_path=None):
+        self.lock = threading.Lock()
+        self.hippo_factory = hippo_factory
+        self.fetcher = fetcher if fetcher is not None else map_fetcher
+        self.history = history if history is not None else history_store
+        self._qtable = qtable
+        self._qtable_lock = threading.Lock()
+        self.qtable_path = qtable_path
+        self.trajectory_dir = trajectory_dir if trajectory_dir is not None else os.environ.get("BLACKGLASS_TRAJECTORIES")
+        self.tiles = self.fetcher.cache
+        self.agents = {}
+        self.aliases = {}
+        self.jobs = OrderedDict()
+        self.loop_count = max(1, int(loop_count))
+        self._loops = []
+        self._load = []
+        self._base_rss = _rss_bytes()
+        self._base_threads = threading.active_count()
 
-        #boot-screen {
-            position: absolute; top: 0; left: 0; width: 100%; height: 100%;
-            background: #000; z-index: 9999; padding: 40px;
-            font-size: 14px; color: #aaa;
-            display: flex; flex-direction: column;
-        }
-        .boot-line { margin-bottom: 5px; opacity: 0; animation: typeLine 0.1s forwards; }
-        @keyframes typeLine { to { opacity: 1; } }
+    @property
+    def qtable(self):
+        # One policy for the whole fleet, mapped on first use; the file also shares it across processes
+        with self._qtable_lock:
+            if self._qtable is None:
+                self._qtable = QTable(QLearningDrive.N_STATES, len(QLearningDrive.ACTIONS), self.qtable_path)
+            return self._qtable
 
-        #desktop {
-            position: absolute; top: 0; left: 0; width: 100%; height: calc(100% - 40px);
-            z-index: 1;
-        }
+    @staticmethod
+    def key_for(first, last):
+        return f"{first}.{last}".strip().lower()
 
-        .window {
-            position: absolute;
-            background: var(--win-bg);
-            border: 1px solid var(--border);
-            box-shadow: 0 10px 30px rgba(0,0,0,0.5);
-            display: flex; flex-direction: column;
-            opacity: 0; transform: scale(0.95);
-            transition: opacity 0.2s, transform 0.2s;
-            min-width: 300px; min-height: 200px;
-        }
-        .window.visible { opacity: 1; transform: scale(1); }
-
-        .window-header {
-            background: var(--win-header);
-            padding: 8px 10px;
-            display: flex; justify-content: space-between; align-items: center;
-            border-bottom: 1px solid var(--border);
-            cursor: grab;
-        }
-        .window-header:active { cursor: grabbing; }
-        .win-title { font-weight: bold; color: var(--accent); font-size: 0.9rem; text-transform: uppercase; letter-spacing: 1px; }
-        .win-controls span {
-            display: inline-block; width: 12px; height: 12px; border-radius: 50%; margin-left: 6px; cursor: pointer;
+    def _spawn_loop(self, idx):
+        loop = asyncio.new_event_loop()
+        def run_loop():
+            asyncio.set_event_loop(loop)
+            loop.run_forever()
+        thread = threading.Thread(target=run_loop, name=f"fleet-loop-{idx}", daemon=True)
+        thread.start()
+        profiler.watch(thread.name, loop, thread.ident)
+        return loop
+
+    def _pick_loop(self):
+        # Least-loaded loop in the pool; loops are started lazily
+        if len(self._loops) < self.loop_count:
+            self._loops.append(self._spawn_loop(len(self._loops)))
+            self._load.append(0)
+        idx = min(range(len(self._loops)), key=self._load.__getitem__)
+        self._load[idx] += 1
+        return self._loops[idx]
+
+    def get_or_create(self, first, last):
+        key = self.key_for(first, last)
+        with self.lock:
+            agent = self.agents.get(key)
+            if agent is None:
+                record = os.path.join(self.trajectory_dir, f"{key}.jsonl") if self.trajectory_dir else None
+                if record: os.makedirs(self.trajectory_dir, exist_ok=True)
+                agent = HippoSLClient(loop=self._pick_loop(), agent_key=key, fetcher=self.fetcher,
+                                      history=self.history, qtable=self.qtable, record_path=record,
+                                      hippo_factory=self.hippo_factory)
+                self.agents[key] = agent
+            return agent
+
+    def start_login(self, first, last, password, start_input="last"):
+        """Queues a login job and returns it immediately; poll it with job_status()."""
+        return self._start_login(first, last, password, start_input)[0]
+
+    def _start_login(self, first, last, password, start_input="last"):
+        agent = self.get_or_create(first, last)
+        job = {"id": _uuid.uuid4().hex[:12], "agent": agent.agent_key, "status": "pending",
+               "started": time.time(), "finished": None}
+        with self.lock:
+            self.jobs[job["id"]] = job
+            while len(self.jobs) > self.JOB_HISTORY: self.jobs.popitem(last=False)
+
+        def _finished(fut):
+            ok = not fut.cancelled() and fut.exception() is None and fut.result()
+            with self.lock:
+                job["status"] = "connected" if ok else "failed"
+                job["finished"] = time.time()
+                if ok and agent.agent_id: self.aliases[agent.agent_id] = agent.agent_key
+
+        fut = agent.begin_login(first, last, password, start_input)
+        fut.add_done_callback(_finished)
+        return dict(job), fut
+
+    def _control_loop(self):
+        """A loop for fleet-level coroutines (bulk logins); doesn't count towards agent load."""
+        with self.lock:
+            if not self._loops:
+                self._loops.append(self._spawn_loop(0))
+                self._load.append(0)
+            return self._loops[0]
+
+    def start_bulk_login(self, roster, concurrency=None, stagger=None, jitter=None):
+        """Logs in a roster of (first, last, password, start) concurrently; returns the bulk job."""
+        concurrency = max(1, int(concurrency or self.BULK_CONCURRENCY))
+        stagger = max(0.0, float(self.BULK_STAGGER if stagger is None else stagger))
+        jitter = min(max(float(self.BULK_JITTER if jitter is None else jitter), 0.0), 1.0)
+        accounts = OrderedDict()
+        for first, last, _, _ in roster: accounts.setdefault(self.key_for(first, last), {"status": "pending"})
+        job = {"id": _uuid.uuid4().hex[:12], "kind": "bulk", "status": "running", "total": len(accounts),
+               "concurrency": concurrency, "stagger": stagger, "started": time.time(), "finished": None,
+               "counts": dict.fromkeys(("pending", "connecting", "connected", "reused", "failed", "timeout"), 0),
+               "accounts": accounts, "events": EventBus(), "seq": 0, "progress": deque(maxlen=4096)}
+        job["counts"]["pending"] = len(accounts)
+        with self.lock:
+            self.jobs[job["id"]] = job
+            while len(self.jobs) > self.JOB_HISTORY: self.jobs.popitem(last=False)
+        asyncio.run_coroutine_threadsafe(self._run_bulk(job, roster, concurrency, stagger, jitter), self._control_loop())
+        return self.job_status(job["id"])
+
+    def _bulk_progress(self, job, key, status, **extra):
+        with self.lock:
+            prev = job["accounts"][key]
+            job["counts"][prev["status"]] -= 1
+            job["counts"][status] += 1
+            # Replace rather than mutate, so status readers never see a half-updated entry
+            job["accounts"][key] = dict(prev, status=status, **extra)
+            job["seq"] += 1
+            event = LogRecord(job["seq"], time.strftime("%H:%M:%S"), f"{key}: {status}", "progress",
+                              {"agent": key, "status": status, "counts": dict(job["counts"]), **extra})
+            job["progress"].append(event)
+        job["events"].publish("message", event, "progress")
+        if status in ("failed", "timeout"): log_sink.emit("fleet", f"bulk login {key}: {status} {extra.get('error', '')}".rstrip(), "warning")
+
+    async def _run_bulk(self, job, roster, concurrency, stagger, jitter):
+        slots = asyncio.Semaphore(concurrency)
+        loop = asyncio.get_running_loop()
+        tasks, seen, next_start = [], set(), loop.time()
+
+        async def _one(first, last, password, start_input, key):
+            t0 = time.time()
+            try:
+                _, fut = self._start_login(first, last, password, start_input)
+                try: ok = await asyncio.wait_for(asyncio.wrap_future(fut), self.LOGIN_TIMEOUT)
+                except asyncio.TimeoutError:
+                    self._bulk_progress(job, key, "timeout", seconds=round(time.time() - t0, 2)); return
+                except Exception as e:
+                    ok, err = False, str(e)
+                else: err = None
+                self._bulk_progress(job, key, "connected" if ok else "failed", seconds=round(time.time() - t0, 2),
+                                    **({"error": err or "login failed"} if not ok else {}))
+            finally:
+                slots.release()
+
+        for first, last, password, start_input in roster:
+            key = self.key_for(first, last)
+            if key in seen: continue
+            seen.add(key)
+            existing = self.resolve(key)
+            if existing and existing.state.connected:
+                self._bulk_progress(job, key, "reused"); continue
+            await slots.acquire()
+            # Space login-server hits out, with jitter so a fleet restart doesn't arrive in lockstep
+            delay = next_start - loop.time()
+            if delay > 0: await asyncio.sleep(delay)
+            next_start = loop.time() + stagger * random.uniform(1.0 - jitter, 1.0 + jitter)
+            self._bulk_progress(job, key, "connecting")
+            tasks.append(loop.create_task(_one(first, last, password, start_input, key)))
+        if tasks: await asyncio.gather(*tasks, return_exceptions=True)
+        with self.lock:
+            job["status"] = "done"
+            job["finished"] = time.time()
+            job["seq"] += 1
+            event = LogRecord(job["seq"], time.strftime("%H:%M:%S"), "bulk login finished", "done",
+                              {"counts": dict(job["counts"]), "seconds": round(job["finished"] - job["started"], 2)})
+            job["progress"].append(event)
+        job["events"].publish("message", event, "done")
+        log_sink.emit("fleet", f"bulk login finished: {event.meta['counts']}")
+
+    def subscribe_bulk(self, job_id, since=0):
+        """(bus, subscription) for a bulk job's progress, primed with the events it has missed."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.get("kind") != "bulk": return None
+        sub = job["events"].subscribe(max_messages=4096)
+        with self.lock: backlog = [e for e in job["progress"] if e.seq > since]
+        sub.prime(backlog, {})
+        return job["events"], sub
+
+    def job_status(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None: return None
+            if job.get("kind") == "bulk":
+                return dict({k: v for k, v in job.items() if k not in ("events", "progress", "seq")},
+                            counts=dict(job["counts"]), accounts=dict(job["accounts"]))
+            if job["status"] == "pending" and time.time() - job["started"] > self.LOGIN_TIMEOUT:
+                job["status"] = "timeout"
+                job["finished"] = time.time()
+            return dict(job)
+
+    def resolve(self, selector=None):
+        """Find an agent by key or UUID; with no selector, the sole agent (if exactly one)."""
+        with self.lock:
+            if not selector:
+                return next(iter(self.agents.values())) if len(self.agents) == 1 else None
+            selector = selector.strip().lower()
+            key = self.aliases.get(selector, selector)
+            return self.agents.get(key)
+
+    def remove(self, selector):
+        agent = self.resolve(selector)
+        if not agent: return False
+        agent.logout()
+        for sub in agent.state.events.subscribers: agent.state.events.unsubscribe(sub)
+        metrics.drop("agent", agent.agent_key)
+        with self.lock:
+            self.agents.pop(agent.agent_key, None)
+            if agent.agent_id: self.aliases.pop(agent.agent_id, None)
+            if agent._loop in self._loops:
+                self._load[self._loops.index(agent._loop)] -= 1
+        return True
+
+    def list_agents(self):
+        with self.lock: agents = list(self.agents.values())
+        return [{"key": a.agent_key, "id": a.agent_id, "name": a.state.full_name,
+                 "connected": a.state.connected, "region": a.state.current_region,
+                 "agent_updates": dict(a.updates.counters), "autopilot": a.neural.stats(),
+                 "state_lock": a.state.contention(), "outbox": a.outbox.stats(), "session": dict(a.session_stats),
+                 "responses": a.state.responses.stats()} for a in agents]
+
+    def collect_metrics(self):
+        """Scrape-time metrics from counters the fleet's components already keep."""
+        with self.lock: agents = list(self.agents.values())
+        def fam(name, help_text, kind="gauge", labels=("agent",)): return Metric(name, help_text, kind, labels)
+        connected = fam("blackglass_agent_connected", "1 while the agent's circuit is up.")
+        updates = fam("blackglass_agent_updates_total", "AgentUpdate decisions by outcome.", "counter", ("agent", "result"))
+        nearby = fam("blackglass_nearby_avatars", "Avatars currently tracked in the agent's region.")
+        logged = fam("blackglass_messages_logged_total", "Lines appended to the agent's message log.", "counter")
+        dilation = fam("blackglass_sim_time_dilation", "Latest published region time dilation.")
+        fps = fam("blackglass_sim_fps", "Latest published region simulator FPS.")
+        autopilot = fam("blackglass_autopilot_steps_total", "Autopilot decisions taken.", "counter")
+        lock_events = fam("blackglass_state_lock_total", "SharedState lock acquisitions and contended acquisitions.",
+                          "counter", ("agent", "event"))
+        lock_seconds = fam("blackglass_state_lock_seconds_total", "SharedState lock time spent waiting and held.",
+                           "counter", ("agent", "phase"))
+        outbox = fam("blackglass_outbox_messages_total", "Outbound chat/IM by delivery outcome.", "counter", ("agent", "status"))
+        outbox_depth = fam("blackglass_outbox_depth", "Outbound messages waiting, per lane (inflight: sent, awaiting the ack).", labels=("agent", "lane"))
+        packets = fam("blackglass_packets_received_total", "Inbound UDP messages by type (as of the last closed stats bucket).",
+                      "counter", ("agent", "message"))
+        for a in agents:
+            key = (a.agent_key,)
+            for name, n in a.sim_stats.totals.items(): packets.set(n, (a.agent_key, name))
+            connected.set(int(a.state.connected), key)
+            for result, n in a.updates.counters.items(): updates.set(n, (a.agent_key, result))
+            nearby.set(len(a.state.nearby_avatars), key)
+            logged.set(a.state.seq, key)
+            dilation.set(a.state.time_dilation, key)
+            fps.set(a.state.sim_fps, key)
+            autopilot.set(a.neural.steps, key)
+            lock = a.state.lock
+            lock_events.set(lock.acquisitions, (a.agent_key, "acquired"))
+            lock_events.set(lock.contended, (a.agent_key, "contended"))
+            lock_seconds.set(lock.wait, (a.agent_key, "wait"))
+            lock_seconds.set(lock.hold, (a.agent_key, "hold"))
+            o = a.outbox.stats()
+            for status in ("queued", "sent", "failed"): outbox.set(o[status], (a.agent_key, status))
+            for lane in OutboundQueue.LANES: outbox_depth.set(o[f"{lane}_depth"], (a.agent_key, lane))
+            outbox_depth.set(o["sending"], (a.agent_key, "inflight"))
+
+        process = fam("blackglass_process", "Process totals.", labels=("resource",))
+        process.set(len(agents), ("agents",))
+        process.set(threading.active_count(), ("threads",))
+        process.set(_rss_bytes(), ("rss_bytes",))
+        tiles = fam("blackglass_tile_cache_events_total", "Map tile cache hits, misses and evictions.", "counter", ("event",))
+        for event in ("memory_hits", "disk_hits", "misses", "evictions"): tiles.set(self.tiles.counters[event], (event,))
+        fetcher = fam("blackglass_tile_fetcher_total", "Map tile download activity.", "counter", ("event",))
+        for event, n in self.fetcher.counters.items(): fetcher.set(n, (event,))
+        history = fam("blackglass_history_rows", "Chat/IM archive rows by state.", labels=("state",))
+        h = self.history.stats()
+        for state in ("written", "pending", "dropped"): history.set(h[state], (state,))
+        logs = fam("blackglass_log_records", "Structured log records by state.", labels=("state",))
+        for state, n in log_sink.stats().items():
+            if state in ("written", "pending", "dropped"): logs.set(n, (state,))
+        return [connected, updates, nearby, logged, dilation, fps, autopilot, lock_events, lock_seconds, outbox, outbox_depth,
+                packets, process, tiles, fetcher, history, logs]
+
+    def stats(self):
+        """Process-level cost of the fleet, amortised per hosted agent."""
+        with self.lock: count = len(self.agents)
+        rss = _rss_bytes()
+        threads = threading.active_count()
+        per = max(count, 1)
+        return {
+            "agents": count,
+            "loops": len(self._loops),
+            "threads": threads,
+            "rss_bytes": rss,
+            "per_agent_rss_bytes": max(rss - self._base_rss, 0) // per if count else 0,
+            "per_agent_threads": round(max(threads - self._base_threads, 0) / per, 3) if count else 0,
+            "tiles": self.tiles.stats(),
+            "tile_fetcher": self.fetcher.stats(),
+            "history": self.history.stats(),
+            "log": log_sink.stats(),
         }
-        .ctrl-min { background: #f1c40f; }
-        .ctrl-max { background: #2ecc71; }
-        .ctrl-close { background: #e74c3c; }
 
-        .window-content { flex: 1; padding: 10px; overflow: hidden; position: relative; display: flex; flex-direction: column; }
+# ==========================================
+# SECTION 9: WEB SERVER
+# ==========================================
 
-        #taskbar {
-            position: absolute; bottom: 0; left: 0; width: 100%; height: 40px;
-            background: var(--taskbar-bg); border-top: 1px solid var(--border);
-            display: flex; align-items: center; padding: 0 10px; z-index: 9000;
-        }
-        #start-btn {
-            background: var(--accent); color: #000; padding: 5px 15px; font-weight: bold; cursor: pointer; margin-right: 20px;
-        }
-        #start-menu {
-            position: absolute; bottom: 42px; left: 10px; width: 200px; background: var(--win-bg);
-            border: 1px solid var(--border); display: none; z-index: 9001;
-        }
-        .menu-item { padding: 10px; border-bottom: 1px solid #222; cursor: pointer; color: #aaa; }
-        .menu-item:hover { background: #222; color: #fff; }
+fleet = AgentFleet(loop_count=os.environ.get("BLACKGLASS_LOOPS", 1))
+metrics.register_collector(fleet.collect_metrics)
 
-        .task-item {
-            padding: 5px 15px; background: #222; margin-right: 5px; cursor: pointer; border-bottom: 2px solid transparent; color: #888;
-        }
-        .task-item.active { border-bottom: 2px solid var(--accent); color: #fff; background: #333; }
-
-        #term-log { flex: 1; overflow-y: auto; font-size: 0.85rem; font-family: monospace; color: #0f0; }
-        .log-line { margin-bottom: 2px; }
-        .log-sys { color: #888; }
-        .log-err { color: var(--err); }
-        .log-suc { color: var(--success); }
-
-        #chat-history { flex: 1; overflow-y: auto; margin-bottom: 10px; background: #000; border: 1px solid #333; padding: 5px; }
-        .msg { margin-bottom: 4px; font-size: 0.9rem; word-wrap: break-word; }
-        .msg.chat { color: #ccc; }
-        .msg.chat_own { color: var(--accent); text-align: right; }
-        .msg.im { color: var(--im-color); border-left: 2px solid var(--im-color); padding-left: 5px; }
-        .reply-link { cursor: pointer; text-decoration: underline; font-size: 0.75em; margin-left: 5px; color: #fff; }
-
-        #chat-input-row { display: flex; gap: 5px; }
-        #chat-input { flex: 1; background: #000; border: 1px solid #444; color: #fff; padding: 5px; }
-        #chat-send { background: var(--accent); border: none; color: #000; font-weight: bold; cursor: pointer; padding: 0 15px; }
-
-        .login-field { margin-bottom: 10px; }
-        .login-field label { display: block; font-size: 0.8rem; color: #888; margin-bottom: 2px; }
-        .login-field input { width: 100%; background: #000; border: 1px solid #444; color: #fff; padding: 8px; }
-        #btn-login { width: 100%; padding: 10px; background: var(--accent); border: none; font-weight: bold; cursor: pointer; margin-top: 10px; }
-        #login-status { margin-top: 10px; font-size: 0.8rem; text-align: center; height: 20px; }
-
-        #three-container { width: 100%; height: 100%; background: #000; display: block; overflow: hidden; position: relative; }
-        #map-info { position: absolute; bottom: 5px; left: 5px; background: rgba(0,0,0,0.7); padding: 2px 5px; font-size: 0.8rem; z-index: 10; pointer-events: none; color: #fff; }
-
-        .tp-controls {
-            position: absolute; top: 10px; right: 10px; z-index: 20; display: flex; flex-direction: column; gap: 5px;
-        }
-        .tp-btn {
-            background: rgba(0, 212, 255, 0.2); border: 1px solid var(--accent); color: var(--accent);
-            font-weight: bold; cursor: pointer; padding: 5px 10px; font-size: 0.8rem; text-align: center;
-        }
-        .tp-btn:hover { background: var(--accent); color: #000; }
+DATA_DIR = os.environ.get("BLACKGLASS_HOME", os.path.join(os.path.expanduser("~"), ".blackglass"))
 
-        #radar-canvas { background: #000; width: 100%; height: 100%; border: 1px solid #333; }
+def open_data_dir(data_dir, history=False, history_days=None):
+    """Points the log, tile cache, Q-table, compressed assets and (opt-in) chat archive at `data_dir`; env vars still win."""
+    env = os.environ.get
+    log_sink.open(env("BLACKGLASS_LOG", os.path.join(data_dir, "blackglass.jsonl")))
+    map_tiles.open(env("BLACKGLASS_TILE_CACHE", os.path.join(data_dir, "tiles")))
+    if history: history_store.open(env("BLACKGLASS_HISTORY", os.path.join(data_dir, "history.db")), history_days)
+    fleet.qtable_path = env("BLACKGLASS_QTABLE", os.path.join(data_dir, "qtable.npy"))
+    assets.cache_dir = os.path.join(data_dir, "assets")
 
-        .stat-row { display: flex; justify-content: space-between; border-bottom: 1px solid #222; padding: 5px 0; }
-        .stat-val { color: var(--accent); font-weight: bold; }
+class _CountingWriter:
+    """Wraps a handler's wfile to count bytes written for the response-size histogram."""
+    __slots__ = ("raw", "written")
 
-        ::-webkit-scrollbar { width: 8px; }
-        ::-webkit-scrollbar-track { background: #111; }
-        ::-webkit-scrollbar-thumb { background: #333; }
-        ::-webkit-scrollbar-thumb:hover { background: #555; }
-    </style>
+    def __init__(self, raw):
+        self.raw = raw
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return self.raw.write(data)
+
+    def __getattr__(self, name): return getattr(self.raw, name)
+
+class StaticAsset:
+    """A response encoded once: identity, gzip and (with the brotli package) br variants plus a content ETag."""
+    def __init__(self, body, content_type, cache_control="no-cache", variants=None):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.etag = f'"{self.digest[:20]}"'
+        self.variants = {"identity": body}
+        self.variants.update(variants if variants is not None else self.compress(body))
+
+    @staticmethod
+    def compress(body):
+        out = {"gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None: out["br"] = brotli.compress(body, quality=11)
+        return out
+
+    def negotiate(self, accept_encoding):
+        """(encoding, body) for an Accept-Encoding header; smallest accepted variant wins."""
+        accepted = set()
+        for part in (accept_encoding or "").split(","):
+            name, _, params = part.partition(";")
+            q = params.replace(" ", "")
+            try:
+                if q.startswith("q=") and float(q[2:]) <= 0: continue
+            except ValueError: continue
+            accepted.add(name.strip().lower())
+        for enc in ("br", "gzip"):
+            if enc in self.variants and (enc in accepted or "*" in accepted): return enc, self.variants[enc]
+        return "identity", self.variants["identity"]
+
+HTML_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>BlackGlass OS v3.0</title>
+
+    <script type="importmap">{importmap}</script>
+
+    <link rel="stylesheet" href="{stylesheet}">
+{preload}
 </head>
 <body>
     <div id="boot-screen">
@@ -693,437 +3453,480 @@ HTML_TEMPLATE = """
         <div class="menu-item" style="border-top: 1px solid #444; color: #ff4757;" onclick="location.reload()">SHUTDOWN</div>
     </div>
 
-    <script type="module">
-        import * as THREE from 'three';
-        import { OrbitControls } from 'three/addons/controls/OrbitControls.js';
-        import { VRButton } from 'three/addons/webxr/VRButton.js';
-
-        const wm = {
-            zIndex: 100,
-            windows: document.querySelectorAll('.window'),
-            init() {
-                this.windows.forEach(win => {
-                    this.makeDraggable(win);
-                    win.addEventListener('mousedown', () => this.focus(win.id));
-                    win.querySelector('.ctrl-close').onclick = () => this.close(win.id);
-                    win.querySelector('.ctrl-min').onclick = () => this.minimize(win.id);
-                });
-            },
-            focus(id) {
-                const win = document.getElementById(id);
-                if(win.style.display === 'none' || win.style.display === '') {
-                    win.style.display = 'flex';
-                    setTimeout(() => win.classList.add('visible'), 10);
-                }
-                win.style.zIndex = ++this.zIndex;
-                document.getElementById('start-menu').style.display = 'none';
-                this.updateTaskbar(id);
-            },
-            updateTaskbar(winId) {
-                document.querySelectorAll('.task-item').forEach(t => t.classList.remove('active'));
-                const map = {'win-login':'task-auth','win-term':'task-term','win-comm':'task-comm','win-map':'task-map','win-radar':'task-radar','win-mon':'task-mon'};
-                const taskId = map[winId];
-                if(taskId) {
-                    const taskEl = document.getElementById(taskId);
-                    if(taskEl) taskEl.classList.add('active');
-                }
-            },
-            open(id) {
-                this.focus(id);
-                const taskID = id.replace('win-', 'task-');
-                const taskEl = document.getElementById(taskID);
-                if(taskEl) taskEl.style.display = 'block';
-            },
-            close(id) {
-                const win = document.getElementById(id);
-                win.classList.remove('visible');
-                setTimeout(() => win.style.display = 'none', 200);
-            },
-            minimize(id) { this.close(id); },
-            toggleStart() {
-                const menu = document.getElementById('start-menu');
-                menu.style.display = menu.style.display === 'block' ? 'none' : 'block';
-            },
-            makeDraggable(el) {
-                let pos1 = 0, pos2 = 0, pos3 = 0, pos4 = 0;
-                const header = el.querySelector('.window-header');
-                header.onmousedown = dragMouseDown;
-                function dragMouseDown(e) {
-                    e = e || window.event;
-                    e.preventDefault();
-                    pos3 = e.clientX;
-                    pos4 = e.clientY;
-                    document.onmouseup = closeDragElement;
-                    document.onmousemove = elementDrag;
-                    wm.focus(el.id);
-                }
-                function elementDrag(e) {
-                    e = e || window.event;
-                    e.preventDefault();
-                    pos1 = pos3 - e.clientX;
-                    pos2 = pos4 - e.clientY;
-                    pos3 = e.clientX;
-                    pos4 = e.clientY;
-                    el.style.top = (el.offsetTop - pos2) + "px";
-                    el.style.left = (el.offsetLeft - pos1) + "px";
-                }
-                function closeDragElement() {
-                    document.onmouseup = null;
-                    document.onmousemove = null;
-                }
-            }
-        };
-
-        const app = {
-            msgCount: 0,
-            controls: 0,
-            scene: null,
-            camera: null,
-            renderer: null,
-            mapPlane: null,
-            avatars: [],
-            lastMapData: null,
-            raycaster: new THREE.Raycaster(),
-            mouse: new THREE.Vector2(),
-            neuralActive: false,
-
-            async login() {
-                const btn = document.getElementById('btn-login');
-                const stat = document.getElementById('login-status');
-                btn.disabled = true;
-                stat.innerText = "HANDSHAKING...";
-                stat.style.color = "#00d4ff";
-
-                const res = await fetch('/api/login', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({
-                        first: document.getElementById('inp-first').value,
-                        last: document.getElementById('inp-last').value,
-                        pass: document.getElementById('inp-pass').value,
-                        start: document.getElementById('inp-loc').value
-                    })
-                });
-                const data = await res.json();
-
-                if(data.success) {
-                    stat.innerText = "UPLINK ESTABLISHED";
-                    stat.style.color = "#00ff9d";
-                    setTimeout(() => {
-                        wm.close('win-login');
-                        this.openSession();
-                    }, 1000);
-                } else {
-                    stat.innerText = "ACCESS DENIED";
-                    stat.style.color = "#ff4757";
-                    btn.disabled = false;
-                }
-            },
-
-            openSession() {
-                ['win-comm', 'win-map', 'win-radar', 'win-mon'].forEach(id => wm.open(id));
-                setTimeout(() => this.initThree(), 100);
-            },
-
-            async sendChat() {
-                const input = document.getElementById('chat-input');
-                if(!input.value) return;
-                await fetch('/api/chat', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({msg: input.value})
-                });
-                input.value = "";
-            },
-
-            async teleportLocal(x, y, z) {
-                await fetch('/api/teleport', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({region: "local", x: x, y: y, z: z})
-                });
-                wm.open('win-comm');
-            },
-
-            setReply(id) {
-                const input = document.getElementById('chat-input');
-                input.value = "/im " + id + " ";
-                input.focus();
-            },
-
-            toggleNeural() {
-                this.neuralActive = !this.neuralActive;
-                fetch('/api/neural', { method: 'POST' });
-                const btn = document.getElementById('btn-neural');
-                if(this.neuralActive) {
-                    btn.innerText = "AI AUTOPILOT: ON";
-                    btn.style.background = "#00ff9d";
-                    btn.style.color = "#000";
-                } else {
-                    btn.innerText = "AI AUTOPILOT: OFF";
-                    btn.style.background = "";
-                    btn.style.color = "";
-                }
-            },
-
-            initThree() {
-                if (this.renderer) return;
-                const container = document.getElementById('three-container');
-                const width = container.clientWidth || 600;
-                const height = container.clientHeight || 500;
-
-                this.scene = new THREE.Scene();
-                this.scene.background = new THREE.Color(0x111116);
-                this.scene.fog = new THREE.Fog(0x111116, 50, 200);
-
-                this.camera = new THREE.PerspectiveCamera(60, width / height, 0.1, 500);
-                this.camera.position.set(128, 100, 180);
-                this.camera.lookAt(128, 0, 128);
-
-                this.renderer = new THREE.WebGLRenderer({ antialias: true });
-                this.renderer.setSize(width, height);
-                this.renderer.xr.enabled = true;
-                container.appendChild(this.renderer.domElement);
-                container.appendChild(VRButton.createButton(this.renderer));
-
-                const controls = new OrbitControls(this.camera, this.renderer.domElement);
-                controls.target.set(128, 0, 128);
-                controls.update();
-
-                const ambientLight = new THREE.AmbientLight(0xffffff, 0.5);
-                this.scene.add(ambientLight);
-                const dirLight = new THREE.DirectionalLight(0xffffff, 0.8);
-                dirLight.position.set(0, 100, 50);
-                this.scene.add(dirLight);
-
-                const geometry = new THREE.PlaneGeometry(256, 256);
-                geometry.rotateX(-Math.PI / 2);
-                geometry.translate(128, 0, 128);
-
-                const material = new THREE.MeshStandardMaterial({
-                    color: 0x444444,
-                    roughness: 0.8,
-                    metalness: 0.2
-                });
-                this.mapPlane = new THREE.Mesh(geometry, material);
-                this.scene.add(this.mapPlane);
-
-                const gridHelper = new THREE.GridHelper(256, 16, 0x00d4ff, 0x333333);
-                gridHelper.position.set(128, 0.1, 128);
-                this.scene.add(gridHelper);
-
-                this.renderer.domElement.addEventListener('click', (event) => {
-                    const rect = this.renderer.domElement.getBoundingClientRect();
-                    this.mouse.x = ((event.clientX - rect.left) / rect.width) * 2 - 1;
-                    this.mouse.y = -((event.clientY - rect.top) / rect.height) * 2 + 1;
-
-                    this.raycaster.setFromCamera(this.mouse, this.camera);
-                    const intersects = this.raycaster.intersectObjects([this.mapPlane, ...this.avatars]);
-
-                    if (intersects.length > 0) {
-                        const pt = intersects[0].point;
-                        console.log("Teleporting to", pt);
-                        this.teleportLocal(pt.x, pt.z, 25);
-                    }
-                });
-
-                new ResizeObserver(() => {
-                    const w = container.clientWidth;
-                    const h = container.clientHeight;
-                    if (w > 0 && h > 0) {
-                        this.renderer.setSize(w, h);
-                        this.camera.aspect = w / h;
-                        this.camera.updateProjectionMatrix();
-                    }
-                }).observe(container);
-
-                this.animateThree();
-            },
-
-            updateMapTexture(base64Data) {
-                if (!this.scene || base64Data === this.lastMapData) return;
-                this.lastMapData = base64Data;
-
-                const image = new Image();
-                image.src = "data:image/jpeg;base64," + base64Data;
-                image.onload = () => {
-                    const texture = new THREE.Texture(image);
-                    texture.needsUpdate = true;
-                    this.mapPlane.material.map = texture;
-                    this.mapPlane.material.needsUpdate = true;
-                    this.mapPlane.material.color.setHex(0xffffff);
-                };
-            },
-
-            updateAvatars(nearbyList) {
-                if (!this.scene) return;
-                this.avatars.forEach(m => this.scene.remove(m));
-                this.avatars = [];
-
-                nearbyList.forEach(av => {
-                    const geometry = new THREE.CapsuleGeometry(1, 2, 4, 8);
-                    const material = new THREE.MeshStandardMaterial({ color: 0xff00ff, emissive: 0x440044 });
-                    const mesh = new THREE.Mesh(geometry, material);
-                    mesh.position.set(av.x, av.z/2 + 2, av.y);
-                    mesh.userData = { x: av.x, y: av.y };
-                    this.scene.add(mesh);
-                    this.avatars.push(mesh);
-                });
-            },
-
-            animateThree() {
-                this.renderer.setAnimationLoop(() => {
-                    this.renderer.render(this.scene, this.camera);
-                });
-            },
-
-            drawRadar(avatars) {
-                const canvas = document.getElementById('radar-canvas');
-                const ctx = canvas.getContext('2d');
-                canvas.width = canvas.parentElement.clientWidth;
-                canvas.height = canvas.parentElement.clientHeight;
-                const cx = canvas.width / 2;
-                const cy = canvas.height / 2;
-
-                ctx.fillStyle = '#000';
-                ctx.fillRect(0,0, canvas.width, canvas.height);
-
-                ctx.strokeStyle = '#003300';
-                ctx.beginPath(); ctx.arc(cx, cy, 30, 0, 7); ctx.stroke();
-                ctx.beginPath(); ctx.arc(cx, cy, 60, 0, 7); ctx.stroke();
-                ctx.beginPath(); ctx.arc(cx, cy, 90, 0, 7); ctx.stroke();
-
-                ctx.fillStyle = '#00ff00';
-                ctx.beginPath(); ctx.arc(cx, cy, 3, 0, 7); ctx.fill();
-
-                avatars.forEach(av => {
-                    const px = (av.x / 256) * canvas.width;
-                    const py = ((256-av.y) / 256) * canvas.height;
-
-                    ctx.fillStyle = '#ff00ff';
-                    ctx.beginPath(); ctx.arc(px, py, 4, 0, 7); ctx.fill();
-                });
-            },
-
-            poll: async function() {
-                try {
-                    const res = await fetch('/api/poll');
-                    const data = await res.json();
-
-                    const term = document.getElementById('term-log');
-                    const chat = document.getElementById('chat-history');
-
-                    if (data.messages.length > this.msgCount) {
-                        for (let i = this.msgCount; i < data.messages.length; i++) {
-                            const m = data.messages[i];
-                            if (['system', 'error', 'success'].includes(m.type)) {
-                                const div = document.createElement('div');
-                                div.className = 'log-line';
-                                if(m.type === 'error') div.className += ' log-err';
-                                if(m.type === 'success') div.className += ' log-suc';
-                                if(m.type === 'system') div.className += ' log-sys';
-                                div.innerText = `[${m.time}] ${m.text}`;
-                                term.appendChild(div);
-                                term.scrollTop = term.scrollHeight;
-                            }
-                            if (['chat', 'chat_own', 'im'].includes(m.type)) {
-                                const div = document.createElement('div');
-                                div.className = `msg ${m.type}`;
-                                let content = `[${m.time}] ${m.text}`;
-                                if(m.type === 'im' && m.meta && m.meta.id) {
-                                    content += ` <span class="reply-link" onclick="app.setReply('${m.meta.id}')">[REPLY]</span>`;
-                                }
-                                div.innerHTML = content;
-                                chat.appendChild(div);
-                                chat.scrollTop = chat.scrollHeight;
-                            }
-                        }
-                        this.msgCount = data.messages.length;
-                    }
-
-                    if (data.map) this.updateMapTexture(data.map);
-                    if (data.nearby) this.updateAvatars(data.nearby);
-
-                    if(data.region && data.region !== "Unknown") {
-                        document.getElementById('map-info').innerText = "SECTOR: " + data.region;
-                    }
-
-                    this.drawRadar(data.nearby);
-
-                    document.getElementById('stat-fps').innerText = data.stats.fps.toFixed(1);
-                    document.getElementById('stat-dil').innerText = data.stats.dilation.toFixed(2);
-                    document.getElementById('stat-pos').innerText = `<${data.stats.pos.x.toFixed(0)}, ${data.stats.pos.y.toFixed(0)}>`;
-
-                } catch (e) { console.error(e); }
-            }
-        };
-
-        window.onload = () => {
-            window.app = app;
-            window.wm = wm;
-
-            let lines = document.querySelectorAll('.boot-line');
-            let delay = 0;
-            lines.forEach((line) => {
-                setTimeout(() => line.style.opacity = 1, delay);
-                delay += (Math.random() * 500) + 200;
-            });
-            setTimeout(() => {
-                document.getElementById('boot-screen').style.display = 'none';
-                document.getElementById('desktop').style.display = 'block';
-                document.getElementById('taskbar').style.display = 'flex';
-                wm.init();
-                setTimeout(() => wm.focus('win-login'), 100);
-                setTimeout(() => wm.focus('win-term'), 300);
-
-                setInterval(() => {
-                    document.getElementById('clock').innerText = new Date().toLocaleTimeString();
-                }, 1000);
-                setInterval(() => app.poll(), 500);
-            }, delay + 800);
-        };
-    </script>
+    <script type="module" src="{script}"></script>
 </body>
 </html>
 """
 
+class AssetBundle:
+    """The UI's static files, served from /static/ under content-hashed names with immutable caching.
+
+    Nothing is read until the server starts. Compressed variants are cached by content hash under
+    `cache_dir` (in memory only when it is None), so restarts don't re-run brotli over the vendored Three.js."""
+    TYPES = {".js": "text/javascript; charset=utf-8", ".css": "text/css; charset=utf-8",
+             ".json": "application/json", ".ico": "image/x-icon"}
+    IMMUTABLE = "public, max-age=31536000, immutable"
+    ENCODINGS = {"gzip": ".gz", "br": ".br"}
+    THREE_VERSION = "0.160.0"
+    THREE_FILES = {"three": "build/three.module.js",
+                   "three/addons/controls/OrbitControls.js": "examples/jsm/controls/OrbitControls.js",
+                   "three/addons/webxr/VRButton.js": "examples/jsm/webxr/VRButton.js"}
+    THREE_CDN = "https://cdn.jsdelivr.net/npm/three@{version}/"
+
+    def __init__(self, root, template, cache_dir=None):
+        self.root = root
+        self.template = template
+        self.cache_dir = cache_dir
+        self.assets = {}    # url -> StaticAsset
+        self.urls = {}      # path relative to root -> hashed url
+        self.lock = threading.Lock()
+        self._page = None
+
+    def page(self):
+        """The rendered index page; the first call hashes and compresses every file."""
+        with self.lock:
+            if self._page is None:
+                self.load()
+                self._page = self.index(self.template)
+            return self._page
+
+    def load(self):
+        for dirpath, _, files in os.walk(self.root):
+            for name in sorted(files):
+                if os.path.splitext(name)[1] in self.TYPES:
+                    self.add(os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, "/"))
+        return self
+
+    def add(self, rel):
+        path = os.path.join(self.root, rel)
+        with open(path, "rb") as f: body = f.read()
+        stem, ext = os.path.splitext(rel)
+        asset = StaticAsset(body, self.TYPES[ext], self.IMMUTABLE, self._variants(body))
+        url = f"/static/{stem}.{asset.digest[:12]}{ext}"
+        self.assets[url] = asset
+        self.urls[rel] = url
+        return url
+
+    def _variants(self, body):
+        if not self.cache_dir: return StaticAsset.compress(body)
+        base = os.path.join(self.cache_dir, hashlib.sha256(body).hexdigest()[:32])
+        cached = {}
+        for enc, suffix in self.ENCODINGS.items():
+            try:
+                with open(base + suffix, "rb") as f: cached[enc] = f.read()
+            except OSError:
+                pass
+        if len(cached) == len(self.ENCODINGS) or (brotli is None and "gzip" in cached): return cached
+        fresh = StaticAsset.compress(body)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for enc, data in fresh.items():
+                with open(base + self.ENCODINGS[enc] + ".tmp", "wb") as f: f.write(data)
+                os.replace(base + self.ENCODINGS[enc] + ".tmp", base + self.ENCODINGS[enc])
+        except OSError:
+            pass    # an unwritable cache just compresses again next start
+        return fresh
+
+    def lookup(self, path):
+        if self._page is None: self.page()
+        return self.assets.get(path)
+
+    def import_map(self):
+        """Bare specifiers the UI imports, resolved to the vendored copies (or the CDN when absent)."""
+        imports, missing = {}, []
+        for spec, rel in self.THREE_FILES.items():
+            url = self.urls.get(f"vendor/three/{rel}")
+            if url is None:
+                missing.append(rel)
+                url = self.THREE_CDN.format(version=self.THREE_VERSION) + rel
+            imports[spec] = url
+        return {"imports": imports}, missing
+
+    def index(self, template):
+        if "blackglass.js" not in self.urls or "blackglass.css" not in self.urls:
+            log_sink.emit("assets", f"UI assets not found in {self.root}; set BLACKGLASS_STATIC", "error")
+            return StaticAsset(f"BlackGlass UI assets not found in {self.root}".encode('utf-8'), 'text/plain; charset=utf-8')
+        imports, missing = self.import_map()
+        if missing:
+            log_sink.emit("assets", f"Three.js not vendored ({', '.join(missing)}); loading it from the CDN. "
+                          "Run --fetch-vendor to serve it locally.", "warning")
+        preload = [self.urls["blackglass.js"]] + [u for u in imports["imports"].values() if u.startswith("/static/")]
+        page = template.format(importmap=json.dumps(imports), stylesheet=self.urls["blackglass.css"],
+                               script=self.urls["blackglass.js"],
+                               preload="\n".join(f'    <link rel="modulepreload" href="{u}">' for u in preload))
+        return StaticAsset(page.encode('utf-8'), 'text/html; charset=utf-8')
+
+    @classmethod
+    def fetch_vendor(cls, root):
+        """Downloads the pinned Three.js modules into root/vendor/three (run once on a connected machine)."""
+        import urllib.request
+        base = cls.THREE_CDN.format(version=cls.THREE_VERSION)
+        for rel in cls.THREE_FILES.values():
+            dest = os.path.join(root, "vendor", "three", *rel.split("/"))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with urllib.request.urlopen(base + rel, timeout=30) as resp, open(dest, "wb") as f: f.write(resp.read())
+            print(f"{base + rel} -> {dest}")
+
+STATIC_DIR = os.environ.get("BLACKGLASS_STATIC", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+assets = AssetBundle(STATIC_DIR, HTML_TEMPLATE)
+
 class WebHandler(BaseHTTPRequestHandler):
-    def do_POST(self):
+    SSE_KEEPALIVE = 15
+    ROUTES = frozenset(("/", "/api/login", "/api/logout", "/api/chat", "/api/im/broadcast", "/api/outbox", "/api/teleport", "/api/neural", "/api/agents",
+                        "/api/stats", "/api/messages", "/api/history", "/api/nearby", "/api/events",
+                        "/api/login/status", "/api/fleet/login", "/api/fleet/login/events", "/api/poll",
+                        "/api/profile", "/api/profile/flame", "/metrics"))
+
+    def setup(self):
+        super().setup()
+        self.wfile = _CountingWriter(self.wfile)
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def _instrumented(self, method, handler):
+        """Runs one request, then records count, latency and response size under a bounded route label."""
+        t0, start = time.perf_counter(), self.wfile.written
+        self._status = None
+        try:
+            handler()
+        finally:
+            path = urllib.parse.urlsplit(self.path).path
+            route = path if path in self.ROUTES else ("/api/map" if path.startswith("/api/map/") else
+                                                      "/static" if path.startswith("/static/") else "other")
+            HTTP_REQUESTS.inc((method, route, str(self._status or 500)))
+            HTTP_SECONDS.observe(time.perf_counter() - t0, (route,))
+            HTTP_BYTES.observe(self.wfile.written - start, (route,))
+
+    def do_POST(self): self._instrumented("POST", self._post)
+    def do_GET(self): self._instrumented("GET", self._get)
+
+    def _route(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        query = {k: v[-1] for k, v in urllib.parse.parse_qs(parsed.query, keep_blank_values=True).items()}
+        return parsed.path, query
+
+    def _send_json(self, obj, code=200):
+        self._send_body(dumps(obj), code)
+
+    def _send_body(self, body, code=200, content_type='application/json', headers=()):
+        self.send_response(code)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers: self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_asset(self, asset):
+        headers = [('ETag', asset.etag), ('Cache-Control', asset.cache_control), ('Vary', 'Accept-Encoding')]
+        if self.headers.get('If-None-Match') == asset.etag:
+            self.send_response(304)
+            for name, value in headers: self.send_header(name, value)
+            self.end_headers(); return
+        encoding, body = asset.negotiate(self.headers.get('Accept-Encoding'))
+        if encoding != "identity": headers.append(('Content-Encoding', encoding))
+        self._send_body(body, content_type=asset.content_type, headers=headers)
+
+    def _post(self):
         length = int(self.headers.get('Content-Length', 0))
         if length > 0:
             body = json.loads(self.rfile.read(length))
         else:
             body = {}
-            
+        path, query = self._route()
+        selector = body.get('agent') or query.get('agent')
+
         res = {"success": False}
-        if self.path == '/api/login':
-            res["success"] = client.login(body['first'], body['last'], body['pass'], body['start'])
-        elif self.path == '/api/chat':
-            client.send_chat(body['msg']); res["success"] = True
-        elif self.path == '/api/teleport':
+        if path == '/api/login':
+            job = fleet.start_login(body['first'], body['last'], body['pass'], body['start'])
+            res.update(success=True, agent=job["agent"], job=job["id"])
+            self._send_json(res); return
+        if path == '/api/fleet/login':
+            try:
+                roster = parse_roster(body['csv']) if 'csv' in body else parse_roster(json.dumps(body.get('roster') or []))
+                if not roster: raise ValueError("empty roster")
+                job = fleet.start_bulk_login(roster, body.get('concurrency'), body.get('stagger'), body.get('jitter'))
+            except (ValueError, TypeError) as e:
+                self._send_json(dict(res, error=str(e)), 400); return
+            self._send_json(dict(res, success=True, job=job["id"], total=job["total"])); return
+        if path == '/api/logout':
+            res["success"] = fleet.remove(selector)
+            self._send_json(res); return
+        if path == '/api/profile':
+            try: threshold = float(body['threshold_ms']) / 1000.0 if body.get('threshold_ms') else None
+            except (TypeError, ValueError):
+                self._send_json(dict(res, error="bad threshold_ms"), 400); return
+            if body.get('enable', True): profiler.start(threshold)
+            else: profiler.stop()
+            self._send_json(dict(profiler.report(), success=True)); return
+
+        client = fleet.resolve(selector)
+        if client is None:
+            res["error"] = "unknown agent" if selector else "agent selector required"
+            self._send_json(res, 404); return
+
+        if path == '/api/chat':
+            rec = client.send_chat(body['msg'])
+            res.update(success=rec is not None and rec["status"] != "failed", message=rec)
+        elif path == '/api/im/broadcast':
+            recipients = body.get('to')
+            if not isinstance(recipients, list) or not recipients or not body.get('msg'):
+                res["error"] = "expected {to: [uuid, ...], msg: text}"
+                self._send_json(res, 400); return
+            if not client.state.connected:
+                res["error"] = "agent not connected"
+                self._send_json(res, 409); return
+            recs = client.broadcast_im(recipients, body['msg'])
+            res.update(success=True, messages=recs, queued=sum(r["status"] == "queued" for r in recs))
+        elif path == '/api/teleport':
             if body.get('region') == 'local':
                 client.teleport_local(body['x'], body['y'], body['z'])
             else:
                 client.log(f"Teleporting to {body['region']}...", "system")
             res["success"] = True
-        elif self.path == '/api/neural':
-            active = client.neural.toggle()
-            client.log(f"NEURAL AUTOPILOT {'ACTIVE' if active else 'DISENGAGED'}", "system")
-            res["success"] = True
-            
-        self.send_response(200); self.send_header('Content-type', 'application/json'); self.end_headers()
-        self.wfile.write(json.dumps(res).encode('utf-8'))
-
-    def do_GET(self):
-        if self.path == '/api/poll':
-            self.send_response(200); self.send_header('Content-type', 'application/json'); self.end_headers()
-            self.wfile.write(json.dumps(client.state.snapshot()).encode('utf-8'))
+        elif path == '/api/neural':
+            mode = body.get('mode')
+            if mode in ("learn", "exploit", "steer"):
+                client.neural.mode = mode
+                client.log(f"NEURAL AUTOPILOT MODE: {mode.upper()}", "system")
+            else:
+                active = client.neural.toggle()
+                client.log(f"NEURAL AUTOPILOT {'ACTIVE' if active else 'DISENGAGED'}", "system")
+            res.update(success=True, autopilot=client.neural.stats())
+
+        self._send_json(res)
+
+    def _get(self):
+        path, query = self._route()
+        if path == '/metrics':
+            body = metrics.expose().encode('utf-8')
+            self.send_response(200); self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body))); self.end_headers()
+            self.wfile.write(body)
+        elif path == '/api/profile':
+            self._send_json(dict(profiler.report(), success=True))
+        elif path == '/api/profile/flame':
+            if not profiler.enabled:
+                self._send_json({"success": False, "error": "profiling is off; POST /api/profile or start with --profile"}, 409); return
+            try: seconds = max(0.1, min(float(query.get('seconds', 5)), 60.0))
+            except ValueError: seconds = 5.0
+            folded = profiler.capture(seconds)
+            if folded is None:
+                self._send_json({"success": False, "error": "a capture is already running"}, 409); return
+            body = folded.encode('utf-8')
+            self.send_response(200); self.send_header('Content-type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body))); self.end_headers()
+            self.wfile.write(body)
+        elif path == '/api/outbox':
+            client = fleet.resolve(query.get('agent'))
+            if client is None:
+                self._send_json({"success": False, "error": "unknown agent"}, 404); return
+            ids = [i for i in query.get('ids', '').split(',') if i]
+            try: k = max(1, min(int(query.get('k', 50)), OutboundQueue.HISTORY))
+            except ValueError: k = 50
+            self._send_json({"success": True, "messages": client.outbox.status(ids, k), "stats": client.outbox.stats()})
+        elif path == '/api/agents':
+            self._send_json({"agents": fleet.list_agents(), "fleet": fleet.stats()})
+        elif path.startswith('/api/map/'):
+            self._send_map_tile(path)
+        elif path == '/api/stats':
+            client = fleet.resolve(query.get('agent'))
+            if client is None:
+                self._send_json({"success": False, "error": "unknown agent"}, 404); return
+            try: points = max(0, min(int(query.get('points', 60)), SimStatsAggregator.WINDOW))
+            except ValueError: points = 60
+            series = client.sim_stats.series
+            self._send_json({"success": True, "agent": client.agent_key, "summary": client.sim_stats.summary(),
+                             "series": list(series[len(series) - points:]) if points else []})
+        elif path == '/api/messages':
+            client = fleet.resolve(query.get('agent'))
+            if client is None:
+                self._send_json({"success": False, "error": "unknown agent"}, 404); return
+            channel = query.get('channel', 'im')
+            if channel not in MessageLog.CHANNELS:
+                self._send_json({"success": False, "error": "unknown channel"}, 400); return
+            try: k = max(1, min(int(query.get('k', 50)), 500))
+            except ValueError: k = 50
+            self._send_json({"success": True, "messages": client.state.recent(k, channel, query.get('with'))})
+        elif path == '/api/history':
+            owner = fleet.resolve(query['agent']) if query.get('agent') else None
+            if owner: query['agent'] = owner.agent_key
+            try:
+                limit = max(1, min(int(query.get('limit', 50)), 500))
+                page = fleet.history.query(
+                    text=query.get('q'), sender=query.get('sender'), region=query.get('region'),
+                    msg_type=query.get('type'), agent=query.get('agent'), since=query.get('since') or None,
+                    until=query.get('until') or None, before=query.get('before') or None, limit=limit)
+            except (ValueError, sqlite3.Error) as e:
+                self._send_json({"success": False, "error": str(e)}, 400); return
+            self._send_json(dict(page, success=True))
+        elif path == '/api/nearby':
+            client = fleet.resolve(query.get('agent'))
+            if client is None:
+                self._send_json({"success": False, "error": "unknown agent"}, 404); return
+            try:
+                pos = client.state.pos
+                x, y, z = (float(query.get(a) or getattr(pos, a)) for a in ("x", "y", "z"))
+                radius = float(query['radius']) if query.get('radius') else None
+                k = int(query['k']) if query.get('k') else None
+            except ValueError as e:
+                self._send_json({"success": False, "error": str(e)}, 400); return
+            t0 = time.perf_counter()
+            hits = client.avatars.query(x, y, z, radius, k)
+            self._send_json({"success": True, "avatars": hits, "query_us": round((time.perf_counter() - t0) * 1e6, 1)})
+        elif path == '/api/events':
+            client = fleet.resolve(query.get('agent'))
+            if client is None:
+                self._send_json({"success": False, "error": "unknown agent"}, 404); return
+            self._stream_events(client, query)
+        elif path == '/api/fleet/login/events':
+            try: since = int(self.headers.get('Last-Event-ID') or query.get('since') or 0)
+            except ValueError: since = 0
+            found = fleet.subscribe_bulk(query.get('job', ''), since)
+            if found is None:
+                self._send_json({"success": False, "error": "unknown job"}, 404); return
+            self._stream(*found, since)
+        elif path == '/api/login/status':
+            job = fleet.job_status(query.get('job', ''))
+            if job is None:
+                self._send_json({"success": False, "error": "unknown job"}, 404); return
+            self._send_json(dict(job, success=True))
+        elif path == '/api/poll':
+            client = fleet.resolve(query.get('agent'))
+            if client is None:
+                self._send_json({"success": False, "error": "unknown agent"}, 404); return
+            state, cursor = client.state, query.get('cursor')
+            # Bodies are cached per (request cursor, state version); each carries its own cursor,
+            # so one built a moment after the key was read is still self-consistent
+            if cursor is None:
+                self._send_body(state.responses.get(("snapshot", state.cursor()), lambda: dumps(state.snapshot()))); return
+            def _encode():
+                delta = state.delta(cursor)
+                return f'"{delta["cursor"]}"', not delta["messages"] and len(delta) == 2, dumps(delta)
+            etag, unchanged, body = state.responses.get((cursor, state.cursor()), _encode)
+            if unchanged and self.headers.get('If-None-Match') == etag:
+                self.send_response(304); self.send_header('ETag', etag); self.end_headers(); return
+            self._send_body(body, headers=(('ETag', etag), ('Cache-Control', 'no-cache')))
+        elif path.startswith('/static/'):
+            asset = assets.lookup(path)
+            if asset is None:
+                self._send_json({"success": False, "error": "no such asset"}, 404); return
+            self._send_asset(asset)
         else:
-            self.send_response(200); self.send_header('Content-type', 'text/html'); self.end_headers()
-            self.wfile.write(HTML_TEMPLATE.encode('utf-8'))
-    
+            self._send_asset(assets.page())
+
+    def _send_map_tile(self, path):
+        m = re.fullmatch(r"/api/map/(\d+)/(\d+)\.jpg", path)
+        tile = fleet.tiles.lookup(int(m.group(1)), int(m.group(2))) if m else None
+        if tile is None:
+            self._send_json({"success": False, "error": "tile not cached"}, 404); return
+        data, etag = tile
+        etag = f'"{etag}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304); self.send_header('ETag', etag); self.end_headers(); return
+        self.send_response(200)
+        self.send_header('Content-type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'public, max-age=86400')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream_events(self, client, query):
+        """Server-Sent Events: blocks on the subscription, so an idle stream costs nothing."""
+        kinds = [k for k in query.get('types', '').split(',') if k] or None
+        try: since = int(self.headers.get('Last-Event-ID') or query.get('since') or 0)
+        except ValueError: since = 0
+        self._stream(client.state.events, client.state.subscribe(kinds, since), since)
+
+    def _stream(self, bus, sub, since):
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        last_seq = since
+        try:
+            self.wfile.write(b"retry: 2000\n\n"); self.wfile.flush()
+            while not sub.closed:
+                events = sub.drain(timeout=self.SSE_KEEPALIVE)
+                if not events:
+                    self.wfile.write(b": keepalive\n\n"); self.wfile.flush()
+                    continue
+                chunks = []
+                for kind, data in events:
+                    if kind == "message":
+                        if data.seq <= last_seq: continue
+                        last_seq = data.seq
+                        chunks.append(f"id: {last_seq}\n".encode())
+                        # A finished bulk login has nothing more to say
+                        if data.type == "done": sub.closed = True
+                    chunks.append(f"event: {kind}\ndata: ".encode() + dumps(data) + b"\n\n")
+                self.wfile.write(b"".join(chunks)); self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass
+        finally:
+            bus.unsubscribe(sub)
+
     def log_message(self, format, *args): return
 
 if __name__ == "__main__":
-    print("HYPER-CORE [DEEP-FIX V6] LOADED. PORT 8080")
-    HTTPServer(('0.0.0.0', 8080), WebHandler).serve_forever()
+    import argparse
+    parser = argparse.ArgumentParser(description="BlackGlass OS headless Second Life client")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--train", nargs="+", metavar="JSONL", help="fit the shared Q-table to recorded trajectories and exit")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--profile", action="store_true", help="watch loop threads for lag and stalls (also BLACKGLASS_PROFILE=1)")
+    parser.add_argument("--simulate", action="store_true", help="log agents into the offline simulator instead of the grid")
+    parser.add_argument("--bench-sim", type=int, metavar="STEPS", help="run the autopilot against the simulator and print a report")
+    parser.add_argument("--sim-avatars", type=int, default=12)
+    parser.add_argument("--bench-memory", type=int, metavar="BOTS", help="measure the per-bot memory footprint against simulators")
+    parser.add_argument("--sim-mode", choices=("learn", "exploit", "steer"), default="learn")
+    parser.add_argument("--fetch-vendor", action="store_true", help=f"download Three.js {AssetBundle.THREE_VERSION} into the static dir for offline consoles")
+    parser.add_argument("--roster", metavar="PATH", help="log in every account in a CSV/JSON roster at startup")
+    parser.add_argument("--login-concurrency", type=int, default=AgentFleet.BULK_CONCURRENCY)
+    parser.add_argument("--login-stagger", type=float, default=AgentFleet.BULK_STAGGER)
+    parser.add_argument("--data-dir", metavar="DIR", help=f"logs, chat history, map tiles and the Q-table (default {DATA_DIR}; "
+                        "a throwaway temp dir for --simulate and the benchmarks)")
+    parser.add_argument("--history", action="store_true", help="archive received chat and IMs to history.db in the data dir "
+                        "(also set by BLACKGLASS_HISTORY=<path>)")
+    parser.add_argument("--history-days", type=float, default=30.0, help="prune archived messages older than this; 0 keeps them all")
+    args = parser.parse_args()
+    history = args.history or bool(os.environ.get("BLACKGLASS_HISTORY"))
+
+    if args.fetch_vendor:
+        AssetBundle.fetch_vendor(STATIC_DIR)
+        sys.exit(0)
+
+    if args.data_dir or not (args.simulate or args.bench_sim or args.bench_memory):
+        open_data_dir(args.data_dir or DATA_DIR, history, args.history_days)
+    else:
+        # Simulated runs keep their files out of the real profile; removed at exit
+        scratch = tempfile.TemporaryDirectory(prefix="blackglass-sim-")
+        open_data_dir(scratch.name, history, args.history_days)
+
+    if args.bench_memory:
+        print(json.dumps(run_memory_benchmark(args.bench_memory, avatars=args.sim_avatars), indent=2))
+        sys.exit(0)
+
+    if args.bench_sim:
+        print(json.dumps(run_simulation(args.bench_sim, avatars=args.sim_avatars, mode=args.sim_mode), indent=2))
+        sys.exit(0)
+
+    if args.train:
+        n = train_offline(args.train, fleet.qtable, epochs=args.epochs)
+        print(f"Trained on {n} transitions -> {fleet.qtable.path or 'in-memory table'}")
+        sys.exit(0)
+
+    if args.profile or os.environ.get("BLACKGLASS_PROFILE"): profiler.start()
+    if args.simulate: fleet.hippo_factory = lambda: SimHippoClient(avatars=args.sim_avatars, login_delay=(0.2, 1.5))
+    if args.roster:
+        with open(args.roster) as f: roster = parse_roster(f.read())
+        job = fleet.start_bulk_login(roster, args.login_concurrency, args.login_stagger)
+        print(f"Bulk login {job['id']}: {job['total']} accounts, {args.login_concurrency} at a time")
+
+    assets.page()
+    print(f"HYPER-CORE [DEEP-FIX V6] LOADED. PORT {args.port}")
+    server = ThreadingHTTPServer(('0.0.0.0', args.port), WebHandler)
+    server.daemon_threads = True
+    server.serve_forever()
@@ -0,0 +1,490 @@
+import * as THREE from 'three';
+import { OrbitControls } from 'three/addons/controls/OrbitControls.js';
+import { VRButton } from 'three/addons/webxr/VRButton.js';
+
+const wm = {
+    zIndex: 100,
+    windows: document.querySelectorAll('.window'),
+    init() {
+        this.windows.forEach(win => {
+            this.makeDraggable(win);
+            win.addEventListener('mousedown', () => this.focus(win.id));
+            win.querySelector('.ctrl-close').onclick = () => this.close(win.id);
+            win.querySelector('.ctrl-min').onclick = () => this.minimize(win.id);
+        });
+    },
+    focus(id) {
+        const win = document.getElementById(id);
+        if(win.style.display === 'none' || win.style.display === '') {
+            win.style.display = 'flex';
+            setTimeout(() => win.classList.add('visible'), 10);
+        }
+        win.style.zIndex = ++this.zIndex;
+        document.getElementById('start-menu').style.display = 'none';
+        this.updateTaskbar(id);
+    },
+    updateTaskbar(winId) {
+        document.querySelectorAll('.task-item').forEach(t => t.classList.remove('active'));
+        const map = {'win-login':'task-auth','win-term':'task-term','win-comm':'task-comm','win-map':'task-map','win-radar':'task-radar','win-mon':'task-mon'};
+        const taskId = map[winId];
+        if(taskId) {
+            const taskEl = document.getElementById(taskId);
+            if(taskEl) taskEl.classList.add('active');
+        }
+    },
+    open(id) {
+        this.focus(id);
+        const taskID = id.replace('win-', 'task-');
+        const taskEl = document.getElementById(taskID);
+        if(taskEl) taskEl.style.display = 'block';
+    },
+    close(id) {
+        const win = document.getElementById(id);
+        win.classList.remove('visible');
+        setTimeout(() => win.style.display = 'none', 200);
+    },
+    minimize(id) { this.close(id); },
+    toggleStart() {
+        const menu = document.getElementById('start-menu');
+        menu.style.display = menu.style.display === 'block' ? 'none' : 'block';
+    },
+    makeDraggable(el) {
+        let pos1 = 0, pos2 = 0, pos3 = 0, pos4 = 0;
+        const header = el.querySelector('.window-header');
+        header.onmousedown = dragMouseDown;
+        function dragMouseDown(e) {
+            e = e || window.event;
+            e.preventDefault();
+            pos3 = e.clientX;
+            pos4 = e.clientY;
+            document.onmouseup = closeDragElement;
+            document.onmousemove = elementDrag;
+            wm.focus(el.id);
+        }
+        function elementDrag(e) {
+            e = e || window.event;
+            e.preventDefault();
+            pos1 = pos3 - e.clientX;
+            pos2 = pos4 - e.clientY;
+            pos3 = e.clientX;
+            pos4 = e.clientY;
+            el.style.top = (el.offsetTop - pos2) + "px";
+            el.style.left = (el.offsetLeft - pos1) + "px";
+        }
+        function closeDragElement() {
+            document.onmouseup = null;
+            document.onmousemove = null;
+        }
+    }
+};
+
+const app = {
+    agent: null,
+    cursor: null,
+    lastSeq: 0,
+    stream: null,
+    streaming: false,
+    nearby: new Map(),
+    controls: 0,
+    scene: null,
+    camera: null,
+    renderer: null,
+    mapPlane: null,
+    avatarMeshes: new Map(),
+    lastMapUrl: null,
+    mapTile: null,
+    raycaster: new THREE.Raycaster(),
+    mouse: new THREE.Vector2(),
+    neuralActive: false,
+
+    async login() {
+        const btn = document.getElementById('btn-login');
+        const stat = document.getElementById('login-status');
+        btn.disabled = true;
+        stat.innerText = "HANDSHAKING...";
+        stat.style.color = "#00d4ff";
+
+        const res = await fetch('/api/login', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                first: document.getElementById('inp-first').value,
+                last: document.getElementById('inp-last').value,
+                pass: document.getElementById('inp-pass').value,
+                start: document.getElementById('inp-loc').value
+            })
+        });
+        const data = await res.json();
+        if (data.agent && data.agent !== this.agent) {
+            this.agent = data.agent;
+            this.cursor = null;
+            this.lastSeq = 0;
+            this.mapTile = null;
+            this.connectStream();
+        }
+
+        // Login runs as a background job; poll it instead of holding the request open
+        let job = data;
+        while (job.success && (!job.status || job.status === 'pending')) {
+            await new Promise(r => setTimeout(r, 500));
+            try {
+                const jr = await fetch('/api/login/status?job=' + encodeURIComponent(data.job));
+                job = await jr.json();
+            } catch (e) { console.error(e); }
+        }
+
+        if(job.status === 'connected') {
+            stat.innerText = "UPLINK ESTABLISHED";
+            stat.style.color = "#00ff9d";
+            setTimeout(() => {
+                wm.close('win-login');
+                this.openSession();
+            }, 1000);
+        } else {
+            stat.innerText = job.status === 'timeout' ? "UPLINK TIMEOUT" : "ACCESS DENIED";
+            stat.style.color = "#ff4757";
+            btn.disabled = false;
+        }
+    },
+
+    openSession() {
+        ['win-comm', 'win-map', 'win-radar', 'win-mon'].forEach(id => wm.open(id));
+        setTimeout(() => this.initThree(), 100);
+    },
+
+    async sendChat() {
+        const input = document.getElementById('chat-input');
+        if(!input.value) return;
+        await fetch('/api/chat', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({agent: this.agent, msg: input.value})
+        });
+        input.value = "";
+    },
+
+    async teleportLocal(x, y, z) {
+        await fetch('/api/teleport', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({agent: this.agent, region: "local", x: x, y: y, z: z})
+        });
+        wm.open('win-comm');
+    },
+
+    setReply(id) {
+        const input = document.getElementById('chat-input');
+        input.value = "/im " + id + " ";
+        input.focus();
+    },
+
+    toggleNeural() {
+        this.neuralActive = !this.neuralActive;
+        fetch('/api/neural', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({agent: this.agent})
+        });
+        const btn = document.getElementById('btn-neural');
+        if(this.neuralActive) {
+            btn.innerText = "AI AUTOPILOT: ON";
+            btn.style.background = "#00ff9d";
+            btn.style.color = "#000";
+        } else {
+            btn.innerText = "AI AUTOPILOT: OFF";
+            btn.style.background = "";
+            btn.style.color = "";
+        }
+    },
+
+    initThree() {
+        if (this.renderer) return;
+        const container = document.getElementById('three-container');
+        const width = container.clientWidth || 600;
+        const height = container.clientHeight || 500;
+
+        this.scene = new THREE.Scene();
+        this.scene.background = new THREE.Color(0x111116);
+        this.scene.fog = new THREE.Fog(0x111116, 50, 200);
+
+        this.camera = new THREE.PerspectiveCamera(60, width / height, 0.1, 500);
+        this.camera.position.set(128, 100, 180);
+        this.camera.lookAt(128, 0, 128);
+
+        this.renderer = new THREE.WebGLRenderer({ antialias: true });
+        this.renderer.setSize(width, height);
+        this.renderer.xr.enabled = true;
+        container.appendChild(this.renderer.domElement);
+        container.appendChild(VRButton.createButton(this.renderer));
+
+        const controls = new OrbitControls(this.camera, this.renderer.domElement);
+        controls.target.set(128, 0, 128);
+        controls.update();
+
+        const ambientLight = new THREE.AmbientLight(0xffffff, 0.5);
+        this.scene.add(ambientLight);
+        const dirLight = new THREE.DirectionalLight(0xffffff, 0.8);
+        dirLight.position.set(0, 100, 50);
+        this.scene.add(dirLight);
+
+        const geometry = new THREE.PlaneGeometry(256, 256);
+        geometry.rotateX(-Math.PI / 2);
+        geometry.translate(128, 0, 128);
+
+        const material = new THREE.MeshStandardMaterial({
+            color: 0x444444,
+            roughness: 0.8,
+            metalness: 0.2
+        });
+        this.mapPlane = new THREE.Mesh(geometry, material);
+        this.scene.add(this.mapPlane);
+
+        const gridHelper = new THREE.GridHelper(256, 16, 0x00d4ff, 0x333333);
+        gridHelper.position.set(128, 0.1, 128);
+        this.scene.add(gridHelper);
+
+        this.renderer.domElement.addEventListener('click', (event) => {
+            const rect = this.renderer.domElement.getBoundingClientRect();
+            this.mouse.x = ((event.clientX - rect.left) / rect.width) * 2 - 1;
+            this.mouse.y = -((event.clientY - rect.top) / rect.height) * 2 + 1;
+
+            this.raycaster.setFromCamera(this.mouse, this.camera);
+            const intersects = this.raycaster.intersectObjects([this.mapPlane, ...this.avatarMeshes.values()]);
+
+            if (intersects.length > 0) {
+                const pt = intersects[0].point;
+                console.log("Teleporting to", pt);
+                this.teleportLocal(pt.x, pt.z, 25);
+            }
+        });
+
+        new ResizeObserver(() => {
+            const w = container.clientWidth;
+            const h = container.clientHeight;
+            if (w > 0 && h > 0) {
+                this.renderer.setSize(w, h);
+                this.camera.aspect = w / h;
+                this.camera.updateProjectionMatrix();
+            }
+        }).observe(container);
+
+        this.animateThree();
+        this.nearby.forEach(av => this.upsertAvatar(av));
+        this.updateMapTexture(this.mapTile);
+    },
+
+    updateMapTexture(tile) {
+        // Tiles that arrive before the scene exists are kept and applied by initThree
+        if (tile) this.mapTile = tile;
+        if (!this.scene || !tile || tile.url === this.lastMapUrl) return;
+        this.lastMapUrl = tile.url;
+
+        const image = new Image();
+        image.src = tile.url;
+        image.onload = () => {
+            const texture = new THREE.Texture(image);
+            texture.needsUpdate = true;
+            this.mapPlane.material.map = texture;
+            this.mapPlane.material.needsUpdate = true;
+            this.mapPlane.material.color.setHex(0xffffff);
+        };
+    },
+
+    upsertAvatar(av) {
+        this.nearby.set(av.id, av);
+        if (!this.scene) return;
+        let mesh = this.avatarMeshes.get(av.id);
+        if (!mesh) {
+            const geometry = new THREE.CapsuleGeometry(1, 2, 4, 8);
+            const material = new THREE.MeshStandardMaterial({ color: 0xff00ff, emissive: 0x440044 });
+            mesh = new THREE.Mesh(geometry, material);
+            this.scene.add(mesh);
+            this.avatarMeshes.set(av.id, mesh);
+        }
+        mesh.position.set(av.x, av.z/2 + 2, av.y);
+        mesh.userData = { id: av.id, name: av.name, x: av.x, y: av.y };
+    },
+
+    removeAvatar(id) {
+        this.nearby.delete(id);
+        const mesh = this.avatarMeshes.get(id);
+        if (!mesh) return;
+        this.scene.remove(mesh);
+        mesh.geometry.dispose();
+        mesh.material.dispose();
+        this.avatarMeshes.delete(id);
+    },
+
+    animateThree() {
+        this.renderer.setAnimationLoop(() => {
+            this.renderer.render(this.scene, this.camera);
+        });
+    },
+
+    drawRadar(avatars) {
+        const canvas = document.getElementById('radar-canvas');
+        const ctx = canvas.getContext('2d');
+        canvas.width = canvas.parentElement.clientWidth;
+        canvas.height = canvas.parentElement.clientHeight;
+        const cx = canvas.width / 2;
+        const cy = canvas.height / 2;
+
+        ctx.fillStyle = '#000';
+        ctx.fillRect(0,0, canvas.width, canvas.height);
+
+        ctx.strokeStyle = '#003300';
+        ctx.beginPath(); ctx.arc(cx, cy, 30, 0, 7); ctx.stroke();
+        ctx.beginPath(); ctx.arc(cx, cy, 60, 0, 7); ctx.stroke();
+        ctx.beginPath(); ctx.arc(cx, cy, 90, 0, 7); ctx.stroke();
+
+        ctx.fillStyle = '#00ff00';
+        ctx.beginPath(); ctx.arc(cx, cy, 3, 0, 7); ctx.fill();
+
+        avatars.forEach(av => {
+            const px = (av.x / 256) * canvas.width;
+            const py = ((256-av.y) / 256) * canvas.height;
+
+            ctx.fillStyle = '#ff00ff';
+            ctx.beginPath(); ctx.arc(px, py, 4, 0, 7); ctx.fill();
+        });
+    },
+
+    renderMessage(m) {
+        // At or below the watermark only lines a resync recovered are drawn
+        const recovered = m.seq <= this.lastSeq;
+        if (recovered && document.querySelector(`[data-seq="${m.seq}"]`)) return;
+        if (!recovered) this.lastSeq = m.seq;
+        if (['system', 'error', 'success'].includes(m.type)) {
+            const term = document.getElementById('term-log');
+            const div = document.createElement('div');
+            div.className = 'log-line';
+            if(m.type === 'error') div.className += ' log-err';
+            if(m.type === 'success') div.className += ' log-suc';
+            if(m.type === 'system') div.className += ' log-sys';
+            div.innerText = `[${m.time}] ${m.text}`;
+            this.placeLine(term, div, m.seq, recovered);
+        }
+        if (['chat', 'chat_own', 'im'].includes(m.type)) {
+            const chat = document.getElementById('chat-history');
+            const div = document.createElement('div');
+            div.className = `msg ${m.type}`;
+            let content = `[${m.time}] ${m.text}`;
+            if(m.type === 'im' && m.meta && m.meta.id) {
+                content += ` <span class="reply-link" onclick="app.setReply('${m.meta.id}')">[REPLY]</span>`;
+            }
+            div.innerHTML = content;
+            this.placeLine(chat, div, m.seq, recovered);
+        }
+    },
+
+    placeLine(box, div, seq, recovered) {
+        div.dataset.seq = seq;
+        // Recovered lines slot in by seq; live ones append
+        const next = recovered ? [...box.children].find(el => +el.dataset.seq > seq) : null;
+        box.insertBefore(div, next || null);
+        if (!next) box.scrollTop = box.scrollHeight;
+    },
+
+    applyNearby(nearby) {
+        // Full table: reconcile by id so existing meshes are kept, not rebuilt
+        const live = new Set(nearby.map(av => av.id));
+        [...this.nearby.keys()].forEach(id => { if (!live.has(id)) this.removeAvatar(id); });
+        nearby.forEach(av => this.upsertAvatar(av));
+        this.drawRadar([...this.nearby.values()]);
+    },
+
+    applyAvatarDelta(delta) {
+        delta.remove.forEach(id => this.removeAvatar(id));
+        delta.add.forEach(av => this.upsertAvatar(av));
+        delta.move.forEach(av => this.upsertAvatar(av));
+        this.drawRadar([...this.nearby.values()]);
+    },
+
+    applyRegion(region) {
+        if(region && region !== "Unknown") {
+            document.getElementById('map-info').innerText = "SECTOR: " + region;
+        }
+    },
+
+    applyPos(pos) {
+        document.getElementById('stat-pos').innerText = `<${pos.x.toFixed(0)}, ${pos.y.toFixed(0)}>`;
+    },
+
+    applyStats(stats) {
+        document.getElementById('stat-fps').innerText = stats.fps.toFixed(1);
+        document.getElementById('stat-dil').innerText = stats.dilation.toFixed(2);
+        this.applyPos(stats.pos);
+    },
+
+    connectStream() {
+        if (!window.EventSource || !this.agent) return;
+        if (this.stream) this.stream.close();
+        this.streaming = false;
+        const es = new EventSource('/api/events?agent=' + encodeURIComponent(this.agent) + '&since=' + this.lastSeq);
+        this.stream = es;
+        // EventSource reconnects on its own (resuming via Last-Event-ID); polling fills the gap
+        es.onopen = () => { this.streaming = true; };
+        // Polling resumes from the last event id, with every section in full so no stale delta applies
+        es.onerror = () => { if (this.streaming) this.cursor = String(this.lastSeq); this.streaming = false; };
+        const on = (kind, fn) => es.addEventListener(kind, e => {
+            try { fn(JSON.parse(e.data)); } catch (err) { console.error(err); }
+        });
+        on('message', m => this.renderMessage(m));
+        on('map', m => { if (m) this.updateMapTexture(m); });
+        on('nearby', n => this.applyNearby(n));
+        on('avatars', d => this.applyAvatarDelta(d));
+        on('region', r => this.applyRegion(r));
+        on('pos', p => this.applyPos(p));
+        on('stats', st => this.applyStats(st));
+        // Sent ahead of the lines that survived the overflow, so lastSeq is still the last contiguous seq
+        on('resync', () => { this.cursor = String(this.lastSeq); this.poll(); });
+    },
+
+    poll: async function() {
+        if (!this.agent) return;
+        try {
+            let url = '/api/poll?agent=' + encodeURIComponent(this.agent) + '&cursor=' + (this.cursor || '');
+            const headers = this.cursor ? {'If-None-Match': '"' + this.cursor + '"'} : {};
+            const res = await fetch(url, { headers, cache: 'no-store' });
+            if (res.status === 304) return;
+            const data = await res.json();
+            this.cursor = data.cursor;
+
+            data.messages.forEach(m => this.renderMessage(m));
+
+            // Only sections whose version moved are present in the delta
+            if (data.map) this.updateMapTexture(data.map);
+            if (data.nearby) this.applyNearby(data.nearby);
+            if (data.avatars) this.applyAvatarDelta(data.avatars);
+            if (data.region) this.applyRegion(data.region);
+            if (data.stats) this.applyStats(data.stats);
+
+        } catch (e) { console.error(e); }
+    }
+};
+
+window.onload = () => {
+    window.app = app;
+    window.wm = wm;
+
+    let lines = document.querySelectorAll('.boot-line');
+    let delay = 0;
+    lines.forEach((line) => {
+        setTimeout(() => line.style.opacity = 1, delay);
+        delay += (Math.random() * 500) + 200;
+    });
+    setTimeout(() => {
+        document.getElementById('boot-screen').style.display = 'none';
+        document.getElementById('desktop').style.display = 'block';
+        document.getElementById('taskbar').style.display = 'flex';
+        wm.init();
+        setTimeout(() => wm.focus('win-login'), 100);
+        setTimeout(() => wm.focus('win-term'), 300);
+
+        setInterval(() => {
+            document.getElementById('clock').innerText = new Date().toLocaleTimeString();
+        }, 1000);
+        // Polling only covers gaps while the push stream is down
+        setInterval(() => { if (!app.streaming) app.poll(); }, 500);
+    }, delay + 800);
+};
@@ -0,0 +1,42 @@
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BlackGlass as B
+
+B.log_sink.console = False
+
+
+@pytest.fixture
+def fleet():
+    fleet = B.AgentFleet(hippo_factory=lambda: B.SimHippoClient(avatars=4), history=B.HistoryStore(None),
+                         qtable=B.QTable(B.QLearningDrive.N_STATES, len(B.QLearningDrive.ACTIONS)))
+    yield fleet
+    for agent in fleet.list_agents(): fleet.remove(agent["key"])
+
+
+@pytest.fixture
+def server(fleet, monkeypatch):
+    """Base URL of a WebHandler serving `fleet` on an ephemeral port."""
+    monkeypatch.setattr(B, "fleet", fleet)
+    srv = B.ThreadingHTTPServer(("127.0.0.1", 0), B.WebHandler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+    srv.server_close()
+
+
+def request(url, data=None, **headers):
+    """(status, headers, body) without raising on HTTP errors."""
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data, headers=headers), timeout=30) as r:
+            return r.status, r.headers, r.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
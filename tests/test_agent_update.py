@@ -0,0 +1,34 @@
+import BlackGlass as B
+
+IDENTITY = (0.0, 0.0, 0.0, 1.0)
+CAMERA = (128.0, 128.0, 22.0)
+
+
+def test_every_control_change_is_sent_under_dilation():
+    sched = B.AgentUpdateScheduler()
+    sent = [sched.should_send(1 << (i % 2), IDENTITY, CAMERA, time_dilation=0.97, now=i * 0.2)
+            for i in range(100)]
+    assert all(sent)
+    assert sched.counters["sent"] == 100 and sched.counters["suppressed"] == 0
+
+
+def test_turns_are_sent_even_between_ticks():
+    sched = B.AgentUpdateScheduler()
+    assert sched.should_send(0, IDENTITY, CAMERA, now=0.0)
+    assert sched.should_send(0, (0.0, 0.0, 0.7071, 0.7071), CAMERA, time_dilation=0.5, now=0.05)
+
+
+def test_idle_keepalive_stretches_with_dilation():
+    sched = B.AgentUpdateScheduler()
+    assert sched.should_send(0, IDENTITY, CAMERA, now=0.0)
+    assert not sched.should_send(0, IDENTITY, CAMERA, time_dilation=0.5, now=2.0)
+    assert sched.should_send(0, IDENTITY, CAMERA, time_dilation=0.5, now=4.0)
+    assert sched.counters["keepalive"] == 1
+
+
+def test_camera_drift_is_rate_limited_with_jitter_slack():
+    sched = B.AgentUpdateScheduler()
+    assert sched.should_send(0, IDENTITY, (0.0, 0.0, 0.0), now=0.0)
+    assert not sched.should_send(0, IDENTITY, (1.0, 0.0, 0.0), now=0.1)
+    # A tick that lands a hair early still counts as due
+    assert sched.should_send(0, IDENTITY, (1.0, 0.0, 0.0), now=0.1999)
@@ -0,0 +1,46 @@
+import json
+
+import BlackGlass as B
+
+
+class Pos:
+    def __init__(self, x, y): self.x, self.y = x, y
+
+
+def make_drive(tmp_path=None):
+    state = B.SharedState()
+    state.sink = None
+    record = str(tmp_path / "run.jsonl") if tmp_path else None
+    drive = B.QLearningDrive(state, record_path=record, seed=1)
+    drive.toggle()
+    return drive
+
+
+def test_new_waypoint_reencodes_the_decision_state(monkeypatch):
+    drive = make_drive()
+    here = [Pos(95.0, 100.0)]
+    monkeypatch.setattr(B.QLearningDrive, "pos", property(lambda self: here[0]))
+    drive.target_pos = (101, 100)
+    drive.decide()
+    # Arrive at the waypoint: the next decide() records the terminal step and picks a new target
+    here[0] = Pos(100.5, 100.0)
+    learned = []
+    monkeypatch.setattr(drive, "learn", lambda s, a, r, s2, done: learned.append(done))
+    drive.decide()
+    assert learned == [True]
+    obs, s, _ = drive._prev
+    assert obs[3:] == drive.target_pos != (101, 100)
+    assert s == B.QLearningDrive.encode(100.5, 100.0, obs[2], drive.target_pos, 0.0, False)
+
+
+def test_trajectory_file_is_flushed_and_closed(tmp_path, monkeypatch):
+    drive = make_drive(tmp_path)
+    monkeypatch.setattr(B.QLearningDrive, "pos", property(lambda self: Pos(50.0, 50.0)))
+    for _ in range(3): drive.decide()
+    drive.toggle()
+    assert len((tmp_path / "run.jsonl").read_text().splitlines()) == 3
+    drive.close()
+    assert drive._record is None
+    drive.toggle(); drive.decide(); drive.close()
+    lines = (tmp_path / "run.jsonl").read_text().splitlines()
+    assert len(lines) == 4 and all("action" in json.loads(l) for l in lines)
@@ -0,0 +1,100 @@
+import json
+import time
+
+import pytest
+
+import BlackGlass as B
+from conftest import request
+
+
+def test_parse_roster_formats():
+    assert B.parse_roster("first,last,password,start\nJane,Doe,pw,home\n") == [("Jane", "Doe", "pw", "home")]
+    assert B.parse_roster("# bots\nJohn,Smith,secret\n\n") == [("John", "Smith", "secret", "last")]
+    assert B.parse_roster('[{"username": "Solo", "pass": "x"}]') == [("Solo", "Resident", "x", "last")]
+    assert B.parse_roster('[{"name": "Ann Lee", "password": 1}]') == [("Ann", "Lee", "1", "last")]
+    for bad in ('[{"first": "NoPassword"}]', '["not an object"]'):
+        with pytest.raises(ValueError): B.parse_roster(bad)
+
+
+class TrackedSim(B.SimHippoClient):
+    """Records when each login starts and how many are at the login server at once."""
+    starts, active, peak = [], 0, 0
+
+    async def login(self, *args, **kwargs):
+        cls = TrackedSim
+        cls.starts.append(time.monotonic())
+        cls.active += 1
+        cls.peak = max(cls.peak, cls.active)
+        try: await super().login(*args, **kwargs)
+        finally: cls.active -= 1
+
+
+@pytest.fixture
+def tracked(fleet):
+    TrackedSim.starts, TrackedSim.active, TrackedSim.peak = [], 0, 0
+    fleet.hippo_factory = lambda: TrackedSim(avatars=1, login_delay=(0.3, 0.3))
+    return TrackedSim
+
+
+def roster(n, prefix="Bot"):
+    return [(f"{prefix}{i}", "Resident", "pw", "last") for i in range(n)]
+
+
+def wait_done(fleet, job, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = fleet.job_status(job["id"])
+        if status["status"] == "done": return status
+        time.sleep(0.05)
+    raise AssertionError(f"bulk job still running: {status}")
+
+
+def test_concurrency_cap(fleet, tracked):
+    status = wait_done(fleet, fleet.start_bulk_login(roster(6), concurrency=2, stagger=0))
+    assert status["counts"]["connected"] == 6
+    assert tracked.peak == 2
+
+
+def test_stagger_spaces_login_starts(fleet, tracked):
+    wait_done(fleet, fleet.start_bulk_login(roster(4), concurrency=4, stagger=0.2, jitter=0))
+    gaps = [b - a for a, b in zip(tracked.starts, tracked.starts[1:])]
+    assert len(gaps) == 3 and min(gaps) >= 0.18
+
+
+def test_failed_logins_are_counted(fleet):
+    fleet.hippo_factory = lambda: B.SimHippoClient(avatars=1, login_delay=(0.05, 0.1), fail_rate=1.0)
+    status = wait_done(fleet, fleet.start_bulk_login(roster(3), concurrency=3, stagger=0))
+    assert status["counts"]["failed"] == 3 and status["counts"]["connected"] == 0
+    assert all(a["error"] for a in status["accounts"].values())
+
+
+def test_connected_sessions_are_reused_and_duplicates_skipped(fleet, tracked):
+    assert fleet._start_login("Bot0", "Resident", "pw", "last")[1].result(10)
+    status = wait_done(fleet, fleet.start_bulk_login(roster(2) + roster(1), concurrency=2, stagger=0))
+    assert status["total"] == 2
+    assert status["accounts"]["bot0.resident"]["status"] == "reused"
+    assert status["accounts"]["bot1.resident"]["status"] == "connected"
+    assert len(tracked.starts) == 2
+
+
+def test_bulk_login_over_http_streams_progress(server, fleet, tracked):
+    body = json.dumps({"csv": "A,One,pw\nB,Two,pw\nC,Three,pw", "concurrency": 2, "stagger": 0}).encode()
+    status, _, raw = request(f"{server}/api/fleet/login", body, **{"Content-Type": "application/json"})
+    job = json.loads(raw)
+    assert status == 200 and job["success"] and job["total"] == 3
+
+    status, headers, raw = request(f"{server}/api/fleet/login/events?job={job['job']}")
+    assert status == 200 and headers["Content-Type"] == "text/event-stream"
+    events = [json.loads(line[6:]) for line in raw.decode().splitlines() if line.startswith("data: ")]
+    assert events[-1]["type"] == "done" and events[-1]["meta"]["counts"]["connected"] == 3
+    assert sorted(e["meta"]["agent"] for e in events if e["meta"].get("status") == "connected") == \
+        ["a.one", "b.two", "c.three"]
+    # Reconnecting with Last-Event-ID replays only what came after it
+    _, _, raw = request(f"{server}/api/fleet/login/events?job={job['job']}", **{"Last-Event-ID": str(events[-2]["seq"])})
+    assert [json.loads(l[6:])["type"] for l in raw.decode().splitlines() if l.startswith("data: ")] == ["done"]
+
+
+def test_bad_roster_and_unknown_job(server):
+    status, _, raw = request(f"{server}/api/fleet/login", b'{"roster": []}', **{"Content-Type": "application/json"})
+    assert status == 400 and not json.loads(raw)["success"]
+    assert request(f"{server}/api/fleet/login/events?job=nope")[0] == 404
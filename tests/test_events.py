@@ -0,0 +1,30 @@
+import BlackGlass as B
+
+
+def av(av_id, x=10.0):
+    return B.AvatarSample(av_id, av_id, x, 20.0, 30.0, 0.0)
+
+
+def delta(add=(), move=(), remove=()):
+    return {"add": list(add), "move": list(move), "remove": list(remove)}
+
+
+def test_subscription_overflow_drops_oldest_and_resyncs():
+    state = B.SharedState()
+    sub = state.events.subscribe(max_messages=3)
+    for i in range(5): state.log(f"m{i}")
+    events = sub.drain(timeout=0)
+    assert events[0] == ("resync", {"reason": "lagged"})
+    assert [data.text for kind, data in events[1:]] == ["m2", "m3", "m4"]
+    assert not sub.lagged
+    # Recovery polls from the last seq the consumer saw before the gap
+    assert [m.text for m in state.delta("0")["messages"]] == ["m0", "m1", "m2", "m3", "m4"]
+
+
+def test_subscription_coalesces_sections_and_folds_avatar_deltas():
+    sub = B.EventSubscription()
+    sub.offer("region", "A")
+    sub.offer("region", "B")
+    sub.offer("avatars", delta(add=[av("a")]))
+    sub.offer("avatars", delta(remove=["a"]))
+    assert sub.drain(timeout=0) == [("region", "B"), ("avatars", delta())]
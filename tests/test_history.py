@@ -0,0 +1,24 @@
+import sqlite3
+import time
+
+import BlackGlass as B
+
+
+def test_idle_archive_still_prunes(tmp_path):
+    store = B.HistoryStore(None)
+    store.PRUNE_INTERVAL = 0.1
+    store.open(str(tmp_path / "history.db"), retention_days=1)
+    try:
+        db = sqlite3.connect(store.path)
+        # No new rows reach the writer, so only the prune timer can wake it for the later ones
+        for _ in range(3):
+            db.execute("INSERT INTO messages (ts, type, text) VALUES (?, 'chat', 'stale')", (time.time() - 2 * 86400,))
+            db.commit()
+            time.sleep(0.3)
+        deadline = time.monotonic() + 5
+        while store.pruned < 3 and time.monotonic() < deadline: time.sleep(0.05)
+        assert store.pruned == 3
+        assert db.execute("SELECT COUNT(*) FROM messages").fetchone() == (0,)
+        db.close()
+    finally:
+        store.close()
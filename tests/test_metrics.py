@@ -0,0 +1,35 @@
+import BlackGlass as B
+
+
+class Packet:
+    def __init__(self, name): self.name = name
+
+
+def _expose(fam):
+    out = []
+    fam.expose(out)
+    return out
+
+
+def test_packet_counts_are_exported_at_scrape_time(fleet):
+    agent = fleet.get_or_create("A", "B")
+    clock = [0.0]
+    agent.sim_stats.clock = lambda: clock[0]
+    for name in ("ChatFromSimulator", "ChatFromSimulator", "KillObject"): agent._on_packet(Packet(name))
+    agent.sim_stats.roll()
+    clock[0] = 1.0
+    agent._on_packet(Packet("KillObject"))
+    agent.sim_stats.roll()
+
+    text = "\n".join(fam_line for fam in fleet.collect_metrics() for fam_line in _expose(fam))
+    assert 'blackglass_packets_received_total{agent="a.b",message="ChatFromSimulator"} 2' in text
+    assert 'blackglass_packets_received_total{agent="a.b",message="KillObject"} 2' in text
+
+
+def test_handler_timing_is_sampled(fleet, monkeypatch):
+    agent = fleet.get_or_create("C", "D")
+    seen = []
+    monkeypatch.setattr(B.HANDLER_SECONDS, "observe", lambda value, labels: seen.append(labels))
+    wrapped = agent._instrument("chat", lambda msg: None)
+    for _ in range(3 * B.HippoSLClient.HANDLER_SAMPLE): wrapped(None)
+    assert seen == [("c.d", "chat")] * 3
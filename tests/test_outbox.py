@@ -0,0 +1,84 @@
+import pytest
+
+import BlackGlass as B
+
+
+def test_token_bucket_allows_burst_then_paces():
+    bucket = B.TokenBucket(rate=2.0, burst=3)
+    for _ in range(3):
+        assert bucket.wait(0.0) == 0.0
+        bucket.take()
+    assert bucket.wait(0.0) == pytest.approx(0.5)
+    assert bucket.wait(0.25) == pytest.approx(0.25)
+    assert bucket.wait(0.5) == 0.0
+    bucket.take()
+    # Idle time refills no further than the burst
+    assert bucket.wait(100.0) == 0.0 and bucket.tokens == 3
+
+
+class Clock:
+    def __init__(self): self.now = 0.0
+    def __call__(self): return self.now
+
+
+def make_queue(ready=lambda: True):
+    clock, sent = Clock(), []
+    return B.OutboundQueue(lambda rec: sent.append(rec["text"]), ready, clock=clock), clock, sent
+
+
+def test_outbound_queue_paces_lanes_and_prefers_im():
+    q, clock, sent = make_queue()
+    q.enqueue("chat", [(f"c{i}", {}) for i in range(6)])
+    q.enqueue("im", [(f"i{i}", {}) for i in range(6)])
+    delay = q._pump()
+    # The shared circuit burst goes to the IM lane first; chat only gets what is left
+    assert sent == ["i0", "i1", "i2", "i3", "i4", "c0"]
+    assert delay == pytest.approx(1 / B.OutboundQueue.CIRCUIT_RATE[0])
+
+    clock.now += delay
+    q._pump()
+    assert len(sent) == 7
+    assert q.stats()["im_depth"] + q.stats()["chat_depth"] == 5
+    assert q.stats()["sent"] == 7
+
+
+def test_outbound_queue_holds_while_not_ready_and_records_failures():
+    ready = [False]
+    q, clock, sent = make_queue(lambda: ready[0])
+    q.deliver = lambda rec: (_ for _ in ()).throw(RuntimeError("no circuit"))
+    [rec] = q.enqueue("chat", [("hello", {})])
+    assert q._pump() is None and q.status([rec["id"]])[0]["status"] == "queued"
+    ready[0] = True
+    q._pump()
+    status = q.status([rec["id"]])[0]
+    assert status["status"] == "failed" and status["error"] == "no circuit"
+
+
+def test_outbound_queue_rejects_when_full(monkeypatch):
+    monkeypatch.setattr(B.OutboundQueue, "MAX_QUEUED", 2)
+    q, _, _ = make_queue()
+    out = q.enqueue("im", [(str(i), {}) for i in range(3)])
+    assert [r["status"] for r in out] == ["queued", "queued", "failed"]
+    assert out[-1]["error"] == "queue full"
+
+
+def test_outbound_queue_settles_on_the_ack():
+    q, _, _ = make_queue()
+    acks = []
+    q.deliver = lambda rec: acks.append(B.Future()) or acks[-1]
+    ok, lost, dropped = q.enqueue("im", [("ok", {}), ("lost", {}), ("dropped", {})])
+    q._pump()
+    status = lambda rec: q.status([rec["id"]])[0]
+    assert [status(r)["status"] for r in (ok, lost, dropped)] == ["sending"] * 3
+    assert q.stats()["sending"] == 3 and q.stats()["sent"] == 0
+
+    acks[0].set_result(None)
+    acks[1].set_exception(TimeoutError("Exceeded resend limit"))
+    assert status(ok)["status"] == "sent"
+    assert status(lost)["status"] == "failed" and status(lost)["error"] == "Exceeded resend limit"
+
+    # The circuit went away before the last ack; a late ack changes nothing
+    q.stop()
+    acks[2].set_result(None)
+    assert status(dropped)["status"] == "failed" and status(dropped)["error"] == "circuit lost"
+    assert q.stats()["sending"] == 0 and q.stats()["sent"] == 1
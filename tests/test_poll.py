@@ -0,0 +1,81 @@
+import json
+
+import BlackGlass as B
+from conftest import request
+
+
+def av(av_id, x=10.0):
+    return B.AvatarSample(av_id, av_id, x, 20.0, 30.0, 0.0)
+
+
+def delta(add=(), move=(), remove=()):
+    return {"add": list(add), "move": list(move), "remove": list(remove)}
+
+
+def test_delta_sends_only_what_moved():
+    state = B.SharedState()
+    state.log("one")
+    first = state.delta(None)
+    assert [m.text for m in first["messages"]] == ["one"]
+    assert set(first) == {"messages", "cursor", *B.SharedState.SECTIONS}
+
+    state.log("two")
+    state.update_region("Sandbox")
+    second = state.delta(first["cursor"])
+    assert [m.text for m in second["messages"]] == ["two"]
+    assert set(second) == {"messages", "cursor", "region"}
+    assert state.delta(second["cursor"]) == {"messages": [], "cursor": second["cursor"]}
+
+
+def test_nearby_moves_as_merged_avatar_delta():
+    state = B.SharedState()
+    state.update_avatars(delta(add=[av("a")]), [av("a")])
+    cursor = state.delta(None)["cursor"]
+    state.update_avatars(delta(add=[av("b")]), [av("a"), av("b")])
+    state.update_avatars(delta(remove=["b"], move=[av("a", 11.0)]), [av("a", 11.0)])
+    out = state.delta(cursor)
+    assert "nearby" not in out
+    assert out["avatars"] == {"add": [], "move": [av("a", 11.0)], "remove": []}
+
+
+def test_bare_seq_cursor_resends_every_section():
+    state = B.SharedState()
+    for text in ("a", "b", "c"): state.log(text)
+    state.update_avatars(delta(add=[av("a")]), [av("a")])
+    out = state.delta("2")
+    assert [m.seq for m in out["messages"]] == [3]
+    assert out["nearby"] == (av("a"),) and "avatars" not in out
+    assert out["cursor"].split(".")[0] == "3"
+
+
+def test_unknown_or_future_cursor_resyncs_from_scratch():
+    state = B.SharedState()
+    state.log("a")
+    for cursor in ("junk", "99.0.0.0.0"):
+        out = state.delta(cursor)
+        assert [m.text for m in out["messages"]] == ["a"]
+        assert set(B.SharedState.SECTIONS) <= set(out)
+
+
+def test_poll_cursor_delta_and_304(server, fleet):
+    state = fleet.get_or_create("A", "B").state
+    state.log("hello")
+    status, headers, body = request(f"{server}/api/poll?agent=a.b&cursor=")
+    assert status == 200
+    first = json.loads(body)
+    assert [m["text"] for m in first["messages"]] == ["hello"]
+
+    poll = f"{server}/api/poll?agent=a.b&cursor={first['cursor']}"
+    status, headers, body = request(poll)
+    assert status == 200 and json.loads(body) == {"messages": [], "cursor": first["cursor"]}
+    etag = headers["ETag"]
+    assert request(poll, **{"If-None-Match": etag})[0] == 304
+
+    state.update_region("Sandbox")
+    status, headers, body = request(poll, **{"If-None-Match": etag})
+    assert status == 200
+    assert json.loads(body)["region"] == "Sandbox" and headers["ETag"] != etag
+
+
+def test_unknown_agent_is_404(server):
+    assert request(f"{server}/api/poll?agent=nobody")[0] == 404
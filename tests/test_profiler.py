@@ -0,0 +1,35 @@
+import asyncio
+import threading
+import time
+
+import BlackGlass as B
+
+
+def test_restart_leaves_one_heartbeat_and_one_sampler():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    profiler = B.LoopProfiler(threshold=10.0)
+    profiler.watch("test-loop", loop, thread.ident)
+
+    async def heartbeats():
+        return sum(t.get_coro().__name__ == "_heartbeat" for t in asyncio.all_tasks())
+
+    try:
+        for _ in range(3):
+            profiler.start()
+            profiler.stop()
+            profiler.start()
+        time.sleep(0.1)
+        assert asyncio.run_coroutine_threadsafe(heartbeats(), loop).result(1) == 1
+        assert sum(t.name == "loop-profiler" for t in threading.enumerate()) == 1
+        assert profiler.report()["loops"]["test-loop"]["lag_ms"] is not None
+
+        profiler.stop()
+        time.sleep(0.05)
+        assert asyncio.run_coroutine_threadsafe(heartbeats(), loop).result(1) == 0
+        assert not any(t.name == "loop-profiler" for t in threading.enumerate())
+    finally:
+        profiler.stop()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(1)
@@ -0,0 +1,100 @@
+import re
+import time
+
+import pytest
+
+import BlackGlass as B
+
+
+def wait_for(pred, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if pred(): return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def fast_supervisor(monkeypatch):
+    monkeypatch.setattr(B.HippoSLClient, "SILENCE_TIMEOUT", 0.5)
+    monkeypatch.setattr(B.HippoSLClient, "RECONNECT_BASE", 0.1)
+
+
+def login(fleet, factory):
+    fleet.hippo_factory = factory
+    job, fut = fleet._start_login("A", "B", "x", "Sandbox/100/120/30")
+    assert fut.result(10)
+    return fleet.resolve("a.b")
+
+
+def test_silent_circuit_reconnects_with_backoff(fleet, fast_supervisor):
+    made = []
+    def factory():
+        # Reconnect attempts 1 and 2 fail at the login server
+        made.append(B.SimHippoClient(avatars=2, fail_rate=1.0 if len(made) in (1, 2) else 0.0))
+        return made[-1]
+    agent = login(fleet, factory)
+    agent._loop.call_soon_threadsafe(setattr, made[0], "position", B.Vector3(50.0, 60.0, 22.0))
+    assert wait_for(lambda: (agent.state.pos.x, agent.state.pos.y) == (50.0, 60.0))
+    agent._loop.call_soon_threadsafe(made[0].drop_circuit)
+
+    assert wait_for(lambda: agent.session_stats["reconnects"] == 1)
+    stats = agent.session_stats
+    assert stats["state"] == "online" and stats["last_loss"] == "silence"
+    assert stats["losses"] == 1 and stats["attempts"] == 3 and len(made) == 4
+    assert agent.state.connected and agent._hippo is made[-1]
+    # The failed clients were torn down, not left holding circuits
+    assert all(h.main_circuit is None for h in made[:-1])
+
+    texts = [m.text for m in agent.state.snapshot()["messages"]]
+    delays = [float(d) for d in re.findall(r"Reconnecting in ([\d.]+)s", " ".join(texts))]
+    assert len(delays) == 3
+    for attempt, delay in enumerate(delays):
+        cap = B.HippoSLClient.RECONNECT_BASE * 2 ** attempt
+        assert cap / 2 - 0.05 <= delay <= cap + 0.05
+    # Resumed where it was lost rather than at the original start location
+    assert (made[-1].position.X, made[-1].position.Y) == (50, 60)
+
+
+def test_kick_is_detected_and_restored(fleet, fast_supervisor):
+    made = []
+    agent = login(fleet, lambda: made.append(B.SimHippoClient(avatars=2)) or made[-1])
+    agent._loop.call_soon_threadsafe(made[0].drop_circuit, "sim restarting")
+    assert wait_for(lambda: agent.session_stats["reconnects"] == 1)
+    assert agent.session_stats["last_loss"] != "silence"
+
+
+def test_logout_during_backoff_stops_the_supervisor(fleet, monkeypatch, fast_supervisor):
+    monkeypatch.setattr(B.HippoSLClient, "RECONNECT_BASE", 1.0)
+    made = []
+    agent = login(fleet, lambda: made.append(B.SimHippoClient(avatars=2)) or made[-1])
+    agent._loop.call_soon_threadsafe(made[0].drop_circuit)
+    assert wait_for(lambda: agent.session_stats["state"] == "reconnecting")
+    agent.logout()
+    time.sleep(1.5)
+    assert len(made) == 1 and not agent.state.connected
+
+
+def test_relogin_closes_the_previous_client(fleet):
+    made = []
+    agent = login(fleet, lambda: made.append(B.SimHippoClient(avatars=2)) or made[-1])
+    assert fleet._start_login("A", "B", "x", "last")[1].result(10)
+    assert wait_for(lambda: made[0].main_circuit is None)
+    assert agent._hippo is made[1] and made[1].main_circuit is not None
+
+
+def test_retired_login_never_touches_the_newer_client(fleet):
+    made = []
+    def factory():
+        # The first login is still at the login server when the second one starts
+        made.append(B.SimHippoClient(avatars=2, login_delay=(0.5, 0.5) if not made else None))
+        return made[-1]
+    fleet.hippo_factory = factory
+    first = fleet._start_login("A", "B", "x", "last")[1]
+    assert wait_for(lambda: len(made) == 1)
+    second = fleet._start_login("A", "B", "x", "last")[1]
+    assert second.result(10) and not first.result(10)
+    agent = fleet.resolve("a.b")
+    time.sleep(0.5)
+    assert agent._hippo is made[1] and made[1].main_circuit is not None and agent.state.connected
+    assert made[0].main_circuit is None
@@ -0,0 +1,8 @@
+from conftest import request
+
+
+def test_snapshot_bodies_are_shared(server, fleet):
+    state = fleet.get_or_create("A", "B").state
+    bodies = {request(f"{server}/api/poll?agent=a.b")[2] for _ in range(5)}
+    assert len(bodies) == 1
+    assert state.responses.stats()["misses"] == 1
@@ -0,0 +1,31 @@
+import random
+
+import BlackGlass as B
+
+
+def brute(points, x, y, z, k, radius=None):
+    out = sorted((((px - x) ** 2 + (py - y) ** 2 + (pz - z) ** 2) ** 0.5, key)
+                 for key, (px, py, pz) in points.items())
+    if radius is not None: out = [o for o in out if o[0] <= radius]
+    return out[:k]
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(7)
+    grid, points = B.SpatialGrid(), {}
+    for i in range(400):
+        points[f"a{i:03}"] = (rng.uniform(0, 256), rng.uniform(0, 256), rng.uniform(20, 40))
+        grid.update(f"a{i:03}", *points[f"a{i:03}"])
+    for _ in range(200):
+        x, y, z = rng.uniform(-10, 266), rng.uniform(-10, 266), rng.choice([30.0, 400.0, 4000.0])
+        k, radius = rng.randint(1, 12), rng.choice([None, 20.0, 500.0])
+        assert grid.nearest(x, y, z, k, radius) == brute(points, x, y, z, k, radius)
+
+
+def test_high_query_stops_early():
+    grid, scanned = B.SpatialGrid(), []
+    for i in range(400): grid.update(i, (i * 37) % 256, (i * 91) % 256, 25.0)
+    scan = grid._scan
+    grid._scan = lambda *a: scanned.append(len(a[3])) or scan(*a)
+    assert len(grid.nearest(128, 128, 3000.0, 5)) == 5
+    assert len(scanned) < grid.max_cell
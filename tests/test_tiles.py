@@ -0,0 +1,109 @@
+import asyncio
+import os
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+import BlackGlass as B
+
+
+def tile(n, size=2000):
+    return bytes([n % 256]) * size
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = B.TileCache(memory_budget=5000)
+    for n in (1, 2): cache.store(1000, n, "objects", tile(n))
+    assert cache.lookup(1000, 1) is not None    # touch 1, so 2 is the oldest
+    cache.store(1000, 3, "objects", tile(3))
+    assert cache.lookup(1000, 2) is None
+    assert cache.lookup(1000, 1)[0] == tile(1)
+    assert cache.stats()["memory_bytes"] <= 5000
+
+
+def test_disk_tier_evicts_past_budget_and_survives_restart(tmp_path):
+    cache = B.TileCache(cache_dir=str(tmp_path), disk_budget=5000, memory_budget=1)
+    for n in (1, 2, 3): cache.store(1000, n, "objects", tile(n))
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["disk_tiles"] == 2 and stats["disk_bytes"] <= 5000
+
+    reopened = B.TileCache(cache_dir=str(tmp_path), disk_budget=5000)
+    assert reopened.lookup(1000, 1) is None
+    assert reopened.lookup(1000, 3)[0] == tile(3)
+    blobs = [f for _, _, files in os.walk(tmp_path / "blobs") for f in files]
+    assert len(blobs) == 2
+
+
+def test_identical_tiles_share_one_blob(tmp_path):
+    cache = B.TileCache(cache_dir=str(tmp_path))
+    cache.store(1000, 1, "objects", tile(7))
+    cache.store(1000, 2, "objects", tile(7))
+    assert cache.stats()["disk_bytes"] == len(tile(7))
+
+
+def test_memory_only_tiles_expire():
+    cache = B.TileCache(ttl=60)
+    cache.store(1000, 1, "objects", tile(1))
+    assert cache.probe(1000, 1)[1] is False
+    cache.memory[(1000, 1, "objects")] = (tile(1), 0.0)
+    assert cache.probe(1000, 1)[1] is True
+    assert cache.lookup(1000, 1)[0] == tile(1)     # stale still beats nothing
+
+
+async def stub_tile_server(routes):
+    """Local stand-in for the map server: `routes` maps gx-gy-layer to bytes or an HTTP status."""
+    hits = []
+
+    async def serve(request):
+        key = request.match_info["key"]
+        hits.append(key)
+        body = routes.get(key, 404)
+        if isinstance(body, int): return web.Response(status=body)
+        return web.Response(body=body, content_type="image/jpeg")
+
+    app = web.Application()
+    app.router.add_get("/map-1-{key}.jpg", serve)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}", hits
+
+
+def test_fetcher_against_stub_server():
+    async def run():
+        runner, url, hits = await stub_tile_server({"1000-1-objects": tile(1), "1000-3-objects": 500})
+        cache = B.TileCache(base_url=url)
+        fetcher = B.MapFetcher(cache, retries=1, backoff=0)
+        fetcher.hold()
+        try:
+            # Miss, then a memory hit that never reaches the server
+            key = await fetcher.fetch(1000, 1)
+            assert key["etag"] and hits == ["1000-1-objects"]
+            assert await fetcher.fetch(1000, 1) == key and len(hits) == 1
+
+            # Expired: downloaded again
+            cache.ttl = -1
+            assert await fetcher.fetch(1000, 1) == key and len(hits) == 2
+            cache.ttl = 3600
+
+            # Void region: every layer 404s, and the miss is remembered
+            hits.clear()
+            assert await fetcher.fetch(1000, 2) is None
+            assert hits == ["1000-2-objects", "1000-2-base"]
+            assert await fetcher.fetch(1000, 2) is None and len(hits) == 2
+
+            # Server error: retried, then surfaced
+            hits.clear()
+            with pytest.raises(aiohttp.ClientResponseError):
+                await fetcher.fetch(1000, 3)
+            assert len(hits) == 2
+            assert fetcher.stats()["retries"] == 1 and fetcher.stats()["failures"] == 1
+        finally:
+            await fetcher.release()
+            await runner.cleanup()
+        assert not fetcher._pools
+
+    asyncio.run(run())